@@ -1,13 +1,60 @@
 import fiftyone as fo
 import fiftyone.operators as foo
 from fiftyone.operators import types
+from fiftyone.operators.store import ExecutionStore
 from fiftyone.brain import Similarity
+from fiftyone import ViewField as F
 import time
 import requests
+import contextlib
 import glob
+import hashlib
+import itertools
 from pprint import pprint
 import os
-from twelvelabs import TwelveLabs
+import re
+import tempfile
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import numpy as np
+
+from .ann import IVFPQIndex, load_index
+from .brain import (
+    TwelveLabsModel,
+    TwelveLabsModelConfig,
+    is_twelve_labs_index,
+    load_similarity_index,
+    update_similarity_index,
+)
+from .cache import EmbeddingCache, QueryEmbeddingCache, TTLCache
+from .chunks import MAX_VIDEO_DURATION, extract_chunk, plan_chunks, stitch_segments
+from .graph import KNNGraph, cluster_pairs
+from .metrics import Metrics
+from .proxies import PROXY_MAX_SIZE, UploadProxies
+from .quantize import quantize
+from .scheduler import get_client
+from .search import (
+    MultimodalIndex,
+    bump_index_version,
+    load_segment_index,
+    pool_embeddings,
+    pool_modalities,
+    reciprocal_rank_fusion,
+)
+from .shards import ShardedRun, select_shard
+from .store import SegmentStore
+from .tasks import TaskTracker, make_progress_callback
+from .utils import BatchedWriter
+
+_MARENGO_MODEL = "Marengo-retrieval-2.7"
+_EMBEDDINGS_FIELD = "Twelve Labs Marengo-retrieval-27"
+_EMBEDDING_OPTIONS = ["visual-text", "audio"]
+_MODALITY_OPTIONS = {"visual": "visual-text", "audio": "audio"}
+_BRAIN_KEY = "twelve_labs_similarity"
+
+# Segments are added to the approximate index this many at a time
+_ANN_BATCH_SIZE = 2**16
 
 
 class CreateTwelveLabsEmbeddings(foo.Operator):
@@ -42,7 +89,7 @@ class CreateTwelveLabsEmbeddings(foo.Operator):
             "header",
             types.Header(
                 label="Select modalities for embedding generation",
-                description="Select one or more from the below to extract embeddings from your videos",
+                description="Select one or more from the below to extract embeddings from your videos. If none are selected, all are extracted",
                 divider=True,
             ),
         )
@@ -59,6 +106,86 @@ class CreateTwelveLabsEmbeddings(foo.Operator):
             view=types.CheckboxView(),
         )
 
+        inputs.int(
+            "max_concurrent_tasks",
+            default=4,
+            required=True,
+            label="Max concurrent tasks",
+            description="The maximum number of videos to embed in parallel",
+        )
+        storage_choices = types.RadioGroup(orientation="horizontal")
+        storage_choices.add_choice(
+            "SAMPLE",
+            label="Sample field",
+            description="Store embeddings on the temporal detections",
+        )
+        storage_choices.add_choice(
+            "DISK",
+            label="On-disk store",
+            description="Store embeddings in memory-mapped shard files and keep only a pointer on the temporal detections",
+        )
+        inputs.enum(
+            "embedding_storage",
+            storage_choices.values(),
+            default="SAMPLE",
+            required=True,
+            label="Embedding storage",
+            view=storage_choices,
+        )
+        if ctx.params.get("embedding_storage", "SAMPLE") == "DISK":
+            inputs.bool(
+                "compact_store",
+                default=False,
+                label="Compact on-disk store",
+                description="After embedding, drop the rows of the on-disk store that no temporal detection references anymore. Do not run while other ingests or searches of this dataset are in progress",
+                view=types.CheckboxView(),
+            )
+        precision_choices = types.RadioGroup(orientation="horizontal")
+        precision_choices.add_choice(
+            "FLOAT32",
+            label="Full",
+            description="Store full precision embeddings on the temporal detections",
+        )
+        precision_choices.add_choice(
+            "FLOAT16",
+            label="Float16",
+            description="Store float16 embeddings on the temporal detections, half the size of float32",
+        )
+        precision_choices.add_choice(
+            "INT8",
+            label="Int8",
+            description="Store int8 embeddings with a per-vector scale on the temporal detections, a quarter the size of float32",
+        )
+        inputs.enum(
+            "embedding_precision",
+            precision_choices.values(),
+            default="FLOAT32",
+            required=True,
+            label="Embedding precision",
+            description="With the on-disk store, compact embeddings are also kept on the temporal detections so that search can re-rank them at full precision",
+            view=precision_choices,
+        )
+        inputs.bool(
+            "use_cache",
+            default=True,
+            label="Use embedding cache",
+            description="Reuse cached embeddings for videos whose contents have not changed",
+            view=types.CheckboxView(),
+        )
+        inputs.bool(
+            "split_long_videos",
+            default=False,
+            label="Split long videos",
+            description="Embed videos longer than 2 hours in overlapping chunks rather than skipping them. Requires ffmpeg",
+            view=types.CheckboxView(),
+        )
+
+        _upload_proxies(ctx, inputs)
+        _similarity_index(ctx, inputs)
+        _metadata_workers(ctx, inputs)
+        _write_batch_size(ctx, inputs)
+        _num_shards(ctx, inputs)
+
         inputs.view(
             "header2",
             types.Header(
@@ -72,67 +199,312 @@ class CreateTwelveLabsEmbeddings(foo.Operator):
         return ctx.params.get("delegate", False)
 
     def execute(self, ctx):
+        return _execute_sharded(
+            ctx, self._execute, finalize=_finalize_embeddings, label=self.config.label
+        )
+
+    def _execute(self, ctx):
+        metrics = Metrics(self.config.name)
 
-        ctx.dataset.compute_metadata()
         target = ctx.params.get("target", None)
         target_view = _get_target_view(ctx, target)
+        target_view = _get_shard_view(ctx, target_view)
+        target_view = _get_embeddable_view(
+            target_view,
+            num_workers=ctx.params.get("num_workers", None),
+            split_long_videos=ctx.params.get("split_long_videos", False),
+            metrics=metrics,
+        )
 
         API_KEY = ctx.secret("TL_API_KEY")
         # API_KEY = os.getenv("TL_API_KEY")
 
-        client = TwelveLabs(api_key=API_KEY)
+        client = get_client(API_KEY, metrics=metrics)
+
+        # Only the selected modalities are retrieved, and each segment records
+        # its modality so that search can score them separately
+        embedding_options = [
+            option
+            for modality, option in _MODALITY_OPTIONS.items()
+            if ctx.params.get(modality)
+        ] or _EMBEDDING_OPTIONS
+
+        max_concurrent_tasks = ctx.params.get("max_concurrent_tasks", 4)
+        cache = _get_embedding_cache(ctx)
+        proxies = _get_upload_proxies(
+            ctx,
+            keep_audio="audio" in embedding_options,
+            cache=cache,
+            metrics=metrics,
+        )
 
-        so = []
+        store = None
+        if ctx.params.get("embedding_storage", "SAMPLE") == "DISK":
+            store = _get_segment_store(ctx.dataset, _EMBEDDINGS_FIELD, create=True)
+
+        precision = ctx.params.get("embedding_precision", "FLOAT32")
+
+        # Keep an existing approximate index up to date rather than rebuilding.
+        # Shards run concurrently, so they leave it and the similarity index
+        # to the shard that finishes last
+        sharded = ctx.params.get("shard_index", None) is not None
+        ann_index = None
+        if not sharded:
+            ann_index = _load_ann_index(ctx.dataset, _EMBEDDINGS_FIELD)
+
+        # Videos longer than Twelve Labs accepts are split into overlapping
+        # chunks that are embedded concurrently and stitched back together
+        split_long_videos = ctx.params.get("split_long_videos", False)
+
+        samples = list(target_view)
+        jobs = []
+        for sample in samples:
+            chunks = [None]
+            if split_long_videos and sample.metadata.duration > MAX_VIDEO_DURATION:
+                chunks = plan_chunks(sample.metadata.duration)
+
+            for chunk in chunks:
+                jobs.append(_EmbedJob(sample, chunk, len(chunks)))
+
+        def _cache_key(job):
+            key = cache.make_key(job.sample.filepath, _MARENGO_MODEL, embedding_options)
+            if job.chunk is not None:
+                key += ":%g-%g" % (job.chunk.start, job.chunk.end)
+
+            return key
+
+        # Cache hits need no remote task, so their segments are held here
+        # until the result stage picks them up
+        cached = {}
+
+        def submit(job):
+            if cache is not None:
+                segments = cache.get(_cache_key(job))
+                if segments is not None:
+                    metrics.incr("cache_hits")
+                    cached[(job.sample.id, job.chunk)] = segments
+                    return None
+
+                metrics.incr("cache_misses")
+
+            video_path = job.sample.filepath
+            if proxies is not None:
+                video_path = proxies.get(video_path)
+
+            if job.chunk is None:
+                return _upload(video_path)
+
+            with metrics.timer("chunk_extract"):
+                chunk_path = extract_chunk(
+                    video_path, job.chunk, chunk_dir, job.sample.id
+                )
 
-        if ctx.params.get("visual"):
-            so.append("visual")
-        if ctx.params.get("audio"):
-            so.append("audio")
+            try:
+                return _upload(chunk_path)
+            finally:
+                os.remove(chunk_path)
 
-        models = [{"name": "marengo2.7", "options": so}]
+        def _upload(file_path):
+            with metrics.timer("upload"):
+                task_id = _create_embed_task(client, file_path)
 
-        videos = target_view
-        for sample in videos:
-            if sample.metadata.duration < 4 or sample.metadata.duration > 7200:
-                continue
-            else:
-                file_name = sample.filepath.split("/")[-1]
-                file_path = sample.filepath
+            metrics.incr("bytes_uploaded", os.path.getsize(file_path))
+            return task_id
 
-                task = client.embed.task.create(
-                    model_name="Marengo-retrieval-2.7",
-                    video_file=file_path,
-                )
+        def complete(job, task_id):
+            if task_id is None:
+                return cached.pop((job.sample.id, job.chunk))
+
+            with metrics.timer("retrieve"):
+                segments = _retrieve_embeddings(client, task_id, embedding_options)
+
+            if cache is not None:
+                cache.put(_cache_key(job), segments)
+
+            return segments
+
+        failures = {}
+        chunk_results = defaultdict(dict)
 
-                def on_task_update(task):
-                    print(f"  Status={task.status}")
+        # Samples whose chunks have all finished. If writing one fails, the
+        # tracker reports the error for its last chunk, and it is recorded as
+        # the sample's failure rather than gathered as another chunk
+        stitched = set()
 
-                task.wait_for_done(sleep_interval=5, callback=on_task_update)
+        def on_result(job, segments, error):
+            sample = job.sample
+
+            if job.chunk is not None and sample.id not in stitched:
+                results = chunk_results[sample.id]
+                results[job.chunk] = (segments, error)
+                if len(results) < job.num_chunks:
+                    return
+
+                del chunk_results[sample.id]
+                stitched.add(sample.id)
+                chunks = sorted(results.keys())
+                errors = [results[c][1] for c in chunks if results[c][1] is not None]
+                if errors:
+                    error = errors[0]
+                else:
+                    segments = stitch_segments(chunks, [results[c][0] for c in chunks])
+
+            if error is not None:
+                print(f"Embedding failed for {sample.filepath}: {error}")
+                failures[sample.id] = str(error)
+                return
+
+            existing = None
+            if sample.has_field(_EMBEDDINGS_FIELD):
+                existing = sample[_EMBEDDINGS_FIELD]
+
+            digest = _segments_digest(segments)
+
+            if store is not None:
+                refs = _get_stored_refs(store, sample.id, digest, existing)
+                if refs is None:
+                    with metrics.timer("store_write"):
+                        refs = store.append(sample.id, segments)
+                else:
+                    metrics.incr("segments_reused", len(refs))
 
-                if task.status != "ready":
-                    raise RuntimeError(f"Indexing failed with status {task.status}")
+            metrics.incr("segments_stored", len(segments))
 
-                retrieved_task = task.retrieve(
-                    embedding_option=["visual-text", "audio"]
+            embeddings = None
+            if precision != "FLOAT32" and segments:
+                embeddings, scales = quantize(
+                    [segment.embeddings_float for segment in segments], precision
                 )
-                i = 0
-                dets = []
-                for segment in retrieved_task.video_embedding.segments:
-                    det = fo.TemporalDetection.from_timestamps(
-                        [segment.start_offset_sec, segment.end_offset_sec],
-                        label=f"segment_{i}",
-                        sample=sample,
-                    )
 
-                    i += 1
+            dets = []
+            for i, segment in enumerate(segments):
+                det = fo.TemporalDetection.from_timestamps(
+                    [segment.start_offset_sec, segment.end_offset_sec],
+                    label=f"segment_{i}",
+                    sample=sample,
+                    embedding_option=segment.embedding_option,
+                )
+                if store is not None:
+                    det.embedding_ref = refs[i]
+
+                if embeddings is not None:
+                    det.embedding = embeddings[i]
+                    if scales is not None:
+                        det.embedding_scale = float(scales[i])
+                elif store is None:
                     det.embedding = segment.embeddings_float
-                    dets.append(det)
 
-                sample["Twelve Labs Marengo-retrieval-27"] = fo.TemporalDetections(
-                    detections=dets
+                dets.append(det)
+
+            # Videos whose segments are unchanged keep their detection IDs, so
+            # that their clips, and similarity indexes keyed by them, stay
+            # valid across runs
+            _reuse_label_ids(dets, digest, existing)
+
+            # Video-level embeddings pooled from the segments of each modality
+            # let coarse-to-fine search rank videos before scoring their
+            # segments
+            video_options = video_embeddings = None
+            if segments:
+                video_options, video_embeddings = pool_modalities(
+                    [segment.embeddings_float for segment in segments],
+                    [segment.embedding_option for segment in segments],
                 )
-                sample.save()
-        return {}
+
+            writer.set(
+                sample.id,
+                _EMBEDDINGS_FIELD,
+                fo.TemporalDetections(
+                    detections=dets,
+                    segments_digest=digest,
+                    video_embeddings=video_embeddings,
+                    video_embedding_options=video_options,
+                ),
+            )
+
+            if ann_index is not None:
+                ann_pending.append(
+                    (
+                        sample.id,
+                        [segment.embeddings_float for segment in segments],
+                        [det.support for det in dets],
+                        refs if store is not None else [-1] * len(dets),
+                        [segment.embedding_option for segment in segments],
+                    )
+                )
+                if sum(len(p[2]) for p in ann_pending) >= _ANN_BATCH_SIZE:
+                    flush_ann()
+
+        # Every update of the approximate index touches all of its vectors, so
+        # the segments of many videos are added at once
+        ann_pending = []
+
+        def flush_ann():
+            if not ann_pending:
+                return
+
+            with metrics.timer("ann_update"):
+                ann_index.remove_samples([p[0] for p in ann_pending])
+                ann_index.add(
+                    [e for p in ann_pending for e in p[1]],
+                    [p[0] for p in ann_pending for _ in p[2]],
+                    [s for p in ann_pending for s in p[2]],
+                    refs=[r for p in ann_pending for r in p[3]],
+                    options=[o for p in ann_pending for o in p[4]],
+                )
+
+            del ann_pending[:]
+
+        tracker = TaskTracker(
+            submit,
+            lambda task_id: _get_embed_task_status(client, task_id),
+            complete,
+            on_result,
+            on_progress=_make_progress_callback(ctx, "Embedded"),
+            max_in_flight=max_concurrent_tasks,
+            metrics=metrics,
+        )
+
+        writer = BatchedWriter(
+            ctx.dataset,
+            batch_size=ctx.params.get("batch_size", 100),
+            metrics=metrics,
+        )
+        try:
+            with writer, tempfile.TemporaryDirectory() as chunk_dir:
+                tracker.run(jobs)
+        finally:
+            # Cached segment indexes are only reloaded when this is bumped
+            bump_index_version(ctx.dataset, _EMBEDDINGS_FIELD)
+
+        num_embedded = len(samples) - len(failures)
+
+        if ann_index is not None:
+            flush_ann()
+            with metrics.timer("ann_update"):
+                _save_ann_index(ctx.dataset, _EMBEDDINGS_FIELD, ann_index)
+
+        print(f"Embedded {num_embedded} videos, {len(failures)} failed")
+        results = {"num_embedded": num_embedded, "failures": failures}
+
+        if ctx.params.get("similarity_index", False) and not sharded:
+            with metrics.timer("similarity_index"):
+                results["similarity_index"] = _update_similarity_index(ctx)
+
+        if ctx.params.get("compact_store", False) and not sharded:
+            with metrics.timer("store_compaction"):
+                results["store_compaction"] = _compact_segment_store(ctx.dataset)
+
+        if cache is not None:
+            results["cache"] = cache.stats()
+            cache.close()
+
+        if proxies is not None:
+            proxies.close()
+            results["proxies"] = _report_proxies(proxies)
+
+        results["metrics"] = metrics.finish()
+        return results
 
 
 class TwelveLabsSemanticSearch(foo.Operator):
@@ -161,13 +533,8 @@ class TwelveLabsSemanticSearch(foo.Operator):
             )
         else:
             target_view = get_target_view(ctx, inputs)
-            client = TwelveLabs(api_key=API_KEY)
-            indexes = client.index.list()
 
-            if not any(
-                field.startswith("Twelve Labs")
-                for field in list(ctx.dataset.get_field_schema().keys())
-            ):
+            if _EMBEDDINGS_FIELD not in _get_field_names(ctx.dataset):
                 inputs.view(
                     "No Embeddings",
                     types.Warning(
@@ -178,6 +545,76 @@ class TwelveLabsSemanticSearch(foo.Operator):
             else:
 
                 inputs.str("prompt", label="Prompt", required=True)
+                inputs.int(
+                    "top_k",
+                    default=50,
+                    required=True,
+                    label="Number of results",
+                    description="The number of best matching clips to return",
+                )
+
+                method_choices = types.RadioGroup(orientation="horizontal")
+                method_choices.add_choice(
+                    "EXACT",
+                    label="Exact",
+                    description="Score every segment embedding",
+                )
+                method_choices.add_choice(
+                    "APPROXIMATE",
+                    label="Approximate",
+                    description="Use an approximate nearest neighbor index, which is built on first use",
+                )
+                method_choices.add_choice(
+                    "HIERARCHICAL",
+                    label="Coarse-to-fine",
+                    description="Rank videos by their pooled embeddings, then score the segments of only the best matching videos",
+                )
+                method_choices.add_choice(
+                    "BRAIN",
+                    label="Similarity index",
+                    description="Use a FiftyOne Brain similarity index built by `create twelve labs embeddings`",
+                )
+                inputs.enum(
+                    "search_method",
+                    method_choices.values(),
+                    default="EXACT",
+                    required=True,
+                    label="Search method",
+                    view=method_choices,
+                )
+                search_method = ctx.params.get("search_method", "EXACT")
+                if search_method == "APPROXIMATE":
+                    inputs.int(
+                        "nprobe",
+                        default=16,
+                        required=True,
+                        label="Lists to probe",
+                        description="Higher values improve recall at the cost of latency",
+                    )
+                    _search_modalities(ctx, inputs, combine=False)
+                elif search_method == "BRAIN":
+                    get_brain_key(
+                        ctx,
+                        inputs,
+                        label="Similarity index",
+                        description="The similarity index to search",
+                    )
+                    _search_modalities(ctx, inputs, combine=False)
+                else:
+                    if search_method == "HIERARCHICAL":
+                        inputs.int(
+                            "num_videos",
+                            default=100,
+                            required=True,
+                            label="Videos to search",
+                            description="The number of best matching videos whose segments are scored",
+                        )
+
+                    _rerank_candidates(ctx, inputs)
+                    _search_modalities(ctx, inputs)
+
+                if search_method != "BRAIN":
+                    _sort_results(ctx, inputs)
 
                 _execution_mode(ctx, inputs)
 
@@ -192,45 +629,162 @@ class TwelveLabsSemanticSearch(foo.Operator):
 
         assert API_KEY, "Env variable TL_API_KEY not defined."
 
+        metrics = Metrics(self.config.name)
+
         target = ctx.params.get("target", None)
         target_view = _get_target_view(ctx, target)
 
-        client = TwelveLabs(api_key=API_KEY)
+        client = get_client(API_KEY, metrics=metrics)
 
         prompt = ctx.params.get("prompt")
+        top_k = ctx.params.get("top_k", 50)
+        query_cache = _get_query_cache()
+
+        if ctx.params.get("search_method", "EXACT") == "BRAIN":
+            # Brain runs cannot store custom models, so the prompt is embedded
+            # by the model wrapper and the index is queried by vector
+            brain_key = ctx.params["brain_key"]
+            model = TwelveLabsModel(
+                TwelveLabsModelConfig(
+                    {"api_key": API_KEY, "model_name": _MARENGO_MODEL}
+                ),
+                query_cache=query_cache,
+                metrics=metrics,
+            )
+            options = _get_search_options(ctx)
+            with metrics.timer("query_embedding"):
+                query = model.embed_prompt(prompt)
 
-        res = client.embed.create(
-            model_name="Marengo-retrieval-2.7",
-            text=prompt,
-        )
+            with metrics.timer("index_load"):
+                similarity_index = load_similarity_index(
+                    target_view, brain_key, _EMBEDDINGS_FIELD, options=options
+                )
 
-        
-        print(f"Found {len(video_ids)} videos")
-        samples = []
-        view1 = target_view.select_by(
-            "Twelve Labs " + index_name, video_ids, ordered=True
-        )
-        print(f"Found {len(view1)} samples")
-        start = [entry.start for entry in search_results.data]
-        end = [entry.end for entry in search_results.data]
-        if "results" in ctx.dataset.get_field_schema().keys():
-            ctx.dataset.delete_sample_field("results")
-
-        i = 0
-        for sample in view1:
-            support = [
-                int(start[i] * sample.metadata.frame_rate) + 1,
-                int(end[i] * sample.metadata.frame_rate) + 1,
-            ]
-            sample["results"] = fo.TemporalDetection(
-                label=prompt, support=tuple(support)
+            # Each clip has a segment per modality, so enough candidates are
+            # fetched to keep only the best matching modality of each clip
+            with metrics.timer("search"):
+                view = similarity_index.sort_by_similarity(
+                    query, k=top_k * max(len(options), 1)
+                )
+                ids, sample_ids, supports = view.values(["id", "sample_id", "support"])
+                keep = _best_per_clip(sample_ids, supports, top_k)
+                view = view.select([ids[i] for i in keep], ordered=True)
+
+            metrics.incr("segments_searched", similarity_index.index_size)
+            print(
+                f"Searched {similarity_index.index_size} clips with similarity "
+                f"index '{brain_key}'"
             )
-            sample.save()
+            ctx.trigger("set_view", {"view": view._serialize()})
+            ctx.ops.set_view(view=view)
+
+            return {"query_cache": query_cache.stats(), "metrics": metrics.finish()}
+
+        with metrics.timer("query_embedding"):
+            query = _embed_prompt(client, prompt, query_cache=query_cache)
+
+        store = _get_segment_store(ctx.dataset, _EMBEDDINGS_FIELD)
+
+        if ctx.params.get("search_method", "EXACT") == "APPROXIMATE":
+            with metrics.timer("index_load"):
+                ann_index = _get_ann_index(ctx.dataset, _EMBEDDINGS_FIELD, store=store)
+
+            sample_ids = None
+            if target_view.view() != ctx.dataset.view():
+                sample_ids = target_view.values("id")
+
+            # Each clip has a vector per modality, so enough candidates are
+            # fetched to keep only the best matching modality of each clip
+            options = _get_search_options(ctx)
+            with metrics.timer("search"):
+                ids, scores = ann_index.search(
+                    query,
+                    top_k * max(len(options), 1),
+                    nprobe=ctx.params.get("nprobe", 16),
+                    sample_ids=sample_ids,
+                    options=options,
+                    store=store,
+                )
 
-        view2 = view1.to_clips("results")
-        ctx.trigger("set_view", {"view": view2._serialize()})
-        ctx.ops.set_view(view=view2)
-        return {}
+            metrics.incr("segments_searched", len(ann_index))
+            print(f"Searched {len(ann_index)} segments approximately")
+            sample_ids = [_id.decode() for _id in ann_index.sample_ids[ids]]
+            supports = ann_index.supports[ids]
+
+            keep = _best_per_clip(sample_ids, supports, top_k)
+            sample_ids = [sample_ids[i] for i in keep]
+            supports = supports[keep]
+            scores = scores[keep]
+        elif ctx.params.get("search_method", "EXACT") == "HIERARCHICAL":
+            with metrics.timer("index_load"):
+                index = load_segment_index(
+                    target_view,
+                    _EMBEDDINGS_FIELD,
+                    store=store,
+                    split_modalities=True,
+                    hierarchical=True,
+                )
+
+            # Videos are ranked with the same modalities as their segments
+            modalities = _get_search_modalities(ctx, index.index)
+            with metrics.timer("search"):
+                videos, _ = index.rank_videos(
+                    query, ctx.params.get("num_videos", 100), **modalities
+                )
+                inds, scores = index.search(
+                    query,
+                    top_k,
+                    videos=videos,
+                    rerank=ctx.params.get("rerank", 0),
+                    **modalities,
+                )
+
+            num_segments = index.num_segments(videos)
+            metrics.incr("videos_searched", len(index))
+            metrics.incr("segments_searched", num_segments)
+            print(
+                f"Ranked {len(index)} videos and searched {num_segments} segments "
+                f"of the best {len(videos)}"
+            )
+            sample_ids = index.index.sample_ids[inds]
+            supports = index.index.supports[inds]
+        else:
+            with metrics.timer("index_load"):
+                index = load_segment_index(
+                    target_view, _EMBEDDINGS_FIELD, store=store, split_modalities=True
+                )
+
+            with metrics.timer("search"):
+                inds, scores = index.search(
+                    query,
+                    top_k,
+                    rerank=ctx.params.get("rerank", 0),
+                    **_get_search_modalities(ctx, index),
+                )
+
+            num_segments = _get_num_segments(index)
+            metrics.incr("segments_searched", num_segments)
+            print(f"Searched {num_segments} segments")
+            sample_ids = index.sample_ids[inds]
+            supports = index.supports[inds]
+
+        _show_search_results(
+            ctx,
+            target_view,
+            prompt,
+            sample_ids,
+            supports,
+            scores,
+            sort_by=ctx.params.get("sort_by", "CLIP"),
+            metrics=metrics,
+        )
+
+        query_stats = query_cache.stats()
+        print(
+            f"Query cache hit rate {query_stats['hit_rate']:.0%}, "
+            f"{query_stats['latency_saved_secs']:.1f}s of API latency saved"
+        )
+        return {"query_cache": query_stats, "metrics": metrics.finish()}
 
 
 class CreateTwelveLabsIndex(foo.Operator):
@@ -267,6 +821,13 @@ class CreateTwelveLabsIndex(foo.Operator):
             description="Choose your index name and the modalities of embeddings you will use!",
         )
         inputs.str("index_name", label="Index_Name", required=True)
+        inputs.bool(
+            "resume",
+            default=True,
+            label="Resume",
+            description="Reuse an existing index with this name, skip videos that are already indexed, and pick up tasks from interrupted runs",
+            view=types.CheckboxView(),
+        )
         inputs.view(
             "header",
             types.Header(
@@ -287,6 +848,18 @@ class CreateTwelveLabsIndex(foo.Operator):
             description="Video must have audio to work!",
             view=types.CheckboxView(),
         )
+        inputs.int(
+            "max_concurrent_tasks",
+            default=4,
+            required=True,
+            label="Max concurrent tasks",
+            description="The maximum number of videos to index in parallel",
+        )
+
+        _upload_proxies(ctx, inputs)
+        _metadata_workers(ctx, inputs)
+        _write_batch_size(ctx, inputs)
+        _num_shards(ctx, inputs)
 
         inputs.view(
             "header2",
@@ -301,16 +874,28 @@ class CreateTwelveLabsIndex(foo.Operator):
         return ctx.params.get("delegate", False)
 
     def execute(self, ctx):
-        ctx.dataset.compute_metadata()
+        return _execute_sharded(
+            ctx, self._execute, prepare=_prepare_index_shards, label=self.config.label
+        )
+
+    def _execute(self, ctx):
+        metrics = Metrics(self.config.name)
+
         target = ctx.params.get("target", None)
         target_view = _get_target_view(ctx, target)
+        target_view = _get_shard_view(ctx, target_view)
+        target_view = _get_embeddable_view(
+            target_view,
+            num_workers=ctx.params.get("num_workers", None),
+            metrics=metrics,
+        )
 
         API_KEY = ctx.secret("TL_API_KEY")
         # API_KEY = os.getenv("TL_API_KEY")
 
         INDEX_NAME = ctx.params.get("index_name")
 
-        client = TwelveLabs(api_key=API_KEY)
+        client = get_client(API_KEY, metrics=metrics)
 
         so = []
 
@@ -319,38 +904,87 @@ class CreateTwelveLabsIndex(foo.Operator):
         if ctx.params.get("audio"):
             so.append("audio")
 
-        models = [{"name": "marengo2.7", "options": so}]
-
-        index = client.index.create(
-            name=INDEX_NAME,
-            models=models,
-        )
+        index_field = "Twelve Labs " + INDEX_NAME
+        task_field = index_field + " task_id"
+        resume = ctx.params.get("resume", True)
 
-        index_id = index.id
+        # Shards share the index that their parent operation resolved
+        index_id = ctx.params.get("index_id", None)
+        if index_id is None:
+            index_id = _get_or_create_index(client, API_KEY, INDEX_NAME, so, resume)
 
         videos = target_view
-        for sample in videos:
-            if sample.metadata.duration < 4 or sample.metadata.duration > 7200:
-                continue
-            else:
-                file_name = sample.filepath.split("/")[-1]
-                file_path = sample.filepath
-
-                task = client.task.create(index_id=index_id, file=file_path)
-
-                def on_task_update(task):
-                    print(f"  Status={task.status}")
-
-                task.wait_for_done(sleep_interval=5, callback=on_task_update)
+        if resume and index_field in ctx.dataset.get_field_schema():
+            videos = videos.exists(index_field, False)
+
+        has_tasks = task_field in ctx.dataset.get_field_schema()
+        proxies = _get_upload_proxies(ctx, keep_audio="audio" in so, metrics=metrics)
+
+        def submit(sample):
+            if resume and has_tasks and sample[task_field]:
+                # Pick up a task that was still processing when a previous
+                # run died rather than uploading again
+                task_id = sample[task_field]
+                if _get_index_task_status(client, task_id) != "failed":
+                    return task_id
+
+            video_path = sample.filepath
+            if proxies is not None:
+                video_path = proxies.get(video_path)
+
+            with metrics.timer("upload"):
+                task = client.task.create(index_id=index_id, file=video_path)
+
+            metrics.incr("bytes_uploaded", os.path.getsize(video_path))
+
+            # Checkpoint the task immediately so it survives a crash. Only its
+            # own task ID is written, and on this worker thread rather than
+            # the polling loop
+            checkpoints.set(sample.id, task_field, task.id)
+            return task.id
+
+        def complete(sample, task_id):
+            with metrics.timer("retrieve"):
+                return client.task.retrieve(task_id).video_id
+
+        failures = {}
+
+        def on_result(sample, video_id, error):
+            if error is not None:
+                print(f"Indexing failed for {sample.filepath}: {error}")
+                failures[sample.id] = str(error)
+                return
+
+            writer.set(sample.id, index_field, video_id)
+            writer.set(sample.id, task_field, None)
+
+        tracker = TaskTracker(
+            submit,
+            lambda task_id: _get_index_task_status(client, task_id),
+            complete,
+            on_result,
+            on_progress=_make_progress_callback(ctx, "Indexed"),
+            max_in_flight=ctx.params.get("max_concurrent_tasks", 4),
+            metrics=metrics,
+        )
 
-                if task.status != "ready":
-                    raise RuntimeError(f"Indexing failed with status {task.status}")
+        writer = BatchedWriter(
+            ctx.dataset,
+            batch_size=ctx.params.get("batch_size", 100),
+            metrics=metrics,
+        )
+        checkpoints = BatchedWriter(ctx.dataset, batch_size=1, metrics=metrics)
+        with writer, checkpoints:
+            num_indexed, _ = tracker.run(videos)
 
-                video_id = task.video_id
+        print(f"Indexed {num_indexed} videos, {len(failures)} failed")
+        results = {"num_indexed": num_indexed, "failures": failures}
+        if proxies is not None:
+            proxies.close()
+            results["proxies"] = _report_proxies(proxies)
 
-                sample["Twelve Labs " + INDEX_NAME] = video_id
-                sample.save()
-        return {}
+        results["metrics"] = metrics.finish()
+        return results
 
 
 class TwelveLabsIndexSearch(foo.Operator):
@@ -379,10 +1013,9 @@ class TwelveLabsIndexSearch(foo.Operator):
             )
         else:
             target_view = get_target_view(ctx, inputs)
-            client = TwelveLabs(api_key=API_KEY)
-            indexes = client.index.list()
+            indexes = _list_indexes(API_KEY)
 
-            if indexes == []:
+            if not indexes:
                 inputs.view(
                     "No Index",
                     types.Warning(
@@ -396,17 +1029,16 @@ class TwelveLabsIndexSearch(foo.Operator):
                 audio_flag = False
 
                 index_info = {}
-                indexes[0].models.root[0].options
                 for index in indexes:
-                    if "visual" in index.models.root[0].options:
+                    if "visual" in index.options:
                         vis_flag = True
-                    if "audio" in index.models.root[0].options:
+                    if "audio" in index.options:
                         audio_flag = True
                     index_info[index.name] = index.id
 
                 choices = index_info.keys()
                 choices_compare = [
-                    x[12:] for x in ctx.dataset.get_field_schema().keys()
+                    x[12:] for x in _get_field_names(ctx.dataset)
                 ]  # change if ever add more than Twelve Labs
                 common_index = list(set(choices_compare) & set(choices))
                 if len(common_index) < 1:
@@ -452,6 +1084,13 @@ class TwelveLabsIndexSearch(foo.Operator):
                         required=True,
                     )
                     inputs.str("prompt", label="Prompt", required=True)
+                    inputs.int(
+                        "top_k",
+                        default=50,
+                        required=True,
+                        label="Number of results",
+                        description="The number of best matching clips to return",
+                    )
 
                     inputs.view(
                         "header",
@@ -492,14 +1131,12 @@ class TwelveLabsIndexSearch(foo.Operator):
         target = ctx.params.get("target", None)
         target_view = _get_target_view(ctx, target)
 
-        client = TwelveLabs(api_key=API_KEY)
+        metrics = Metrics(self.config.name)
+        client = get_client(API_KEY, metrics=metrics)
 
         index_name = ctx.params.get("index_name")
 
-        indexes = client.index.list()
-        for index in indexes:
-            if index.name == index_name:
-                index_id = index.id
+        index_id = _get_index_id(API_KEY, index_name)
 
         prompt = ctx.params.get("prompt")
 
@@ -510,121 +1147,1222 @@ class TwelveLabsIndexSearch(foo.Operator):
         if ctx.params.get("audio"):
             so.append("audio")
 
-        if len(so) >= 2:
-            search_results = client.search.query(
-                index_id=index_id, query_text=prompt, options=so, operator="and"
-            )
-        else:
-            search_results = client.search.query(
-                index_id=index_id, query_text=prompt, options=so
+        with metrics.timer("remote_search"):
+            sample_ids, supports, scores = _search_index(
+                client,
+                index_id,
+                prompt,
+                so,
+                target_view,
+                "Twelve Labs " + index_name,
+                ctx.params.get("top_k", 50),
             )
 
-        video_ids = [entry.video_id for entry in search_results.data]
-        print(f"Found {len(video_ids)} videos")
-        samples = []
-        view1 = target_view.select_by(
-            "Twelve Labs " + index_name, video_ids, ordered=True
+        print(f"Found {len(sample_ids)} clips")
+
+        _show_search_results(
+            ctx, target_view, prompt, sample_ids, supports, scores, metrics=metrics
         )
-        print(f"Found {len(view1)} samples")
-        start = [entry.start for entry in search_results.data]
-        end = [entry.end for entry in search_results.data]
-        if "results" in ctx.dataset.get_field_schema().keys():
-            ctx.dataset.delete_sample_field("results")
-
-        i = 0
-        for sample in view1:
-            support = [
-                int(start[i] * sample.metadata.frame_rate) + 1,
-                int(end[i] * sample.metadata.frame_rate) + 1,
-            ]
-            sample["results"] = fo.TemporalDetection(
-                label=prompt, support=tuple(support)
-            )
-            sample.save()
+        return {"metrics": metrics.finish()}
 
-        view2 = view1.to_clips("results")
-        ctx.trigger("set_view", {"view": view2._serialize()})
-        ctx.ops.set_view(view=view2)
-        return {}
 
+class TwelveLabsHybridSearch(foo.Operator):
+    @property
+    def config(self):
+        return foo.OperatorConfig(
+            name="twelve_labs_hybrid_search",
+            label="Twelve Labs Hybrid Search",
+            description="Semantic video search that fuses a Twelve Labs Index search with local Twelve Labs Embeddings",
+            dynamic=True,
+            icon="/assets/search.svg",
+        )
 
-def get_target_view(ctx, inputs):
-    has_view = ctx.view != ctx.dataset.view()
-    has_selected = bool(ctx.selected)
-    default_target = None
+    def resolve_input(self, ctx):
+        inputs = types.Object()
 
-    if has_view or has_selected:
-        target_choices = types.RadioGroup(orientation="horizontal")
-        target_choices.add_choice(
-            "DATASET",
-            label="Entire dataset",
-            description="Process the entire dataset",
-        )
+        API_KEY = ctx.secret("TL_API_KEY")
 
-        if has_view:
-            target_choices.add_choice(
-                "CURRENT_VIEW",
-                label="Current view",
-                description="Process the current view",
+        if API_KEY is None:
+            inputs.view(
+                "warning",
+                types.Warning(
+                    label="Twelve Lab key undefined",
+                    description="Please define the enviroment variables TL_API_KEY and reload",
+                ),
             )
-            default_target = "CURRENT_VIEW"
+            return types.Property(inputs)
 
-        if has_selected:
-            target_choices.add_choice(
-                "SELECTED_SAMPLES",
-                label="Selected samples",
-                description="Process only the selected samples",
+        get_target_view(ctx, inputs)
+        field_names = _get_field_names(ctx.dataset)
+
+        if _EMBEDDINGS_FIELD not in field_names:
+            inputs.view(
+                "No Embeddings",
+                types.Warning(
+                    label="No embeddings detected",
+                    description="Please run `create twelve labs embeddings` first in order to hybrid search on your dataset!",
+                ),
             )
-            default_target = "SELECTED_SAMPLES"
+            return types.Property(inputs)
+
+        index_names = [
+            index.name
+            for index in _list_indexes(API_KEY)
+            if "Twelve Labs " + index.name in field_names
+        ]
+        if not index_names:
+            inputs.view(
+                "No Index",
+                types.Warning(
+                    label="No Indexes detected",
+                    description="Please run `create twelve labs index` first in order to hybrid search on your dataset!",
+                ),
+            )
+            return types.Property(inputs)
+
+        radio_group = types.RadioGroup()
+        for index_name in index_names:
+            radio_group.add_choice(index_name, label=index_name)
 
         inputs.enum(
-            "target",
-            target_choices.values(),
-            default=default_target,
+            "index_name",
+            radio_group.values(),
+            label="Pick an index",
+            description="",
+            view=types.DropdownView(),
             required=True,
-            label="Target view",
-            view=target_choices,
+        )
+        inputs.str("prompt", label="Prompt", required=True)
+        inputs.int(
+            "top_k",
+            default=50,
+            required=True,
+            label="Number of results",
+            description="The number of best matching clips to return",
+        )
+        inputs.bool(
+            "visual",
+            default=True,
+            label="visual",
+            description="",
+            view=types.CheckboxView(),
+        )
+        inputs.bool(
+            "audio",
+            label="audio",
+            description="Video must have audio to work!",
+            view=types.CheckboxView(),
+        )
+        inputs.float(
+            "remote_timeout",
+            default=5.0,
+            required=True,
+            label="Index search deadline",
+            description="The number of seconds to wait for the Twelve Labs Index search before returning local results only",
         )
 
-    target = ctx.params.get("target", default_target)
+        _execution_mode(ctx, inputs)
 
-    return _get_target_view(ctx, target)
+        return types.Property(inputs)
 
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
 
-def _get_target_view(ctx, target):
-    if target == "SELECTED_SAMPLES":
-        return ctx.view.select(ctx.selected)
+    def execute(self, ctx):
 
-    if target == "DATASET":
-        return ctx.dataset
+        API_KEY = ctx.secret("TL_API_KEY")
 
-    return ctx.view
+        assert API_KEY, "Env variable TL_API_KEY not defined."
 
+        target = ctx.params.get("target", None)
+        target_view = _get_target_view(ctx, target)
 
-def get_twelve_id_from_name(INDEXES_URL, headers, INDEX_NAME):
-    response = requests.get(INDEXES_URL, headers=headers)
-    INDEX_ID = None
-    for index in response.json()["data"]:
-        if index["index_name"] == INDEX_NAME:
-            INDEX_ID = index["_id"]
-    return INDEX_ID
+        metrics = Metrics(self.config.name)
+        client = get_client(API_KEY, metrics=metrics)
 
+        index_name = ctx.params.get("index_name")
+        prompt = ctx.params.get("prompt")
+        top_k = ctx.params.get("top_k", 50)
+        timeout = ctx.params.get("remote_timeout", 5.0)
 
-_BRAIN_RUN_TYPES = {
-    "similarity": Similarity,
-}
+        so = []
 
+        if ctx.params.get("visual", True):
+            so.append("visual")
+        if ctx.params.get("audio"):
+            so.append("audio")
 
-def get_brain_key(
-    ctx,
-    inputs,
-    label="Brain key",
-    description="Select a brain key",
-    run_type="similarity",
-    show_default=True,
-):
-    type = _BRAIN_RUN_TYPES.get(run_type, None)
-    brain_keys = ctx.dataset.list_brain_runs(type=type)
+        # As when embedding, every modality is searched if none is selected,
+        # rather than the local search silently matching nothing
+        so = so or list(_MODALITY_OPTIONS)
+
+        def remote_search():
+            with metrics.timer("remote_search"):
+                index_id = _get_index_id(API_KEY, index_name)
+                return _search_index(
+                    client,
+                    index_id,
+                    prompt,
+                    so,
+                    target_view,
+                    "Twelve Labs " + index_name,
+                    top_k,
+                )
+
+        def local_search():
+            with metrics.timer("query_embedding"):
+                query = _embed_prompt(client, prompt, query_cache=_get_query_cache())
+
+            store = _get_segment_store(ctx.dataset, _EMBEDDINGS_FIELD)
+            with metrics.timer("index_load"):
+                index = load_segment_index(
+                    target_view, _EMBEDDINGS_FIELD, store=store, split_modalities=True
+                )
+
+            # Local modalities are combined like the index search combines them
+            modalities = {}
+            if isinstance(index, MultimodalIndex):
+                modalities = {
+                    "options": [_MODALITY_OPTIONS[m] for m in so],
+                    "operator": "and" if len(so) >= 2 else "or",
+                }
+
+            with metrics.timer("search"):
+                inds, scores = index.search(query, top_k, **modalities)
+
+            return index.sample_ids[inds], index.supports[inds], scores
+
+        # Both searches run at once, so latency is that of the slower one,
+        # and the index search is abandoned if it misses its deadline
+        start = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=2)
+        remote_future = executor.submit(remote_search)
+        local_future = executor.submit(local_search)
+        executor.shutdown(wait=False)
+
+        local_ids, local_supports, _ = local_future.result()
+        rankings = [list(zip(local_ids, local_supports))]
+
+        remaining = max(timeout - (time.perf_counter() - start), 0)
+        try:
+            remote_ids, remote_supports, _ = remote_future.result(timeout=remaining)
+            rankings.append(list(zip(remote_ids, remote_supports)))
+        except FutureTimeoutError:
+            metrics.incr("remote_timeouts")
+            print(f"Index search missed its {timeout}s deadline, using local results")
+        except Exception as e:
+            metrics.incr("remote_errors")
+            print(f"Index search failed, using local results: {e}")
+
+        with metrics.timer("fusion"):
+            fused = reciprocal_rank_fusion(rankings)[:top_k]
+        print(
+            f"Fused {sum(len(r) for r in rankings)} hits from "
+            f"{len(rankings)} searches into {len(fused)} clips"
+        )
+
+        sample_ids, supports, scores = zip(*fused) if fused else ([], [], [])
+        _show_search_results(
+            ctx, target_view, prompt, sample_ids, supports, scores, metrics=metrics
+        )
+
+        return {
+            "num_local": len(rankings[0]),
+            "num_remote": len(rankings[1]) if len(rankings) > 1 else None,
+            "num_results": len(fused),
+            "metrics": metrics.finish(),
+        }
+
+
+class TwelveLabsBatchSearch(foo.Operator):
+    @property
+    def config(self):
+        return foo.OperatorConfig(
+            name="twelve_labs_batch_search",
+            label="Twelve Labs Batch Search",
+            description="Search many prompts at once using local Twelve Labs Embeddings",
+            dynamic=True,
+            icon="/assets/search.svg",
+        )
+
+    def resolve_input(self, ctx):
+        inputs = types.Object()
+
+        API_KEY = ctx.secret("TL_API_KEY")
+
+        if API_KEY is None:
+            inputs.view(
+                "warning",
+                types.Warning(
+                    label="Twelve Lab key undefined",
+                    description="Please define the enviroment variables TL_API_KEY and reload",
+                ),
+            )
+            return types.Property(inputs)
+
+        get_target_view(ctx, inputs)
+
+        if _EMBEDDINGS_FIELD not in _get_field_names(ctx.dataset):
+            inputs.view(
+                "No Embeddings",
+                types.Warning(
+                    label="No embeddings detected",
+                    description="Please run `create twelve labs embeddings` first in order to batch search on your dataset!",
+                ),
+            )
+            return types.Property(inputs)
+
+        inputs.list(
+            "prompts",
+            types.String(),
+            label="Prompts",
+            description="The prompts to search for",
+        )
+        inputs.str(
+            "prompts_path",
+            label="Prompts file",
+            description="An optional text file with one prompt per line",
+        )
+        inputs.int(
+            "top_k",
+            default=50,
+            required=True,
+            label="Number of results",
+            description="The number of best matching clips to return per prompt",
+        )
+        _rerank_candidates(ctx, inputs)
+        _search_modalities(ctx, inputs)
+
+        output_choices = types.RadioGroup(orientation="horizontal")
+        output_choices.add_choice(
+            "COMBINED",
+            label="Combined",
+            description="Store the clips of every prompt in one field, labeled by prompt",
+        )
+        output_choices.add_choice(
+            "PER_PROMPT",
+            label="Per prompt",
+            description="Store the clips of each prompt in its own field",
+        )
+        inputs.enum(
+            "output_mode",
+            output_choices.values(),
+            default="COMBINED",
+            required=True,
+            label="Output",
+            view=output_choices,
+        )
+        inputs.str(
+            "output_field",
+            default="batch_results",
+            required=True,
+            label="Output field",
+            description="The field in which to store the results. In per prompt mode, this is the prefix of each prompt's field",
+        )
+
+        _execution_mode(ctx, inputs)
+
+        return types.Property(inputs)
+
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
+    def execute(self, ctx):
+        API_KEY = ctx.secret("TL_API_KEY")
+
+        assert API_KEY, "Env variable TL_API_KEY not defined."
+
+        metrics = Metrics(self.config.name)
+
+        target = ctx.params.get("target", None)
+        target_view = _get_target_view(ctx, target)
+
+        prompts = _get_batch_prompts(ctx)
+        if not prompts:
+            raise ValueError("No prompts provided")
+
+        client = get_client(API_KEY, metrics=metrics)
+        query_cache = _get_query_cache()
+
+        # The scheduler paces the requests, so prompts are embedded in parallel
+        with metrics.timer("query_embedding"):
+            with ThreadPoolExecutor(max_workers=min(8, len(prompts))) as executor:
+                queries = list(
+                    executor.map(
+                        lambda prompt: _embed_prompt(
+                            client, prompt, query_cache=query_cache
+                        ),
+                        prompts,
+                    )
+                )
+
+        store = _get_segment_store(ctx.dataset, _EMBEDDINGS_FIELD)
+        with metrics.timer("index_load"):
+            index = load_segment_index(
+                target_view, _EMBEDDINGS_FIELD, store=store, split_modalities=True
+            )
+
+        with metrics.timer("search"):
+            inds, scores = index.search_batch(
+                queries,
+                ctx.params.get("top_k", 50),
+                rerank=ctx.params.get("rerank", 0),
+                **_get_search_modalities(ctx, index),
+            )
+
+        num_segments = _get_num_segments(index)
+        metrics.incr("segments_searched", num_segments)
+        print(f"Searched {num_segments} segments for {len(prompts)} prompts")
+
+        output_field = ctx.params.get("output_field", "batch_results")
+        combined = ctx.params.get("output_mode", "COMBINED") == "COMBINED"
+        if combined:
+            fields = [output_field] * len(prompts)
+        else:
+            fields = _get_prompt_fields(output_field, prompts)
+
+        # Every field is written, so stale results of prompts that no longer
+        # match anything are cleared
+        results = {field: {} for field in fields}
+        for prompt, field, _inds, _scores in zip(prompts, fields, inds, scores):
+            field_results = results[field]
+            for sample_id, support, score in zip(
+                index.sample_ids[_inds], index.supports[_inds], _scores
+            ):
+                if sample_id not in field_results:
+                    field_results[sample_id] = fo.TemporalDetections(detections=[])
+
+                field_results[sample_id].detections.append(
+                    fo.TemporalDetection(
+                        label=prompt,
+                        support=tuple(int(s) for s in support),
+                        confidence=float(score),
+                    )
+                )
+
+        with metrics.timer("db_write"):
+            for field, field_results in results.items():
+                _set_results(ctx.dataset, field_results, field=field)
+
+        metrics.incr("samples_written", sum(len(r) for r in results.values()))
+
+        if combined:
+            view = target_view.select(list(results[output_field].keys()))
+            view = view.to_clips(output_field).sort_by(
+                output_field + ".confidence", reverse=True
+            )
+            ctx.trigger("set_view", {"view": view._serialize()})
+            ctx.ops.set_view(view=view)
+
+        return {
+            "num_prompts": len(prompts),
+            "fields": dict(zip(prompts, fields)),
+            "query_cache": query_cache.stats(),
+            "metrics": metrics.finish(),
+        }
+
+
+class TwelveLabsSimilarClips(foo.Operator):
+    @property
+    def config(self):
+        return foo.OperatorConfig(
+            name="twelve_labs_similar_clips",
+            label="Twelve Labs Similar Clips",
+            description="Find the clips most similar to the selected clips using local Twelve Labs Embeddings",
+            dynamic=True,
+            icon="/assets/search.svg",
+        )
+
+    def resolve_input(self, ctx):
+        inputs = types.Object()
+
+        if _EMBEDDINGS_FIELD not in _get_field_names(ctx.dataset):
+            inputs.view(
+                "No Embeddings",
+                types.Warning(
+                    label="No embeddings detected",
+                    description="Please run `create twelve labs embeddings` first in order to find similar clips in your dataset!",
+                ),
+            )
+            return types.Property(inputs)
+
+        if not ctx.selected:
+            prop = inputs.view(
+                "No selection",
+                types.Warning(
+                    label="Nothing selected",
+                    description="Select one or more clips or videos in the App to find similar clips",
+                ),
+            )
+            prop.invalid = True
+            return types.Property(inputs)
+
+        inputs.int(
+            "top_k",
+            default=50,
+            required=True,
+            label="Number of results",
+            description="The number of most similar clips to return",
+        )
+        inputs.bool(
+            "exclude_selected",
+            default=True,
+            label="Exclude selection",
+            description="Leave the selected clips out of the results",
+            view=types.CheckboxView(),
+        )
+        _search_modalities(ctx, inputs)
+        _rerank_candidates(ctx, inputs)
+
+        _execution_mode(ctx, inputs)
+
+        return types.Property(inputs)
+
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
+    def execute(self, ctx):
+        metrics = Metrics(self.config.name)
+
+        clips = _get_selected_clips(ctx)
+        if not clips:
+            raise ValueError("No clips selected")
+
+        store = _get_segment_store(ctx.dataset, _EMBEDDINGS_FIELD)
+        with metrics.timer("index_load"):
+            index = load_segment_index(
+                ctx.dataset, _EMBEDDINGS_FIELD, store=store, split_modalities=True
+            )
+
+        rows = index.find(clips)
+        if len(rows) == 0:
+            raise ValueError("The selected clips have no embeddings")
+
+        # Each modality is searched for by the centroid of the selected
+        # segments of that modality, so visual and audio embeddings are never
+        # averaged together
+        if isinstance(index, MultimodalIndex):
+            query = index.pool(rows)
+        else:
+            query = pool_embeddings(index.get_embeddings(rows))
+
+        top_k = ctx.params.get("top_k", 50)
+        exclude_selected = ctx.params.get("exclude_selected", True)
+        with metrics.timer("search"):
+            inds, scores = index.search(
+                query,
+                top_k + len(rows) if exclude_selected else top_k,
+                rerank=ctx.params.get("rerank", 0),
+                **_get_search_modalities(ctx, index),
+            )
+
+        if exclude_selected:
+            keep = ~np.isin(inds, rows)
+            inds, scores = inds[keep][:top_k], scores[keep][:top_k]
+
+        num_segments = _get_num_segments(index)
+        metrics.incr("segments_searched", num_segments)
+        print(f"Searched {num_segments} segments for {len(rows)} selected clips")
+
+        _show_search_results(
+            ctx,
+            ctx.dataset,
+            "similar",
+            index.sample_ids[inds],
+            index.supports[inds],
+            scores,
+            metrics=metrics,
+        )
+
+        return {"num_selected_segments": len(rows), "metrics": metrics.finish()}
+
+
+class FindTwelveLabsDuplicates(foo.Operator):
+    @property
+    def config(self):
+        return foo.OperatorConfig(
+            name="find_twelve_labs_duplicates",
+            label="Find Twelve Labs Duplicates",
+            description="Find near-duplicate clips and repeated content using local Twelve Labs Embeddings",
+            dynamic=True,
+            icon="/assets/search.svg",
+        )
+
+    def resolve_input(self, ctx):
+        inputs = types.Object()
+
+        get_target_view(ctx, inputs)
+
+        if _EMBEDDINGS_FIELD not in _get_field_names(ctx.dataset):
+            inputs.view(
+                "No Embeddings",
+                types.Warning(
+                    label="No embeddings detected",
+                    description="Please run `create twelve labs embeddings` first in order to find duplicates in your dataset!",
+                ),
+            )
+            return types.Property(inputs)
+
+        inputs.float(
+            "threshold",
+            default=0.95,
+            required=True,
+            label="Similarity threshold",
+            description="The minimum cosine similarity for two clips to be duplicates",
+        )
+        inputs.int(
+            "num_neighbors",
+            default=10,
+            required=True,
+            label="Neighbors per clip",
+            description="The number of most similar clips to find for each clip. Clusters are linked through these neighbors",
+        )
+        inputs.str(
+            "output_field",
+            default="duplicates",
+            required=True,
+            label="Output field",
+            description="The field in which to store the duplicate clips of each sample",
+        )
+
+        inputs.view(
+            "notice",
+            types.Notice(
+                label=(
+                    "Every clip is compared against every other clip, so "
+                    "large datasets should be processed as a delegated "
+                    "operation"
+                )
+            ),
+        )
+        _execution_mode(ctx, inputs)
+
+        return types.Property(inputs)
+
+    def resolve_delegation(self, ctx):
+        return ctx.params.get("delegate", False)
+
+    def execute(self, ctx):
+        metrics = Metrics(self.config.name)
+
+        target = ctx.params.get("target", None)
+        target_view = _get_target_view(ctx, target)
+
+        store = _get_segment_store(ctx.dataset, _EMBEDDINGS_FIELD)
+        with metrics.timer("index_load"):
+            index = load_segment_index(target_view, _EMBEDDINGS_FIELD, store=store)
+
+        num_neighbors = ctx.params.get("num_neighbors", 10)
+        print(f"Finding {num_neighbors} neighbors of each of {len(index)} segments")
+        with metrics.timer("knn_graph"):
+            graph = KNNGraph.build(
+                index,
+                num_neighbors,
+                on_progress=make_progress_callback(ctx, "Compared"),
+            )
+
+        with metrics.timer("clustering"):
+            i, j, scores = graph.duplicates(
+                ctx.params.get("threshold", 0.95),
+                sample_ids=index.sample_ids,
+                supports=index.supports,
+            )
+            labels = cluster_pairs(len(index), i, j)
+
+        # Each duplicate is scored by its best match
+        best = np.full(len(index), -np.inf, dtype=np.float32)
+        np.maximum.at(best, i, scores)
+        np.maximum.at(best, j, scores)
+
+        num_clusters = int(labels.max()) + 1 if len(labels) > 0 else 0
+        sizes = np.bincount(labels[labels >= 0], minlength=num_clusters)
+        print(f"Found {len(i)} duplicate pairs in {num_clusters} clusters")
+
+        results = {}
+        for row in np.nonzero(labels >= 0)[0]:
+            sample_id = index.sample_ids[row]
+            if sample_id not in results:
+                results[sample_id] = fo.TemporalDetections(detections=[])
+
+            results[sample_id].detections.append(
+                fo.TemporalDetection(
+                    label="cluster %d" % labels[row],
+                    support=tuple(int(s) for s in index.supports[row]),
+                    confidence=float(best[row]),
+                    cluster=int(labels[row]),
+                    cluster_size=int(sizes[labels[row]]),
+                )
+            )
+
+        output_field = ctx.params.get("output_field", "duplicates")
+        with metrics.timer("db_write"):
+            _set_results(ctx.dataset, results, field=output_field)
+
+        metrics.incr("samples_written", len(results))
+
+        view = target_view.select(list(results.keys()))
+        view = view.to_clips(output_field).sort_by(output_field + ".cluster")
+        ctx.trigger("set_view", {"view": view._serialize()})
+        ctx.ops.set_view(view=view)
+
+        return {
+            "num_segments": len(index),
+            "num_duplicate_pairs": len(i),
+            "num_clusters": num_clusters,
+            "metrics": metrics.finish(),
+        }
+
+
+def get_target_view(ctx, inputs):
+    has_view = ctx.view != ctx.dataset.view()
+    has_selected = bool(ctx.selected)
+    default_target = None
+
+    if has_view or has_selected:
+        target_choices = types.RadioGroup(orientation="horizontal")
+        target_choices.add_choice(
+            "DATASET",
+            label="Entire dataset",
+            description="Process the entire dataset",
+        )
+
+        if has_view:
+            target_choices.add_choice(
+                "CURRENT_VIEW",
+                label="Current view",
+                description="Process the current view",
+            )
+            default_target = "CURRENT_VIEW"
+
+        if has_selected:
+            target_choices.add_choice(
+                "SELECTED_SAMPLES",
+                label="Selected samples",
+                description="Process only the selected samples",
+            )
+            default_target = "SELECTED_SAMPLES"
+
+        inputs.enum(
+            "target",
+            target_choices.values(),
+            default=default_target,
+            required=True,
+            label="Target view",
+            view=target_choices,
+        )
+
+    target = ctx.params.get("target", default_target)
+
+    return _get_target_view(ctx, target)
+
+
+def _get_target_view(ctx, target):
+    if target == "SELECTED_SAMPLES":
+        return ctx.view.select(ctx.selected)
+
+    if target == "DATASET":
+        return ctx.dataset
+
+    return ctx.view
+
+
+IndexInfo = namedtuple("IndexInfo", ["name", "id", "options"])
+
+# Dynamic forms are re-rendered on every keystroke, so index listings and
+# field schemas are cached briefly rather than fetched on every render
+_INDEX_LISTINGS = TTLCache(ttl=300)
+_FIELD_NAMES = TTLCache(ttl=30)
+
+# Creating an index bumps its API key's generation in a store that every
+# process shares, so that listings cached by the App are refreshed after a
+# delegated run creates an index
+_INDEX_GENERATIONS_STORE = "twelve_labs_indexes"
+
+
+def _get_index_generation(api_key):
+    key = hashlib.sha1(api_key.encode()).hexdigest()
+    return ExecutionStore.create(_INDEX_GENERATIONS_STORE).get(key)
+
+
+def _invalidate_index_listings(api_key):
+    key = hashlib.sha1(api_key.encode()).hexdigest()
+    ExecutionStore.create(_INDEX_GENERATIONS_STORE).set(key, time.time())
+    _INDEX_LISTINGS.invalidate()
+
+
+def _list_indexes(api_key):
+    def _fetch():
+        client = get_client(api_key)
+        indexes = []
+        for page in _iter_pages(client.index.list_pagination(page_limit=50)):
+            for index in page:
+                options = set()
+                for model in index.models.root:
+                    options.update(model.options)
+
+                indexes.append(IndexInfo(index.name, index.id, sorted(options)))
+
+        return indexes
+
+    return _INDEX_LISTINGS.get((api_key, _get_index_generation(api_key)), _fetch)
+
+
+def _get_index_id(api_key, index_name):
+    for index in _list_indexes(api_key):
+        if index.name == index_name:
+            return index.id
+
+    # The index may have been created since the listing was cached
+    _invalidate_index_listings(api_key)
+    for index in _list_indexes(api_key):
+        if index.name == index_name:
+            return index.id
+
+    raise ValueError(f"Twelve Labs index '{index_name}' not found")
+
+
+def _iter_pages(result):
+    yield result.data
+    for page in result:
+        yield page
+
+
+def _get_field_names(dataset):
+    key = (dataset.name, dataset._doc.last_modified_at)
+    return _FIELD_NAMES.get(key, lambda: set(dataset.get_field_schema().keys()))
+
+
+def _get_embedding_cache(ctx):
+    if not ctx.params.get("use_cache", True):
+        return None
+
+    cache_dir = os.environ.get(
+        "TL_CACHE_DIR",
+        os.path.join(fo.config.default_dataset_dir, "__twelve_labs_cache__"),
+    )
+    max_size_gb = float(os.environ.get("TL_CACHE_MAX_GB", 10))
+
+    return EmbeddingCache(cache_dir, max_size_bytes=int(max_size_gb * 2**30))
+
+
+def _get_upload_proxies(ctx, keep_audio=True, cache=None, metrics=None):
+    if not ctx.params.get("use_proxies", False):
+        return None
+
+    cache_dir = os.environ.get(
+        "TL_CACHE_DIR",
+        os.path.join(fo.config.default_dataset_dir, "__twelve_labs_cache__"),
+    )
+    max_size_gb = float(os.environ.get("TL_PROXY_CACHE_MAX_GB", 50))
+
+    # Proxies are keyed on the source's content hash, which the embedding
+    # cache memoizes so that unchanged videos are not re-read on every run.
+    # Without a cache of the run's own, one is opened for each hash
+    def content_hash(file_path):
+        if cache is not None:
+            return cache.content_hash(file_path)
+
+        with contextlib.closing(EmbeddingCache(cache_dir)) as _cache:
+            return _cache.content_hash(file_path)
+
+    return UploadProxies(
+        os.path.join(cache_dir, "proxies"),
+        max_size=ctx.params.get("proxy_max_size", PROXY_MAX_SIZE),
+        keep_audio=keep_audio,
+        max_workers=ctx.params.get("proxy_workers", None),
+        max_size_bytes=int(max_size_gb * 2**30),
+        content_hash=content_hash,
+        metrics=metrics,
+    )
+
+
+def _report_proxies(proxies):
+    stats = proxies.stats()
+    print(
+        f"Upload proxies saved {stats['bytes_saved'] / 2**20:.1f} MB of "
+        f"{stats['source_bytes'] / 2**20:.1f} MB "
+        f"({stats['num_transcoded']} transcoded, {stats['num_reused']} reused)"
+    )
+    return stats
+
+
+_QUERY_CACHE = None
+
+
+def _get_query_cache():
+    # The in-memory tier lives as long as the process, so the cache is shared
+    # by every operator run rather than recreated per run
+    global _QUERY_CACHE
+    if _QUERY_CACHE is None:
+        cache_dir = os.environ.get(
+            "TL_CACHE_DIR",
+            os.path.join(fo.config.default_dataset_dir, "__twelve_labs_cache__"),
+        )
+        _QUERY_CACHE = QueryEmbeddingCache(
+            cache_dir,
+            max_entries=int(os.environ.get("TL_QUERY_CACHE_MAX_ENTRIES", 100000)),
+        )
+
+    return _QUERY_CACHE
+
+
+def _embed_prompt(client, prompt, query_cache=None):
+    def _fetch():
+        res = client.embed.create(model_name=_MARENGO_MODEL, text=prompt)
+        return res.text_embedding.segments[0].embeddings_float
+
+    if query_cache is None:
+        return _fetch()
+
+    return query_cache.get(_MARENGO_MODEL, prompt, _fetch)
+
+
+def _get_segment_store(dataset, field, create=False):
+    store_dir = _get_storage_dir(dataset, field)
+    if not create and not os.path.isdir(store_dir):
+        return None
+
+    return SegmentStore(store_dir)
+
+
+def _get_storage_dir(dataset, field):
+    return os.path.join(
+        os.environ.get(
+            "TL_STORE_DIR",
+            os.path.join(fo.config.default_dataset_dir, "__twelve_labs_store__"),
+        ),
+        str(dataset._doc.id),
+        field,
+    )
+
+
+def _get_ann_index_path(dataset, field):
+    return os.path.join(_get_storage_dir(dataset, field), "ann_index.npz")
+
+
+def _load_ann_index(dataset, field):
+    path = _get_ann_index_path(dataset, field)
+    if not os.path.isfile(path):
+        return None
+
+    return IVFPQIndex.load(path)
+
+
+def _get_ann_index(dataset, field, store=None):
+    path = _get_ann_index_path(dataset, field)
+    if os.path.isfile(path):
+        return load_index(path)
+
+    index = load_segment_index(dataset, field, store=store)
+    if len(index) == 0:
+        raise ValueError(
+            "There are no segment embeddings to build an approximate index "
+            "from. Run `create_twelve_labs_embeddings` first"
+        )
+
+    print(f"Building approximate index over {len(index)} segments")
+
+    ann_index = IVFPQIndex.build(
+        index.get_embeddings(np.arange(len(index))),
+        index.sample_ids,
+        index.supports,
+        refs=_get_store_refs(index),
+        options=index.embedding_options,
+    )
+    _save_ann_index(dataset, field, ann_index)
+
+    return ann_index
+
+
+def _save_ann_index(dataset, field, ann_index):
+    # Vectors of re-embedded videos are only marked as deleted, so they are
+    # dropped once they make up a quarter of the index
+    if ann_index.num_deleted > len(ann_index.deleted) // 4:
+        ann_index.compact()
+
+    path = _get_ann_index_path(dataset, field)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ann_index.save(path)
+
+
+def _get_store_refs(index):
+    refs = np.full(len(index), -1, dtype=np.int64)
+    if index.refs is not None:
+        refs[: len(index.embeddings)] = index.refs
+
+    refs[len(index.embeddings) :] = index.store_rows
+    return refs
+
+
+def _get_or_create_index(client, api_key, index_name, options, resume):
+    if resume:
+        for index in client.index.list(name=index_name):
+            if index.name == index_name:
+                print(f"Resuming index {index_name} ({index.id})")
+                return index.id
+
+    index = client.index.create(
+        name=index_name,
+        models=[{"name": "marengo2.7", "options": options}],
+    )
+    _invalidate_index_listings(api_key)
+    return index.id
+
+
+def _search_index(client, index_id, prompt, options, target_view, index_field, top_k):
+    search_results = client.search.query(
+        index_id=index_id,
+        query_text=prompt,
+        options=options,
+        operator="and" if len(options) >= 2 else None,
+        page_limit=min(top_k, 50),
+    )
+
+    videos = target_view.exists(index_field)
+    video_samples = {
+        video_id: (sample_id, frame_rate)
+        for video_id, sample_id, frame_rate in zip(
+            *videos.values([index_field, "id", "metadata.frame_rate"])
+        )
+    }
+
+    # Pages are only fetched until top_k hits on the target view are found
+    hits = itertools.islice(
+        (
+            hit
+            for page in _iter_pages(search_results)
+            for hit in page
+            if hit.video_id in video_samples
+        ),
+        top_k,
+    )
+
+    sample_ids = []
+    supports = []
+    scores = []
+    for hit in hits:
+        sample_id, frame_rate = video_samples[hit.video_id]
+        sample_ids.append(sample_id)
+        supports.append(
+            (int(hit.start * frame_rate) + 1, int(hit.end * frame_rate) + 1)
+        )
+        scores.append(hit.score)
+
+    return sample_ids, supports, scores
+
+
+def _show_search_results(
+    ctx,
+    target_view,
+    prompt,
+    sample_ids,
+    supports,
+    scores,
+    sort_by="CLIP",
+    metrics=None,
+):
+    if metrics is None:
+        metrics = Metrics("search")
+
+    results = {}
+    for sample_id, support, score in zip(sample_ids, supports, scores):
+        if sample_id not in results:
+            results[sample_id] = fo.TemporalDetections(detections=[])
+
+        results[sample_id].detections.append(
+            fo.TemporalDetection(
+                label=prompt,
+                support=tuple(int(s) for s in support),
+                confidence=float(score),
+            )
+        )
+
+    with metrics.timer("db_write"):
+        _set_results(ctx.dataset, results)
+
+    metrics.incr("samples_written", len(results))
+
+    with metrics.timer("view"):
+        # Results are sorted by descending score, so the samples are in order
+        # of their best matching clip
+        view1 = target_view.select(list(results.keys()), ordered=True)
+        print(f"Found {len(view1)} samples")
+
+        if sort_by == "VIDEO":
+            view2 = view1
+        else:
+            view2 = view1.to_clips("results").sort_by(
+                "results.confidence", reverse=True
+            )
+
+        ctx.trigger("set_view", {"view": view2._serialize()})
+        ctx.ops.set_view(view=view2)
+
+
+def _set_results(dataset, results, field="results"):
+    # Only samples that gain or lose results are written, rather than
+    # dropping the field from every sample on each query
+    schema_field = dataset.get_field(field)
+    if (
+        schema_field is not None
+        and schema_field.document_type is not fo.TemporalDetections
+    ):
+        dataset.delete_sample_field(field)
+        schema_field = None
+
+    values = dict(results)
+    if schema_field is not None:
+        for sample_id in dataset.exists(field).values("id"):
+            values.setdefault(sample_id, None)
+
+    dataset.set_values(field, values, key_field="id")
+
+
+def _get_batch_prompts(ctx):
+    prompts = list(ctx.params.get("prompts", None) or [])
+
+    prompts_path = ctx.params.get("prompts_path", None)
+    if prompts_path:
+        with open(prompts_path) as f:
+            prompts.extend(f.read().splitlines())
+
+    # Blank lines are skipped, and repeated prompts are searched once
+    prompts = [prompt.strip() for prompt in prompts]
+    return list(dict.fromkeys(prompt for prompt in prompts if prompt))
+
+
+def _get_selected_clips(ctx):
+    # In clips views, the selected clips are matched to the segments of their
+    # source samples. Otherwise every segment of a selected sample matches
+    if not ctx.selected:
+        return []
+
+    if ctx.view._is_clips:
+        sample_ids, supports = ctx.view.select(ctx.selected).values(
+            ["sample_id", "support"]
+        )
+        return list(zip(sample_ids, supports))
+
+    return [(sample_id, None) for sample_id in ctx.selected]
+
+
+def _get_prompt_fields(prefix, prompts):
+    fields = []
+    used = set()
+    for prompt in prompts:
+        name = re.sub(r"[^0-9a-z]+", "_", prompt.lower()).strip("_")[:48]
+        field = "%s_%s" % (prefix, name or "prompt")
+        i = 1
+        while field in used:
+            i += 1
+            field = "%s_%s_%d" % (prefix, name or "prompt", i)
+
+        used.add(field)
+        fields.append(field)
+
+    return fields
+
+
+_EmbedJob = namedtuple("_EmbedJob", ["sample", "chunk", "num_chunks"])
+
+
+def _get_search_modalities(ctx, index):
+    # Segments embedded before their modality was recorded are loaded into a
+    # plain SegmentIndex, which scores every segment together
+    if not isinstance(index, MultimodalIndex):
+        print(
+            "Segments do not record their modality, so all modalities are "
+            "scored together. Re-run `create twelve labs embeddings` to "
+            "search by modality"
+        )
+        return {}
+
+    return {
+        "options": _get_search_options(ctx),
+        "operator": ctx.params.get("modality_operator", "OR").lower(),
+        "weights": {
+            _MODALITY_OPTIONS[modality]: ctx.params.get(modality + "_weight", 1.0)
+            for modality in _MODALITY_OPTIONS
+        },
+    }
+
+
+def _get_search_options(ctx):
+    return [
+        option
+        for modality, option in _MODALITY_OPTIONS.items()
+        if ctx.params.get(modality, True)
+    ]
+
+
+def _best_per_clip(sample_ids, supports, k):
+    # Returns the indices of the first ``k`` distinct clips of the given
+    # results, which are sorted best first
+    keep = []
+    seen = set()
+    for i, (sample_id, support) in enumerate(zip(sample_ids, supports)):
+        clip = (sample_id, tuple(support))
+        if clip not in seen:
+            seen.add(clip)
+            keep.append(i)
+            if len(keep) >= k:
+                break
+
+    return np.asarray(keep, dtype=np.int64)
+
+
+def _get_num_segments(index):
+    if isinstance(index, MultimodalIndex):
+        return index.num_segments
+
+    return len(index)
+
+
+def _create_embed_task(client, file_path):
+    task = client.embed.task.create(
+        model_name=_MARENGO_MODEL,
+        video_file=file_path,
+    )
+    return task.id
+
+
+def _get_embed_task_status(client, task_id):
+    return client.embed.task.status(task_id).status
+
+
+def _retrieve_embeddings(client, task_id, embedding_options):
+    task = client.embed.task.retrieve(task_id, embedding_option=embedding_options)
+    return task.video_embedding.segments
+
+
+def _get_index_task_status(client, task_id):
+    return client.task.retrieve(task_id).status
+
+
+def get_twelve_id_from_name(INDEXES_URL, headers, INDEX_NAME):
+    response = requests.get(INDEXES_URL, headers=headers)
+    INDEX_ID = None
+    for index in response.json()["data"]:
+        if index["index_name"] == INDEX_NAME:
+            INDEX_ID = index["_id"]
+    return INDEX_ID
+
+
+_BRAIN_RUN_TYPES = {
+    "similarity": Similarity,
+}
+
+
+def get_brain_key(
+    ctx,
+    inputs,
+    label="Brain key",
+    description="Select a brain key",
+    run_type="similarity",
+    show_default=True,
+):
+    type = _BRAIN_RUN_TYPES.get(run_type, None)
+    brain_keys = ctx.dataset.list_brain_runs(type=type)
 
     if not brain_keys:
         message = "This dataset has no text similarity brain runs"
@@ -638,17 +2376,18 @@ def get_brain_key(
 
         return
 
+    # Custom models are not stored on brain runs, so indexes of Twelve Labs
+    # embeddings are recognized by the model name they were built with
     text_brain_keys = []
     for brain_key in brain_keys:
-        info = ctx.dataset.get_brain_info(brain_key)
-        if info.config.supports_prompts:
+        if is_twelve_labs_index(ctx.dataset, brain_key, _MARENGO_MODEL):
             text_brain_keys.append(brain_key)
     if len(text_brain_keys) < 1:
-        message = "This dataset has no text similarity brain runs"
+        message = "This dataset has no Twelve Labs similarity indexes"
 
         warning = types.Warning(
             label=message,
-            description="https://docs.voxel51.com/user_guide/brain.html",
+            description="Run `create twelve labs embeddings` with `Build similarity index` checked",
         )
         prop = inputs.view("warning", warning)
         prop.invalid = True
@@ -656,10 +2395,10 @@ def get_brain_key(
         return
 
     choices = types.DropdownView()
-    for brain_key in brain_keys:
+    for brain_key in text_brain_keys:
         choices.add_choice(brain_key, label=brain_key)
 
-    default = brain_keys[0] if show_default else None
+    default = text_brain_keys[0] if show_default else None
     inputs.str(
         "brain_key",
         default=default,
@@ -672,6 +2411,426 @@ def get_brain_key(
     return ctx.params.get("brain_key", None)
 
 
+def _segments_digest(segments):
+    h = hashlib.sha1()
+    for segment in segments:
+        h.update(
+            np.array(
+                [segment.start_offset_sec, segment.end_offset_sec], dtype=np.float64
+            ).tobytes()
+        )
+        h.update(np.asarray(segment.embeddings_float, dtype=np.float32).tobytes())
+
+    return h.hexdigest()
+
+
+def _get_stored_refs(store, sample_id, digest, existing):
+    # The store never reclaims rows in place, so segments that it already
+    # holds for this sample are referenced again rather than appended
+    if existing is None or getattr(existing, "segments_digest", None) != digest:
+        return None
+
+    refs = [getattr(det, "embedding_ref", None) for det in existing.detections]
+    if not refs or any(ref is None or ref >= len(store) for ref in refs):
+        return None
+
+    records = store.records()[refs]
+    if np.any(records["sample_id"] != str(sample_id).encode()):
+        return None
+
+    return refs
+
+
+def _reuse_label_ids(dets, digest, existing):
+    if existing is None or getattr(existing, "segments_digest", None) != digest:
+        return
+
+    if len(existing.detections) != len(dets):
+        return
+
+    for det, old in zip(dets, existing.detections):
+        det.id = old.id
+
+
+def _get_shard_view(ctx, target_view):
+    shard_index = ctx.params.get("shard_index", None)
+    if shard_index is None:
+        return target_view
+
+    return select_shard(target_view, shard_index, ctx.params["num_shards"])
+
+
+def _make_progress_callback(ctx, label):
+    on_progress = make_progress_callback(ctx, label)
+    shard_index = ctx.params.get("shard_index", None)
+    if shard_index is None:
+        return on_progress
+
+    # Shards also record their progress on the run, where it is aggregated
+    run = ShardedRun.from_context(ctx)
+
+    def _on_progress(done, total):
+        on_progress(done, total)
+        run.set_progress(shard_index, done, total)
+
+    return _on_progress
+
+
+def _execute_sharded(ctx, execute, prepare=None, finalize=None, label=None):
+    # The parent queues the shards that still need to run, and the shard that
+    # finishes last finalizes the run. If every shard has already completed,
+    # the parent finalizes it instead
+    num_shards = ctx.params.get("num_shards") or 1
+    if num_shards <= 1:
+        return execute(ctx)
+
+    run = ShardedRun.from_context(ctx)
+    shard_index = ctx.params.get("shard_index", None)
+    if shard_index is None:
+        target_view = _get_target_view(ctx, ctx.params.get("target", None))
+        params = prepare(ctx) if prepare is not None else None
+        results = run.schedule(ctx, target_view, num_shards, params=params, label=label)
+        print(
+            f"Queued {len(results['queued'])} of {num_shards} shards, "
+            f"{len(results['completed'])} already completed and "
+            f"{len(results['in_progress'])} in progress"
+        )
+
+        # If every shard has already completed, the run is finalized here,
+        # which also retries a finalization that failed
+        if not results["queued"] and not results["in_progress"]:
+            results["run"] = _finalize_sharded_run(ctx, run, finalize)
+
+        return results
+
+    run.start(shard_index)
+    try:
+        results = execute(ctx)
+    except Exception as e:
+        if run.complete(shard_index, error=str(e)):
+            _finalize_sharded_run(ctx, run, finalize)
+
+        raise
+
+    shard_results = {k: v for k, v in results.items() if k != "metrics"}
+    if run.complete(shard_index, result=shard_results):
+        results["run"] = _finalize_sharded_run(ctx, run, finalize)
+
+    return results
+
+
+def _finalize_sharded_run(ctx, run, finalize):
+    extra = finalize(ctx) if finalize is not None else None
+    results = run.finalize(extra=extra)
+
+    num_failed = len(results["failed_shards"])
+    print(
+        f"Sharded run {run.run_key} finished, "
+        f"{run.get_info()['num_shards'] - num_failed} shards completed and "
+        f"{num_failed} failed"
+    )
+    return results
+
+
+def _finalize_embeddings(ctx):
+    results = {}
+
+    # Shards skip the approximate index, so it is brought up to date with
+    # every sample of the run at once
+    ann_index = _load_ann_index(ctx.dataset, _EMBEDDINGS_FIELD)
+    if ann_index is not None:
+        target_view = _get_target_view(ctx, ctx.params.get("target", None))
+        sample_ids = target_view.values("id")
+        store = _get_segment_store(ctx.dataset, _EMBEDDINGS_FIELD)
+        index = load_segment_index(
+            ctx.dataset.select(sample_ids), _EMBEDDINGS_FIELD, store=store
+        )
+
+        ann_index.remove_samples(sample_ids)
+        ann_index.add(
+            index.get_embeddings(np.arange(len(index))),
+            index.sample_ids,
+            index.supports,
+            refs=_get_store_refs(index),
+            options=index.embedding_options,
+        )
+        _save_ann_index(ctx.dataset, _EMBEDDINGS_FIELD, ann_index)
+        print(f"Updated approximate index with {len(index)} segments")
+
+    if ctx.params.get("similarity_index", False):
+        results["similarity_index"] = _update_similarity_index(ctx)
+
+    if ctx.params.get("compact_store", False):
+        results["store_compaction"] = _compact_segment_store(ctx.dataset)
+
+    return results
+
+
+def _prepare_index_shards(ctx):
+    # Shards would each create their own index, so the parent resolves it
+    client = get_client(ctx.secret("TL_API_KEY"))
+    options = [m for m in _MODALITY_OPTIONS if ctx.params.get(m)]
+    index_id = _get_or_create_index(
+        client,
+        ctx.secret("TL_API_KEY"),
+        ctx.params.get("index_name"),
+        options,
+        ctx.params.get("resume", True),
+    )
+    return {"index_id": index_id}
+
+
+def _update_similarity_index(ctx):
+    brain_key = ctx.params.get("brain_key", _BRAIN_KEY)
+    num_added, num_removed = update_similarity_index(
+        ctx.dataset,
+        _EMBEDDINGS_FIELD,
+        brain_key,
+        _MARENGO_MODEL,
+        store=_get_segment_store(ctx.dataset, _EMBEDDINGS_FIELD),
+    )
+    print(
+        f"Added {num_added} and removed {num_removed} clips in "
+        f"similarity index '{brain_key}'"
+    )
+    return {"brain_key": brain_key, "num_added": num_added, "num_removed": num_removed}
+
+
+def _compact_segment_store(dataset):
+    store = _get_segment_store(dataset, _EMBEDDINGS_FIELD)
+    if store is None:
+        return None
+
+    view = dataset.exists(_EMBEDDINGS_FIELD)
+    path = _EMBEDDINGS_FIELD + ".detections.embedding_ref"
+    refs = view.values(path)
+    live = [ref for _refs in refs for ref in _refs or [] if ref is not None]
+
+    num_rows = len(store)
+    remap = store.compact(live)
+
+    view.set_values(
+        path,
+        [
+            [None if ref is None else int(remap[ref]) for ref in _refs or []]
+            for _refs in refs
+        ],
+    )
+    bump_index_version(dataset, _EMBEDDINGS_FIELD)
+
+    ann_index = _load_ann_index(dataset, _EMBEDDINGS_FIELD)
+    if ann_index is not None:
+        refs = ann_index.refs
+        ann_index.refs = np.where(refs >= 0, remap[np.maximum(refs, 0)], -1)
+        _save_ann_index(dataset, _EMBEDDINGS_FIELD, ann_index)
+
+    print(f"Compacted on-disk store from {num_rows} to {len(store)} rows")
+    return {"num_rows_before": num_rows, "num_rows_after": len(store)}
+
+
+def _get_embeddable_view(
+    target_view, num_workers=None, split_long_videos=False, metrics=None
+):
+    # Only probe samples that are missing the metadata we filter on
+    missing = target_view.match(
+        (F("metadata.duration") == None) | (F("metadata.frame_rate") == None)
+    )
+    if len(missing) > 0:
+        print(f"Computing metadata for {len(missing)} samples")
+        start = time.perf_counter()
+        missing.compute_metadata(overwrite=True, num_workers=num_workers)
+        if metrics is not None:
+            metrics.add_time("metadata", time.perf_counter() - start)
+
+    # Twelve Labs only accepts videos between 4 seconds and 2 hours long.
+    # Longer videos can be split into chunks
+    if split_long_videos:
+        return target_view.match(F("metadata.duration") >= 4)
+
+    return target_view.match(
+        (F("metadata.duration") >= 4) & (F("metadata.duration") <= MAX_VIDEO_DURATION)
+    )
+
+
+def _rerank_candidates(ctx, inputs):
+    inputs.int(
+        "rerank",
+        default=0,
+        label="Re-rank candidates",
+        description="For compact embeddings backed by the on-disk store, the number of best candidates to re-score at full precision. 0 disables re-ranking",
+    )
+
+
+def _search_modalities(ctx, inputs, combine=True):
+    inputs.bool(
+        "visual",
+        default=True,
+        label="visual",
+        description="",
+        view=types.CheckboxView(),
+    )
+    inputs.bool(
+        "audio",
+        default=True,
+        label="audio",
+        description="Video must have audio to work!",
+        view=types.CheckboxView(),
+    )
+
+    # Methods that cannot combine modalities score each clip by its best one
+    if not combine:
+        return
+
+    if not (ctx.params.get("visual", True) and ctx.params.get("audio", True)):
+        return
+
+    operator_choices = types.RadioGroup(orientation="horizontal")
+    operator_choices.add_choice(
+        "OR",
+        label="Or",
+        description="Score each clip by its best matching modality",
+    )
+    operator_choices.add_choice(
+        "AND",
+        label="And",
+        description="Score each clip by its worst matching modality, so clips must match both",
+    )
+    operator_choices.add_choice(
+        "WEIGHTED",
+        label="Weighted",
+        description="Score each clip by a weighted mean of its modality scores",
+    )
+    inputs.enum(
+        "modality_operator",
+        operator_choices.values(),
+        default="OR",
+        required=True,
+        label="Combine modalities",
+        description="Segments embedded before modalities were recorded are scored together regardless",
+        view=operator_choices,
+    )
+
+    if ctx.params.get("modality_operator", "OR") == "WEIGHTED":
+        inputs.float(
+            "visual_weight",
+            default=1.0,
+            required=True,
+            label="Visual weight",
+        )
+        inputs.float(
+            "audio_weight",
+            default=1.0,
+            required=True,
+            label="Audio weight",
+        )
+
+
+def _sort_results(ctx, inputs):
+    sort_choices = types.RadioGroup(orientation="horizontal")
+    sort_choices.add_choice(
+        "CLIP",
+        label="Clips",
+        description="Show the matching clips, best first",
+    )
+    sort_choices.add_choice(
+        "VIDEO",
+        label="Videos",
+        description="Show the videos with matching clips, ordered by their best clip",
+    )
+    inputs.enum(
+        "sort_by",
+        sort_choices.values(),
+        default="CLIP",
+        label="Sort by",
+        view=sort_choices,
+    )
+
+
+def _upload_proxies(ctx, inputs):
+    inputs.bool(
+        "use_proxies",
+        default=False,
+        label="Upload proxies",
+        description="Transcode videos to a smaller proxy before uploading them. Requires ffmpeg",
+        view=types.CheckboxView(),
+    )
+
+    if ctx.params.get("use_proxies", False):
+        inputs.int(
+            "proxy_max_size",
+            default=PROXY_MAX_SIZE,
+            required=True,
+            label="Proxy resolution",
+            description="The maximum length of the shorter side of each proxy, in pixels",
+        )
+        inputs.int(
+            "proxy_workers",
+            label="Proxy workers",
+            description="The number of videos to transcode in parallel. By default, half the number of CPUs",
+        )
+
+
+def _similarity_index(ctx, inputs):
+    inputs.bool(
+        "similarity_index",
+        default=False,
+        label="Build similarity index",
+        description="Register the clip embeddings as a FiftyOne Brain similarity index, updated with the new clips of every run",
+        view=types.CheckboxView(),
+    )
+
+    if ctx.params.get("similarity_index", False):
+        inputs.str(
+            "brain_key",
+            default=_BRAIN_KEY,
+            required=True,
+            label="Brain key",
+            description="The brain key of the similarity index",
+        )
+
+
+def _num_shards(ctx, inputs):
+    inputs.int(
+        "num_shards",
+        default=1,
+        required=True,
+        label="Shards",
+        description="Split the target view into this many shards, each run as its own delegated operation so that several workers can process them at once. Running again with the same settings only redoes shards that failed",
+    )
+
+    if (ctx.params.get("num_shards") or 1) <= 1:
+        return
+
+    summary = ShardedRun.from_context(ctx).summary()
+    if summary is not None:
+        shards = ", ".join(f"{n} {status}" for status, n in summary["shards"].items())
+        inputs.message(
+            "shard_status",
+            label=f"Sharded run {summary['status']}",
+            description=f"{summary['done']}/{summary['total']} samples processed. Shards: {shards}",
+        )
+
+
+def _metadata_workers(ctx, inputs):
+    inputs.int(
+        "num_workers",
+        default=8,
+        required=True,
+        label="Metadata workers",
+        description="The number of workers to use when computing missing video metadata",
+    )
+
+
+def _write_batch_size(ctx, inputs):
+    inputs.int(
+        "batch_size",
+        default=100,
+        required=True,
+        label="Write batch size",
+        description="The number of samples to buffer before writing results to the database",
+    )
+
+
 def _execution_mode(ctx, inputs):
     delegate = ctx.params.get("delegate", False)
 
@@ -706,5 +2865,10 @@ def _execution_mode(ctx, inputs):
 
 def register(plugin):
     plugin.register(TwelveLabsIndexSearch)
+    plugin.register(TwelveLabsSemanticSearch)
+    plugin.register(TwelveLabsHybridSearch)
+    plugin.register(TwelveLabsBatchSearch)
+    plugin.register(TwelveLabsSimilarClips)
+    plugin.register(FindTwelveLabsDuplicates)
     plugin.register(CreateTwelveLabsEmbeddings)
     plugin.register(CreateTwelveLabsIndex)
@@ -0,0 +1,488 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from .search import top_k
+
+
+class IVFPQIndex(object):
+    """Inverted file index with product-quantized residuals.
+
+    Vectors are L2-normalized and assigned to the nearest of ``nlist``
+    spherical k-means centroids. The residual from that centroid is split
+    into ``m`` subvectors, each encoded as the index of its nearest entry in
+    a 256-entry codebook. Inner products are approximated as
+    ``q . c + sum_j q_j . codebook_j[code_j]``, which only requires a
+    ``(m, 256)`` lookup table per query.
+
+    At query time only the ``nprobe`` lists whose centroids best match the
+    query are scanned, so ``nprobe`` trades recall for latency.
+
+    Every vector has an integer ID that indexes into ``sample_ids``,
+    ``supports``, ``options`` and ``refs``, so search results can be turned
+    into clips without touching the segment embeddings again. When vectors also live in
+    a :class:`store.SegmentStore`, ``refs`` holds their store rows and the
+    best candidates can be re-scored exactly.
+    """
+
+    def __init__(self, nlist, m=64, nbits=8):
+        self.nlist = nlist
+        self.m = m
+        self.ksub = 2**nbits
+
+        self.centroids = None
+        self.codebooks = None
+
+        self.sample_ids = np.empty(0, dtype="S24")
+        self.supports = np.empty((0, 2), dtype=np.int64)
+        self.options = np.empty(0, dtype="U16")
+        self.refs = np.empty(0, dtype=np.int64)
+        self.deleted = np.empty(0, dtype=bool)
+
+        self._lists = None
+
+    def __len__(self):
+        return int(np.count_nonzero(~self.deleted))
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    @classmethod
+    def build(
+        cls,
+        embeddings,
+        sample_ids,
+        supports,
+        refs=None,
+        options=None,
+        nlist=None,
+        m=64,
+        max_train=100000,
+    ):
+        """Trains an index on the given embeddings and adds them to it."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.size == 0:
+            raise ValueError("Cannot build an index from zero embeddings")
+
+        n, d = embeddings.shape
+
+        if nlist is None:
+            nlist = int(np.clip(4 * np.sqrt(n), 1, 65536))
+
+        m = _largest_divisor(d, m)
+        index = cls(min(nlist, n), m=m)
+        index.train(embeddings, max_train=max_train)
+        index.add(embeddings, sample_ids, supports, refs=refs, options=options)
+        return index
+
+    def train(self, embeddings, max_train=100000, num_iters=10, seed=51):
+        rng = np.random.default_rng(seed)
+        x = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if len(x) > max_train:
+            x = x[rng.choice(len(x), max_train, replace=False)]
+
+        self.centroids = _kmeans(x, self.nlist, num_iters, rng, spherical=True)
+
+        assign = _assign(x, self.centroids)
+        residuals = x - self.centroids[assign]
+
+        # Codebooks only have 256 entries each, so a smaller training set
+        # suffices
+        if len(residuals) > 64 * self.ksub:
+            inds = rng.choice(len(residuals), 64 * self.ksub, replace=False)
+            residuals = residuals[inds]
+
+        dsub = x.shape[1] // self.m
+        ksub = min(self.ksub, len(residuals))
+        self.codebooks = np.stack(
+            [
+                _kmeans(_subvectors(residuals, j, dsub), ksub, num_iters, rng)
+                for j in range(self.m)
+            ]
+        )
+        self._lists = [[] for _ in range(self.nlist)]
+
+    def add(self, embeddings, sample_ids, supports, refs=None, options=None):
+        """Adds vectors to a trained index.
+
+        ``options`` optionally holds the modality of each vector, such as
+        ``"visual-text"`` or ``"audio"``.
+
+        Returns:
+            the integer IDs of the added vectors
+        """
+        x = _normalize(np.asarray(embeddings, dtype=np.float32))
+        start = len(self.sample_ids)
+        ids = np.arange(start, start + len(x), dtype=np.int64)
+
+        self.sample_ids = np.concatenate(
+            [self.sample_ids, np.asarray(sample_ids, dtype="S24")]
+        )
+        self.supports = np.concatenate(
+            [self.supports, np.reshape(supports, (-1, 2)).astype(np.int64)]
+        )
+        if refs is None:
+            refs = np.full(len(x), -1, dtype=np.int64)
+
+        if options is None:
+            options = [None] * len(x)
+
+        # Vectors of unknown modality are stored as ""
+        self.options = np.concatenate(
+            [self.options, np.asarray([o or "" for o in options], dtype="U16")]
+        )
+        self.refs = np.concatenate([self.refs, np.asarray(refs, dtype=np.int64)])
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(x), dtype=bool)])
+
+        if len(x) == 0:
+            return ids
+
+        assign = _assign(x, self.centroids)
+        codes = self._encode(x - self.centroids[assign])
+
+        order = np.argsort(assign, kind="stable")
+        lists, starts = np.unique(assign[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for l, s, e in zip(lists, starts, ends):
+            inds = order[s:e]
+            self._lists[l].append((ids[inds], codes[inds]))
+
+        return ids
+
+    def remove_samples(self, sample_ids):
+        """Marks all vectors of the given samples as deleted."""
+        sample_ids = np.asarray([str(_id) for _id in sample_ids], dtype="S24")
+        self.deleted |= np.isin(self.sample_ids, sample_ids)
+
+    @property
+    def num_deleted(self):
+        return int(np.count_nonzero(self.deleted))
+
+    def compact(self):
+        """Drops the vectors that are marked as deleted, renumbering the IDs
+        of the remaining vectors.
+        """
+        keep = ~self.deleted
+        remap = np.full(len(self.deleted), -1, dtype=np.int64)
+        remap[keep] = np.arange(np.count_nonzero(keep))
+
+        for l in range(self.nlist):
+            entry = self._get_list(l)
+            if entry is None:
+                continue
+
+            ids, codes = entry
+            alive = keep[ids]
+            self._lists[l] = (
+                [(remap[ids[alive]], codes[alive])] if np.any(alive) else []
+            )
+
+        self.sample_ids = self.sample_ids[keep]
+        self.supports = self.supports[keep]
+        self.options = self.options[keep]
+        self.refs = self.refs[keep]
+        self.deleted = self.deleted[keep]
+
+    def _encode(self, residuals):
+        dsub = residuals.shape[1] // self.m
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = _subvectors(residuals, j, dsub)
+            codes[:, j] = _assign(sub, self.codebooks[j], metric="l2")
+
+        return codes
+
+    def _get_list(self, l):
+        chunks = self._lists[l]
+        if len(chunks) > 1:
+            ids = np.concatenate([c[0] for c in chunks])
+            codes = np.concatenate([c[1] for c in chunks])
+            chunks[:] = [(ids, codes)]
+
+        if not chunks:
+            return None
+
+        return chunks[0]
+
+    def search(
+        self,
+        query,
+        k,
+        nprobe=16,
+        sample_ids=None,
+        options=None,
+        store=None,
+        refine_factor=4,
+    ):
+        """Returns the IDs and scores of the ``k`` best matching vectors,
+        sorted by descending score.
+
+        Args:
+            query: the query vector
+            k: the number of results
+            nprobe: the number of inverted lists to scan
+            sample_ids: an optional iterable of sample IDs to restrict the
+                results to
+            options: an optional list of modalities to restrict the results
+                to. Vectors of unknown modality always match
+            store: an optional :class:`store.SegmentStore` holding the
+                full-precision vectors. If provided, the best
+                ``refine_factor * k`` candidates are re-scored exactly
+            refine_factor: the candidate multiplier for re-scoring
+        """
+        q = _normalize(np.asarray(query, dtype=np.float32).ravel())
+
+        coarse = self.centroids @ q
+        probe, _ = top_k(coarse, nprobe)
+
+        dsub = len(q) // self.m
+        lut = np.einsum("jkd,jd->jk", self.codebooks, q.reshape(self.m, dsub))
+
+        all_ids = []
+        all_scores = []
+        for l in probe:
+            entry = self._get_list(l)
+            if entry is None:
+                continue
+
+            ids, codes = entry
+            scores = coarse[l] + lut[np.arange(self.m), codes].sum(axis=1)
+            all_ids.append(ids)
+            all_scores.append(scores)
+
+        if not all_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        ids = np.concatenate(all_ids)
+        scores = np.concatenate(all_scores)
+
+        keep = ~self.deleted[ids]
+        if sample_ids is not None:
+            allowed = np.asarray([str(_id) for _id in sample_ids], dtype="S24")
+            keep &= np.isin(self.sample_ids[ids], allowed)
+
+        if options is not None:
+            keep &= np.isin(self.options[ids], list(options) + [""])
+
+        ids = ids[keep]
+        scores = scores[keep]
+
+        if store is None:
+            inds, scores = top_k(scores, k)
+            return ids[inds], scores
+
+        inds, scores = top_k(scores, refine_factor * k)
+        ids = ids[inds]
+        refs = self.refs[ids]
+        exact = refs >= 0
+        if np.any(exact):
+            vectors = store.get(refs[exact])
+            scores[exact] = _normalize(vectors) @ q
+
+        inds, scores = top_k(scores, k)
+        return ids[inds], scores
+
+    def save(self, path):
+        lists = [self._get_list(l) for l in range(self.nlist)]
+        list_sizes = np.array([0 if e is None else len(e[0]) for e in lists])
+        nonempty = [e for e in lists if e is not None]
+        if nonempty:
+            ids = np.concatenate([e[0] for e in nonempty])
+            codes = np.concatenate([e[1] for e in nonempty])
+        else:
+            ids = np.empty(0, dtype=np.int64)
+            codes = np.empty((0, self.m), dtype=np.uint8)
+
+        # The index is written aside and moved into place, so that readers
+        # never load a partially written file
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                nlist=self.nlist,
+                m=self.m,
+                ksub=self.ksub,
+                centroids=self.centroids,
+                codebooks=self.codebooks,
+                sample_ids=self.sample_ids,
+                supports=self.supports,
+                options=self.options,
+                refs=self.refs,
+                deleted=self.deleted,
+                list_sizes=list_sizes,
+                ids=ids,
+                codes=codes,
+            )
+
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(int(data["nlist"]), m=int(data["m"]))
+            index.ksub = int(data["ksub"])
+            index.centroids = data["centroids"]
+            index.codebooks = data["codebooks"]
+            index.sample_ids = data["sample_ids"]
+            index.supports = data["supports"]
+            index.refs = data["refs"]
+
+            # Indexes saved before modalities were recorded
+            if "options" in data:
+                index.options = data["options"]
+            else:
+                index.options = np.full(len(index.refs), "", dtype="U16")
+
+            index.deleted = data["deleted"]
+
+            ids = data["ids"]
+            codes = data["codes"]
+            offsets = np.concatenate([[0], np.cumsum(data["list_sizes"])])
+
+        index._lists = []
+        for s, e in zip(offsets[:-1], offsets[1:]):
+            index._lists.append([(ids[s:e], codes[s:e])] if e > s else [])
+
+        return index
+
+
+_INDEX_CACHE = {}
+_INDEX_CACHE_LOCK = threading.Lock()
+_INDEX_CACHE_SIZE = 4
+
+
+def load_index(path):
+    """Loads the :class:`IVFPQIndex` saved at the given path, reusing a
+    previously loaded index if the file has not changed since.
+
+    The returned index is shared between callers, so use
+    :meth:`IVFPQIndex.load` to load an index that will be modified.
+    """
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    with _INDEX_CACHE_LOCK:
+        entry = _INDEX_CACHE.get(path, None)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+    index = IVFPQIndex.load(path)
+
+    with _INDEX_CACHE_LOCK:
+        _INDEX_CACHE.pop(path, None)
+        while len(_INDEX_CACHE) >= _INDEX_CACHE_SIZE:
+            _INDEX_CACHE.pop(next(iter(_INDEX_CACHE)))
+
+        _INDEX_CACHE[path] = (version, index)
+
+    return index
+
+
+def evaluate_recall(
+    index, embeddings, queries, k=10, nprobes=(1, 4, 16, 64), store=None
+):
+    """Measures recall@k and latency of ``index`` against exact search.
+
+    Args:
+        index: an :class:`IVFPQIndex` containing ``embeddings`` as IDs
+            ``0, ..., len(embeddings) - 1``
+        embeddings: the indexed vectors
+        queries: the query vectors
+        k: the number of results per query
+        nprobes: the ``nprobe`` values to evaluate
+        store: an optional :class:`store.SegmentStore` to re-score
+            candidates with
+
+    Returns:
+        a list of dicts with ``nprobe``, ``recall``, ``latency_ms`` and
+        ``exact_latency_ms`` keys
+    """
+    x = _normalize(np.asarray(embeddings, dtype=np.float32))
+    queries = np.asarray(queries, dtype=np.float32)
+
+    exact = []
+    start = time.perf_counter()
+    for q in queries:
+        inds, _ = top_k(x @ _normalize(q), k)
+        exact.append(set(inds.tolist()))
+
+    exact_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+    report = []
+    for nprobe in nprobes:
+        hits = 0
+        start = time.perf_counter()
+        results = [index.search(q, k, nprobe=nprobe, store=store)[0] for q in queries]
+        latency_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+        for ids, truth in zip(results, exact):
+            hits += len(truth.intersection(ids.tolist()))
+
+        report.append(
+            {
+                "nprobe": nprobe,
+                "recall": hits / (k * len(queries)),
+                "latency_ms": latency_ms,
+                "exact_latency_ms": exact_ms,
+            }
+        )
+
+    return report
+
+
+def _normalize(x):
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return x / norms
+
+
+def _largest_divisor(d, m):
+    m = max(1, min(m, d))
+    while d % m:
+        m -= 1
+
+    return m
+
+
+def _subvectors(x, j, dsub):
+    return np.ascontiguousarray(x[:, j * dsub : (j + 1) * dsub])
+
+
+def _assign(x, centroids, metric="ip", batch_size=8192):
+    out = np.empty(len(x), dtype=np.int64)
+    if metric == "l2":
+        half_norms = 0.5 * np.sum(centroids**2, axis=1)
+
+    for s in range(0, len(x), batch_size):
+        sims = x[s : s + batch_size] @ centroids.T
+        if metric == "l2":
+            sims -= half_norms
+
+        out[s : s + batch_size] = np.argmax(sims, axis=1)
+
+    return out
+
+
+def _kmeans(x, k, num_iters, rng, spherical=False):
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(num_iters):
+        assign = _assign(x, centroids, metric="ip" if spherical else "l2")
+
+        order = np.argsort(assign, kind="stable")
+        clusters, starts = np.unique(assign[order], return_index=True)
+        sums = np.zeros_like(centroids)
+        sums[clusters] = np.add.reduceat(x[order], starts, axis=0)
+        counts = np.bincount(assign, minlength=k)
+
+        empty = counts == 0
+        if np.any(empty):
+            sums[empty] = x[rng.choice(len(x), np.count_nonzero(empty))]
+            counts[empty] = 1
+
+        centroids = sums / counts[:, None]
+        if spherical:
+            centroids = _normalize(centroids)
+
+    return centroids.astype(np.float32)
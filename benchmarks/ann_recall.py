@@ -0,0 +1,146 @@
+"""
+Reports recall@k and latency of the approximate segment index against exact
+search.
+
+By default the report runs on synthetic clustered embeddings. Pass
+``--dataset`` to run it on the Marengo segment embeddings of a FiftyOne
+dataset instead::
+
+    python benchmarks/ann_recall.py --num-vectors 1000000 --nprobes 1 4 16 64
+    python benchmarks/ann_recall.py --dataset my-videos --output report.json
+"""
+
+import argparse
+from collections import namedtuple
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+
+def _import_plugin():
+    # The plugin is loaded by FiftyOne as a package, so mirror that here
+    plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    package = types.ModuleType("semantic_video_search")
+    package.__path__ = [plugin_dir]
+    sys.modules["semantic_video_search"] = package
+
+    import semantic_video_search.ann as ann
+    import semantic_video_search.search as search
+    import semantic_video_search.store as store
+
+    return ann, search, store
+
+
+_Segment = namedtuple(
+    "_Segment", ["start_offset_sec", "end_offset_sec", "embeddings_float"]
+)
+
+
+def _synthetic_embeddings(num_vectors, dim, num_clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, num_clusters, num_vectors)
+    noise = 0.5 * rng.normal(size=(num_vectors, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def _dataset_embeddings(dataset_name, search):
+    import fiftyone as fo
+
+    dataset = fo.load_dataset(dataset_name)
+    index = search.SegmentIndex.from_view(dataset, "Twelve Labs Marengo-retrieval-27")
+    return index.get_embeddings(np.arange(len(index)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--dataset", default=None)
+    parser.add_argument("--num-vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--num-clusters", type=int, default=2000)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--m", type=int, default=64)
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument(
+        "--refine",
+        action="store_true",
+        help="re-score candidates exactly from an on-disk segment store",
+    )
+    parser.add_argument("--seed", type=int, default=51)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    ann, search, store = _import_plugin()
+
+    if args.dataset:
+        embeddings = _dataset_embeddings(args.dataset, search)
+    else:
+        embeddings = _synthetic_embeddings(
+            args.num_vectors, args.dim, args.num_clusters, args.seed
+        )
+
+    n = len(embeddings)
+    sample_ids = np.full(n, "0" * 24)
+    supports = np.zeros((n, 2), dtype=np.int64)
+
+    segment_store = None
+    refs = None
+    if args.refine:
+        segment_store = store.SegmentStore(tempfile.mkdtemp())
+        refs = segment_store.append(
+            sample_ids[0], [_Segment(0, 0, e) for e in embeddings]
+        )
+
+    start = time.perf_counter()
+    index = ann.IVFPQIndex.build(
+        embeddings, sample_ids, supports, refs=refs, nlist=args.nlist, m=args.m
+    )
+    build_time = time.perf_counter() - start
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = embeddings[rng.choice(n, args.num_queries, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+
+    report = {
+        "num_vectors": n,
+        "dim": int(embeddings.shape[1]),
+        "nlist": index.nlist,
+        "m": index.m,
+        "k": args.k,
+        "refine": args.refine,
+        "build_time_s": build_time,
+        "results": ann.evaluate_recall(
+            index,
+            embeddings,
+            queries,
+            k=args.k,
+            nprobes=args.nprobes,
+            store=segment_store,
+        ),
+    }
+
+    print(
+        "%d vectors, dim %d, nlist %d, m %d, built in %.1fs"
+        % (n, report["dim"], index.nlist, index.m, build_time)
+    )
+    print("%8s %10s %12s %12s" % ("nprobe", "recall@%d" % args.k, "ann ms", "exact ms"))
+    for r in report["results"]:
+        print(
+            "%8d %10.3f %12.2f %12.2f"
+            % (r["nprobe"], r["recall"], r["latency_ms"], r["exact_latency_ms"])
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
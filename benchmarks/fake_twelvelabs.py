@@ -0,0 +1,541 @@
+"""
+A local stand-in for the Twelve Labs API, for benchmarking the plugin without
+spending API quota.
+
+The server speaks the subset of the v1.3 REST API that the plugin uses, so
+the real ``twelvelabs`` client can be pointed at it via the
+``TWELVELABS_BASE_URL`` environment variable::
+
+    with FakeTwelveLabsServer(latency=0.05, task_failure_rate=0.01):
+        client = TwelveLabs(api_key="fake")
+        ...
+
+Uploaded videos are not decoded. Their duration is inferred from their size
+via ``bytes_per_sec``, which :func:`make_synthetic_dataset` uses when it
+writes its videos.
+"""
+
+import email.parser
+import email.policy
+import hashlib
+import itertools
+import json
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+API_VERSION = "v1.3"
+MODEL_NAME = "Marengo-retrieval-2.7"
+
+
+class FakeTwelveLabsServer(object):
+    """A threaded HTTP server that mimics the Twelve Labs API.
+
+    Args:
+        latency (0.05): the base latency of every request, in seconds
+        jitter (0.5): the latency of each request is drawn uniformly from
+            ``latency * [1 - jitter, 1 + jitter]``
+        error_rate (0.0): the probability that a request fails with
+            ``error_status``
+        error_status (500): the status code of injected failures
+        rate_limit (None): the maximum number of requests per second. Excess
+            requests fail with a 429 and a ``Retry-After`` header
+        task_failure_rate (0.0): the probability that an embedding or index
+            task ends in the ``failed`` state
+        processing_secs (0.5): the fixed time each task takes to process
+        processing_secs_per_min (0.1): the additional processing time per
+            minute of video
+        clip_length (6): the length of each embedded segment, in seconds
+        bytes_per_sec (1000): the upload size of one second of video
+        dim (1024): the embedding dimension
+        num_topics (32): the number of latent topics that segment and text
+            embeddings are drawn around, so that searches have real matches
+        seed (51): a random seed
+    """
+
+    def __init__(
+        self,
+        latency=0.05,
+        jitter=0.5,
+        error_rate=0.0,
+        error_status=500,
+        rate_limit=None,
+        task_failure_rate=0.0,
+        processing_secs=0.5,
+        processing_secs_per_min=0.1,
+        clip_length=6,
+        bytes_per_sec=1000,
+        dim=1024,
+        num_topics=32,
+        seed=51,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit
+        self.task_failure_rate = task_failure_rate
+        self.processing_secs = processing_secs
+        self.processing_secs_per_min = processing_secs_per_min
+        self.clip_length = clip_length
+        self.bytes_per_sec = bytes_per_sec
+        self.dim = dim
+        self.seed = seed
+
+        rng = np.random.default_rng(seed)
+        topics = rng.normal(size=(num_topics, dim)).astype(np.float32)
+        self.topics = topics / np.linalg.norm(topics, axis=1, keepdims=True)
+
+        self.embed_tasks = {}
+        self.indexes = {}
+        self.index_tasks = {}
+        self.search_pages = {}
+        self.num_requests = 0
+        self.num_rate_limited = 0
+        self.bytes_uploaded = 0
+
+        self._rng = random.Random(seed)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self._prev_base_url = None
+        self._window = None
+        self._window_requests = 0
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+        self._prev_base_url = os.environ.get("TWELVELABS_BASE_URL", None)
+        os.environ["TWELVELABS_BASE_URL"] = self.base_url
+        return self
+
+    def stop(self):
+        if self._prev_base_url is None:
+            os.environ.pop("TWELVELABS_BASE_URL", None)
+        else:
+            os.environ["TWELVELABS_BASE_URL"] = self._prev_base_url
+
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _new_id(self):
+        with self._lock:
+            return "%024x" % next(self._ids)
+
+    def _retry_after(self):
+        """Counts a request against the rate limit, and returns the seconds
+        until the next window if it is over the limit.
+        """
+        if self.rate_limit is None:
+            return None
+
+        now = time.time()
+        with self._lock:
+            window = math.floor(now)
+            if window != self._window:
+                self._window = window
+                self._window_requests = 0
+
+            self._window_requests += 1
+            if self._window_requests <= self.rate_limit:
+                return None
+
+            self.num_rate_limited += 1
+            return window + 1 - now
+
+    def _random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def _new_task(self, num_bytes):
+        duration = max(num_bytes / self.bytes_per_sec, 1.0)
+        processing = self.processing_secs + self.processing_secs_per_min * (
+            duration / 60.0
+        )
+        num_segments = math.ceil(duration / self.clip_length)
+        with self._lock:
+            self.bytes_uploaded += num_bytes
+            topics = [
+                self._rng.randrange(len(self.topics)) for _ in range(num_segments)
+            ]
+
+        return {
+            "_id": self._new_id(),
+            "created_at": _timestamp(),
+            "ready_at": time.monotonic() + processing,
+            "failed": self._random() < self.task_failure_rate,
+            "duration": duration,
+            "topics": topics,
+        }
+
+    def _status(self, task):
+        if time.monotonic() < task["ready_at"]:
+            return "processing"
+
+        return "failed" if task["failed"] else "ready"
+
+    def _segment_embeddings(self, task_id, topics, option):
+        seed = int(hashlib.md5((task_id + option).encode()).hexdigest()[:8], 16)
+        rng = np.random.default_rng(seed)
+        noise = rng.normal(scale=0.05, size=(len(topics), self.dim))
+        return (self.topics[topics] + noise).astype(np.float32)
+
+    def _text_embedding(self, text):
+        digest = int(hashlib.md5(text.lower().encode()).hexdigest()[:8], 16)
+        rng = np.random.default_rng(digest)
+        topic = self.topics[digest % len(self.topics)]
+        noise = rng.normal(scale=0.05, size=self.dim)
+        return (topic + noise).astype(np.float32)
+
+    def _segments(self, task, options):
+        segments = []
+        for option in options:
+            embeddings = self._segment_embeddings(task["_id"], task["topics"], option)
+            for i, embedding in enumerate(embeddings):
+                start = i * self.clip_length
+                segments.append(
+                    {
+                        "start_offset_sec": float(start),
+                        "end_offset_sec": float(
+                            min(start + self.clip_length, task["duration"])
+                        ),
+                        "embedding_scope": "clip",
+                        "embedding_option": option,
+                        "float": embedding.tolist(),
+                    }
+                )
+
+        return segments
+
+    def _search(self, index_id, text, page_limit):
+        query = self._text_embedding(text)
+        topic_scores = self.topics @ query
+
+        hits = []
+        for task in self.index_tasks.values():
+            if task["index_id"] != index_id or self._status(task) != "ready":
+                continue
+
+            for i, topic in enumerate(task["topics"]):
+                score = float(topic_scores[topic])
+                if score < 0.5:
+                    continue
+
+                start = i * self.clip_length
+                hits.append(
+                    {
+                        "score": round(100 * score, 2),
+                        "start": float(start),
+                        "end": float(min(start + self.clip_length, task["duration"])),
+                        "video_id": task["video_id"],
+                        "confidence": "high" if score > 0.8 else "medium",
+                    }
+                )
+
+        hits.sort(key=lambda h: h["score"], reverse=True)
+        pages = [hits[i : i + page_limit] for i in range(0, len(hits), page_limit)]
+        if not pages:
+            pages = [[]]
+
+        tokens = [self._new_id() for _ in pages]
+        pool = {
+            "total_count": len(self.indexes[index_id]["video_ids"]),
+            "total_duration": 0.0,
+            "index_id": index_id,
+        }
+        for i, (token, page) in enumerate(zip(tokens, pages)):
+            self.search_pages[token] = {
+                "search_pool": pool,
+                "data": page,
+                "page_info": {
+                    "limit_per_page": page_limit,
+                    "total_results": len(hits),
+                    "page_expires_at": _timestamp(timedelta(hours=1)),
+                    "next_page_token": tokens[i + 1] if i + 1 < len(tokens) else None,
+                    "prev_page_token": tokens[i - 1] if i > 0 else None,
+                },
+            }
+
+        return self.search_pages[tokens[0]]
+
+    def _index_doc(self, index):
+        return {
+            "_id": index["_id"],
+            "created_at": index["created_at"],
+            "index_name": index["index_name"],
+            "models": index["models"],
+            "video_count": len(index["video_ids"]),
+            "total_duration": 0.0,
+        }
+
+    def handle(self, method, path, query, form, body):
+        """Returns ``(status, payload)`` for the given request."""
+        parts = path.strip("/").split("/")
+        if parts[:1] != [API_VERSION]:
+            return 404, {"message": "unknown API version"}
+
+        parts = parts[1:]
+
+        if method == "POST" and parts == ["embed", "tasks"]:
+            task = self._new_task(len(form.get("video_file", [b""])[0]))
+            self.embed_tasks[task["_id"]] = task
+            return 200, {"_id": task["_id"]}
+
+        if method == "GET" and parts[:2] == ["embed", "tasks"] and len(parts) >= 3:
+            task = self.embed_tasks.get(parts[2], None)
+            if task is None:
+                return 404, {"message": "task not found"}
+
+            doc = {
+                "_id": task["_id"],
+                "model_name": MODEL_NAME,
+                "status": self._status(task),
+                "created_at": task["created_at"],
+            }
+            if parts[3:] == ["status"]:
+                return 200, doc
+
+            if doc["status"] == "ready":
+                options = query.get("embedding_option", ["visual-text", "audio"])
+                doc["video_embedding"] = {"segments": self._segments(task, options)}
+
+            return 200, doc
+
+        if method == "POST" and parts == ["embed"]:
+            text = form.get("text", [b""])[0].decode()
+            embedding = self._text_embedding(text)
+            return 200, {
+                "model_name": MODEL_NAME,
+                "text_embedding": {"segments": [{"float": embedding.tolist()}]},
+            }
+
+        if method == "POST" and parts == ["indexes"]:
+            index = {
+                "_id": self._new_id(),
+                "created_at": _timestamp(),
+                "index_name": body["index_name"],
+                "models": body["models"],
+                "video_ids": [],
+            }
+            self.indexes[index["_id"]] = index
+            return 200, {"_id": index["_id"]}
+
+        if method == "GET" and parts == ["indexes"]:
+            indexes = [
+                self._index_doc(index)
+                for index in self.indexes.values()
+                if "index_name" not in query
+                or index["index_name"] == query["index_name"][0]
+            ]
+            page = int(query.get("page", ["1"])[0])
+            page_limit = int(query.get("page_limit", ["10"])[0])
+            return 200, {
+                "data": indexes[(page - 1) * page_limit : page * page_limit],
+                "page_info": {
+                    "limit_per_page": page_limit,
+                    "page": page,
+                    "total_page": max(math.ceil(len(indexes) / page_limit), 1),
+                    "total_results": len(indexes),
+                },
+            }
+
+        if method == "GET" and parts[:1] == ["indexes"] and len(parts) == 2:
+            index = self.indexes.get(parts[1], None)
+            if index is None:
+                return 404, {"message": "index not found"}
+
+            return 200, self._index_doc(index)
+
+        if method == "POST" and parts == ["tasks"]:
+            index_id = form.get("index_id", [b""])[0].decode()
+            if index_id not in self.indexes:
+                return 400, {"message": "index not found"}
+
+            task = self._new_task(len(form.get("video_file", [b""])[0]))
+            task["index_id"] = index_id
+            task["video_id"] = self._new_id()
+            self.index_tasks[task["_id"]] = task
+            self.indexes[index_id]["video_ids"].append(task["video_id"])
+            return 200, {"_id": task["_id"]}
+
+        if method == "GET" and parts[:1] == ["tasks"] and len(parts) == 2:
+            task = self.index_tasks.get(parts[1], None)
+            if task is None:
+                return 404, {"message": "task not found"}
+
+            status = self._status(task)
+            return 200, {
+                "_id": task["_id"],
+                "created_at": task["created_at"],
+                "index_id": task["index_id"],
+                "video_id": task["video_id"] if status == "ready" else None,
+                "status": status,
+                "system_metadata": {"duration": task["duration"]},
+            }
+
+        if method == "POST" and parts == ["search"]:
+            index_id = form.get("index_id", [b""])[0].decode()
+            if index_id not in self.indexes:
+                return 400, {"message": "index not found"}
+
+            text = form.get("query_text", [b""])[0].decode()
+            page_limit = int(form.get("page_limit", [b"10"])[0])
+            return 200, self._search(index_id, text, page_limit)
+
+        if method == "GET" and parts[:1] == ["search"] and len(parts) == 2:
+            page = self.search_pages.get(parts[1], None)
+            if page is None:
+                return 404, {"message": "page token not found"}
+
+            return 200, page
+
+        return 404, {"message": "not found"}
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _dispatch(self, method):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length) if length else b""
+
+            with server._lock:
+                server.num_requests += 1
+
+            delay = server.latency * (1 + server.jitter * (2 * server._random() - 1))
+            time.sleep(max(delay, 0))
+
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            content_type = self.headers.get("Content-Type", "")
+            form = {}
+            body = None
+            if content_type.startswith("multipart/form-data"):
+                form = _parse_multipart(raw, content_type)
+            elif content_type.startswith("application/json") and raw:
+                body = json.loads(raw)
+
+            headers = {}
+            retry_after = server._retry_after()
+            if retry_after is not None:
+                status, payload = 429, {"message": "too many requests"}
+                headers["Retry-After"] = str(math.ceil(retry_after))
+            elif server._random() < server.error_rate:
+                status, payload = server.error_status, {"message": "injected failure"}
+            else:
+                status, payload = server.handle(method, url.path, query, form, body)
+
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def _parse_multipart(raw, content_type):
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + raw
+    )
+    form = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        form.setdefault(name, []).append(part.get_payload(decode=True) or b"")
+
+    return form
+
+
+def _timestamp(offset=None):
+    now = datetime.now(timezone.utc)
+    if offset is not None:
+        now += offset
+
+    return now.isoformat()
+
+
+def make_synthetic_dataset(
+    num_videos,
+    video_dir,
+    min_duration=30,
+    max_duration=600,
+    frame_rate=30,
+    bytes_per_sec=1000,
+    seed=51,
+    name=None,
+):
+    """Creates a dataset of placeholder videos whose file sizes encode their
+    durations for :class:`FakeTwelveLabsServer`.
+
+    The videos cannot be decoded, so their metadata is populated directly.
+    """
+    import fiftyone as fo
+
+    os.makedirs(video_dir, exist_ok=True)
+    rng = random.Random(seed)
+
+    samples = []
+    for i in range(num_videos):
+        duration = rng.uniform(min_duration, max_duration)
+        filepath = os.path.join(video_dir, "video-%06d.mp4" % i)
+        size = int(duration * bytes_per_sec)
+        with open(filepath, "wb") as f:
+            f.write(("%d:%d:" % (seed, i)).encode())
+            f.truncate(size)
+
+        total_frame_count = int(duration * frame_rate)
+        samples.append(
+            fo.Sample(
+                filepath=filepath,
+                metadata=fo.VideoMetadata(
+                    size_bytes=size,
+                    mime_type="video/mp4",
+                    frame_width=1280,
+                    frame_height=720,
+                    frame_rate=frame_rate,
+                    total_frame_count=total_frame_count,
+                    duration=total_frame_count / frame_rate,
+                ),
+            )
+        )
+
+    dataset = fo.Dataset(name)
+    dataset.add_samples(samples)
+    return dataset
@@ -0,0 +1,119 @@
+"""
+Reports the throughput of building the kNN graph of segment embeddings, and
+how many planted near-duplicates it recovers.
+
+Copies of a random subset of the vectors are planted with a little noise, and
+the report gives the fraction of them that end up in the same duplicate
+cluster as their original::
+
+    python benchmarks/knn_graph.py --num-vectors 1000000 --block-size 32768
+    python benchmarks/knn_graph.py --output report.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import types
+
+import numpy as np
+
+
+def _import_plugin():
+    # The plugin is loaded by FiftyOne as a package, so mirror that here
+    plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    package = types.ModuleType("semantic_video_search")
+    package.__path__ = [plugin_dir]
+    sys.modules["semantic_video_search"] = package
+
+    import semantic_video_search.graph as graph
+    import semantic_video_search.search as search
+
+    return graph, search
+
+
+def _synthetic_embeddings(num_vectors, dim, num_clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, num_clusters, num_vectors)
+    noise = 0.5 * rng.normal(size=(num_vectors, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--num-vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--num-clusters", type=int, default=2000)
+    parser.add_argument("--num-duplicates", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.95)
+    parser.add_argument("--query-block-size", type=int, default=1024)
+    parser.add_argument("--block-size", type=int, default=2**14)
+    parser.add_argument("--seed", type=int, default=51)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    graph, search = _import_plugin()
+
+    rng = np.random.default_rng(args.seed)
+    embeddings = _synthetic_embeddings(
+        args.num_vectors, args.dim, args.num_clusters, args.seed
+    )
+    originals = rng.choice(len(embeddings), args.num_duplicates, replace=False)
+    copies = embeddings[originals] + 0.05 * rng.normal(
+        size=(args.num_duplicates, args.dim)
+    ).astype(np.float32)
+    embeddings = np.concatenate([embeddings, copies])
+
+    n = len(embeddings)
+    sample_ids = np.arange(n).astype(str)
+    supports = np.ones((n, 2), dtype=np.int64)
+    index = search.SegmentIndex(sample_ids, supports, embeddings)
+
+    start = time.perf_counter()
+    knn_graph = graph.KNNGraph.build(
+        index,
+        args.k,
+        query_block_size=args.query_block_size,
+        block_size=args.block_size,
+    )
+    build_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    labels = knn_graph.clusters(args.threshold)
+    cluster_secs = time.perf_counter() - start
+
+    found = labels[originals] >= 0
+    found &= labels[originals] == labels[args.num_vectors :]
+
+    report = {
+        "num_vectors": n,
+        "dim": args.dim,
+        "k": args.k,
+        "build_secs": build_secs,
+        "segments_per_sec": n / build_secs,
+        "block_memory_mb": 4 * args.query_block_size * args.block_size / 2**20,
+        "cluster_secs": cluster_secs,
+        "num_clusters": int(labels.max()) + 1,
+        "duplicate_recall": float(np.mean(found)),
+    }
+
+    print("%d vectors, dim %d, k %d" % (n, args.dim, args.k))
+    print(
+        "built in %.1fs (%.0f segments/s) using %.0f MB score blocks"
+        % (build_secs, report["segments_per_sec"], report["block_memory_mb"])
+    )
+    print(
+        "%d clusters in %.2fs, %.1f%% of planted duplicates recovered"
+        % (report["num_clusters"], cluster_secs, 100 * report["duplicate_recall"])
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
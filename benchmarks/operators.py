@@ -0,0 +1,325 @@
+"""
+Benchmarks the plugin's operators end to end against a local Twelve Labs
+stand-in, so no API quota is spent.
+
+For each dataset size, a synthetic dataset is ingested with
+``create_twelve_labs_embeddings`` and ``create_twelve_labs_index``, and then
+searched with every search operator. The report includes ingest throughput,
+database write time, search latency percentiles and peak RSS::
+
+    python benchmarks/operators.py --sizes 10 100 1000 --output report.json
+
+Each size runs in a fresh process, so peak RSS is not inflated by earlier
+sizes. Peak RSS is the process's high-water mark after each operator.
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+_PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_plugin():
+    # The plugin is loaded by FiftyOne as a package, so mirror that here
+    spec = importlib.util.spec_from_file_location(
+        "semantic_video_search",
+        os.path.join(_PLUGIN_DIR, "__init__.py"),
+        submodule_search_locations=[_PLUGIN_DIR],
+    )
+    plugin = importlib.util.module_from_spec(spec)
+    sys.modules["semantic_video_search"] = plugin
+    spec.loader.exec_module(plugin)
+    return plugin
+
+
+def _peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak /= 1024
+
+    return peak / 1024
+
+
+def _plugin_definition():
+    import yaml
+
+    with open(os.path.join(_PLUGIN_DIR, "fiftyone.yml")) as f:
+        return yaml.safe_load(f)
+
+
+def _execute(operator, dataset, params):
+    from fiftyone.operators.executor import ExecutionContext, Executor
+
+    # Secrets such as TL_API_KEY are resolved from the environment for the
+    # operator's URI, as when FiftyOne executes it
+    plugin = _plugin_definition()
+    ctx = ExecutionContext(
+        request_params={"dataset_name": dataset.name, "params": dict(params)},
+        executor=Executor(),
+        operator_uri="%s/%s" % (plugin["name"], operator.config.name),
+        required_secrets=plugin["secrets"],
+    )
+    return operator.execute(ctx)
+
+
+class _WriteTimer(object):
+    """Accumulates the time spent in :meth:`BatchedWriter.flush`."""
+
+    def __init__(self, writer_cls):
+        self.secs = 0.0
+        flush = writer_cls.flush
+        timer = self
+
+        def timed_flush(self):
+            start = time.perf_counter()
+            try:
+                flush(self)
+            finally:
+                timer.secs += time.perf_counter() - start
+
+        writer_cls.flush = timed_flush
+
+
+def _run_ingest(name, operator, dataset, params, server, write_timer):
+    requests = server.num_requests
+    rate_limited = server.num_rate_limited
+    uploaded = server.bytes_uploaded
+    write_secs = write_timer.secs
+
+    start = time.perf_counter()
+    output = _execute(operator, dataset, params) or {}
+    secs = time.perf_counter() - start
+
+    num_failed = len(output.get("failures", {}))
+    num_videos = len(dataset)
+    return {
+        "operator": name,
+        "num_videos": num_videos,
+        "num_failed": num_failed,
+        "secs": secs,
+        "videos_per_min": 60 * (num_videos - num_failed) / secs,
+        "db_write_secs": write_timer.secs - write_secs,
+        "api_requests": server.num_requests - requests,
+        "rate_limited": server.num_rate_limited - rate_limited,
+        "bytes_uploaded": server.bytes_uploaded - uploaded,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _run_search(name, operator, dataset, params, prompts, server):
+    requests = server.num_requests
+    rate_limited = server.num_rate_limited
+    latencies = []
+    error = None
+    for prompt in prompts:
+        start = time.perf_counter()
+        try:
+            _execute(operator, dataset, dict(params, prompt=prompt))
+        except Exception as e:
+            error = str(e)
+            break
+
+        latencies.append(1000 * (time.perf_counter() - start))
+
+    result = {
+        "operator": name,
+        "num_queries": len(latencies),
+        "api_requests": server.num_requests - requests,
+        "rate_limited": server.num_rate_limited - rate_limited,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    if latencies:
+        result.update(
+            p50_ms=float(np.percentile(latencies, 50)),
+            p99_ms=float(np.percentile(latencies, 99)),
+            mean_ms=float(np.mean(latencies)),
+        )
+
+    if error is not None:
+        result["error"] = error
+
+    return result
+
+
+def _run_size(config, num_videos):
+    from fake_twelvelabs import FakeTwelveLabsServer, make_synthetic_dataset
+
+    work_dir = tempfile.mkdtemp(prefix="tl-benchmark-")
+    os.environ["TL_API_KEY"] = "fake"
+    os.environ["TL_CACHE_DIR"] = os.path.join(work_dir, "cache")
+    os.environ["TL_STORE_DIR"] = os.path.join(work_dir, "store")
+
+    plugin = _import_plugin()
+    write_timer = _WriteTimer(sys.modules["semantic_video_search.utils"].BatchedWriter)
+
+    server = FakeTwelveLabsServer(
+        latency=config["latency"],
+        error_rate=config["error_rate"],
+        error_status=config["error_status"],
+        rate_limit=config["rate_limit"],
+        task_failure_rate=config["task_failure_rate"],
+        processing_secs=config["processing_secs"],
+        processing_secs_per_min=config["processing_secs_per_min"],
+        seed=config["seed"],
+    )
+
+    dataset = make_synthetic_dataset(
+        num_videos,
+        os.path.join(work_dir, "videos"),
+        min_duration=config["min_duration"],
+        max_duration=config["max_duration"],
+        seed=config["seed"],
+    )
+
+    prompts = ["query %d" % i for i in range(config["num_queries"])]
+    common = {"max_concurrent_tasks": config["max_concurrent_tasks"]}
+
+    results = []
+    with server:
+        results.append(
+            _run_ingest(
+                "create_twelve_labs_embeddings",
+                plugin.CreateTwelveLabsEmbeddings(),
+                dataset,
+                dict(common, embedding_storage=config["embedding_storage"]),
+                server,
+                write_timer,
+            )
+        )
+        results.append(
+            _run_ingest(
+                "create_twelve_labs_index",
+                plugin.CreateTwelveLabsIndex(),
+                dataset,
+                dict(common, index_name="benchmark", visual=True, audio=True),
+                server,
+                write_timer,
+            )
+        )
+
+        searches = [
+            (
+                "twelve_labs_semantic_search",
+                plugin.TwelveLabsSemanticSearch(),
+                {"top_k": config["top_k"], "search_method": "EXACT"},
+            ),
+            (
+                "twelve_labs_semantic_search (approximate)",
+                plugin.TwelveLabsSemanticSearch(),
+                {"top_k": config["top_k"], "search_method": "APPROXIMATE"},
+            ),
+            (
+                "twelve_labs_index_search",
+                plugin.TwelveLabsIndexSearch(),
+                {"top_k": config["top_k"], "index_name": "benchmark", "visual": True},
+            ),
+            (
+                "twelve_labs_hybrid_search",
+                plugin.TwelveLabsHybridSearch(),
+                {"top_k": config["top_k"], "index_name": "benchmark", "visual": True},
+            ),
+        ]
+        for name, operator, params in searches:
+            results.append(
+                _run_search(name, operator, dataset, params, prompts, server)
+            )
+
+    dataset.delete()
+
+    return {
+        "num_videos": num_videos,
+        "num_segments": sum(len(t["topics"]) for t in server.embed_tasks.values()),
+        "operators": results,
+    }
+
+
+def _environment():
+    import fiftyone as fo
+    import twelvelabs
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "fiftyone": fo.__version__,
+        "twelvelabs": getattr(twelvelabs, "__version__", None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--min-duration", type=float, default=30)
+    parser.add_argument("--max-duration", type=float, default=600)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--rate-limit", type=int, default=None)
+    parser.add_argument("--task-failure-rate", type=float, default=0.0)
+    parser.add_argument("--processing-secs", type=float, default=0.5)
+    parser.add_argument("--processing-secs-per-min", type=float, default=0.1)
+    parser.add_argument("--max-concurrent-tasks", type=int, default=8)
+    parser.add_argument(
+        "--embedding-storage", choices=["SAMPLE", "DISK"], default="SAMPLE"
+    )
+    parser.add_argument("--num-queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=51)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("sizes", "output")}
+
+    # Each size runs in a fresh interpreter so that peak RSS is per size
+    mp = multiprocessing.get_context("spawn")
+    results = []
+    for num_videos in args.sizes:
+        with mp.Pool(1) as pool:
+            result = pool.apply(_run_size, (config, num_videos))
+
+        results.append(result)
+
+        print("\n%d videos, %d segments" % (num_videos, result["num_segments"]))
+        for r in result["operators"]:
+            if "videos_per_min" in r:
+                print(
+                    "  %-42s %8.1f videos/min  %6.2fs db write  %7.1f MB"
+                    % (
+                        r["operator"],
+                        r["videos_per_min"],
+                        r["db_write_secs"],
+                        r["peak_rss_mb"],
+                    )
+                )
+            elif "p50_ms" in r:
+                print(
+                    "  %-42s %8.1f ms p50  %8.1f ms p99  %7.1f MB"
+                    % (r["operator"], r["p50_ms"], r["p99_ms"], r["peak_rss_mb"])
+                )
+            else:
+                print("  %-42s failed: %s" % (r["operator"], r.get("error")))
+
+    report = {
+        "environment": _environment(),
+        "config": config,
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
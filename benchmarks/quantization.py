@@ -0,0 +1,178 @@
+"""
+Reports the storage, memory, recall@k and latency of quantized segment
+embeddings against full precision search.
+
+For each precision, the report gives the stored size of one embedding on a
+temporal detection, the in-memory size of the search index, and recall@k
+with and without re-ranking from an on-disk segment store::
+
+    python benchmarks/quantization.py --num-vectors 200000 --rerank 100
+    python benchmarks/quantization.py --dataset my-videos --output report.json
+"""
+
+import argparse
+from collections import namedtuple
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+
+import numpy as np
+
+
+def _import_plugin():
+    # The plugin is loaded by FiftyOne as a package, so mirror that here
+    plugin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    package = types.ModuleType("semantic_video_search")
+    package.__path__ = [plugin_dir]
+    sys.modules["semantic_video_search"] = package
+
+    import semantic_video_search.quantize as quantize
+    import semantic_video_search.search as search
+    import semantic_video_search.store as store
+
+    return quantize, search, store
+
+
+_Segment = namedtuple(
+    "_Segment", ["start_offset_sec", "end_offset_sec", "embeddings_float"]
+)
+
+
+def _synthetic_embeddings(num_vectors, dim, num_clusters, seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, num_clusters, num_vectors)
+    noise = 0.5 * rng.normal(size=(num_vectors, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def _dataset_embeddings(dataset_name, search):
+    import fiftyone as fo
+
+    dataset = fo.load_dataset(dataset_name)
+    index = search.SegmentIndex.from_view(dataset, "Twelve Labs Marengo-retrieval-27")
+    return index.get_embeddings(np.arange(len(index)))
+
+
+def _stored_bytes(embedding):
+    # The BSON size of the embedding as stored on a temporal detection
+    import bson
+    import fiftyone.core.utils as fou
+
+    if embedding.dtype == np.float32:
+        value = embedding.tolist()
+    else:
+        value = fou.serialize_numpy_array(embedding)
+
+    return len(bson.encode({"embedding": value})) - len(bson.encode({}))
+
+
+def _evaluate(index, queries, exact_inds, k, rerank):
+    start = time.perf_counter()
+    inds, _ = index.search_batch(queries, k, rerank=rerank)
+    latency = time.perf_counter() - start
+
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(inds, exact_inds)])
+    return float(recall), 1000 * latency / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--dataset", default=None)
+    parser.add_argument("--num-vectors", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--num-clusters", type=int, default=2000)
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=51)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    quantize, search, store = _import_plugin()
+
+    if args.dataset:
+        embeddings = _dataset_embeddings(args.dataset, search)
+    else:
+        embeddings = _synthetic_embeddings(
+            args.num_vectors, args.dim, args.num_clusters, args.seed
+        )
+
+    n = len(embeddings)
+    sample_ids = np.full(n, "0" * 24)
+    supports = np.zeros((n, 2), dtype=np.int64)
+
+    segment_store = store.SegmentStore(tempfile.mkdtemp())
+    refs = segment_store.append(sample_ids[0], [_Segment(0, 0, e) for e in embeddings])
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = embeddings[rng.choice(n, args.num_queries, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+
+    exact = search.SegmentIndex(sample_ids, supports, embeddings)
+    exact_inds, _ = exact.search_batch(queries, args.k)
+
+    results = []
+    for precision in quantize.PRECISIONS:
+        values, _ = quantize.quantize(embeddings, precision)
+        index = search.SegmentIndex(
+            sample_ids, supports, values, store=segment_store, refs=refs
+        )
+
+        recall, latency = _evaluate(index, queries, exact_inds, args.k, 0)
+        result = {
+            "precision": precision,
+            "stored_bytes": _stored_bytes(values[0]),
+            "memory_mb": index.embeddings.nbytes / 2**20,
+            "recall": recall,
+            "latency_ms": latency,
+        }
+        if precision != "FLOAT32":
+            recall, latency = _evaluate(index, queries, exact_inds, args.k, args.rerank)
+            result.update(rerank_recall=recall, rerank_latency_ms=latency)
+
+        results.append(result)
+
+    report = {
+        "num_vectors": n,
+        "dim": int(embeddings.shape[1]),
+        "k": args.k,
+        "rerank": args.rerank,
+        "results": results,
+    }
+
+    print("%d vectors, dim %d" % (n, report["dim"]))
+    print(
+        "%9s %13s %10s %10s %10s %16s"
+        % (
+            "precision",
+            "stored bytes",
+            "memory MB",
+            "recall@%d" % args.k,
+            "ms/query",
+            "rerank recall@%d" % args.k,
+        )
+    )
+    for r in results:
+        print(
+            "%9s %13d %10.1f %10.3f %10.2f %16s"
+            % (
+                r["precision"],
+                r["stored_bytes"],
+                r["memory_mb"],
+                r["recall"],
+                r["latency_ms"],
+                "%.3f" % r["rerank_recall"] if "rerank_recall" in r else "-",
+            )
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
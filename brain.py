@@ -0,0 +1,195 @@
+import fiftyone.brain as fob
+import fiftyone.core.config as foc
+import fiftyone.core.models as fom
+from fiftyone import ViewField as F
+import numpy as np
+
+from .scheduler import get_client
+from .search import SegmentIndex
+
+# Embeddings are added to similarity indexes this many at a time
+_ADD_BATCH_SIZE = 2**16
+
+
+class TwelveLabsModelConfig(foc.Config):
+    """Configuration for a :class:`TwelveLabsModel`.
+
+    Args:
+        api_key (None): a Twelve Labs API key
+        model_name ("Marengo-retrieval-2.7"): the Twelve Labs embedding model
+    """
+
+    def __init__(self, d):
+        self.api_key = self.parse_string(d, "api_key", default=None)
+        self.model_name = self.parse_string(
+            d, "model_name", default="Marengo-retrieval-2.7"
+        )
+
+
+class TwelveLabsModel(fom.Model, fom.EmbeddingsMixin, fom.PromptMixin):
+    """Prompt-capable FiftyOne model that embeds text with Twelve Labs.
+
+    Video embeddings come from ``create_twelve_labs_embeddings``, so this
+    model only embeds prompts, which lets similarity indexes over Twelve Labs
+    segment embeddings be queried by text. Prompt embeddings are looked up
+    in ``query_cache``, if provided, before calling the API.
+
+    Args:
+        config: a :class:`TwelveLabsModelConfig`
+        query_cache (None): an optional :class:`cache.QueryEmbeddingCache`
+        metrics (None): an optional :class:`Metrics` that records API calls
+    """
+
+    def __init__(self, config, query_cache=None, metrics=None):
+        self.config = config
+        self.query_cache = query_cache
+        self.metrics = metrics
+        self._client = None
+
+    @property
+    def media_type(self):
+        return "video"
+
+    @property
+    def has_embeddings(self):
+        return True
+
+    @property
+    def can_embed_prompts(self):
+        return True
+
+    @property
+    def ragged_batches(self):
+        return False
+
+    @property
+    def transforms(self):
+        return None
+
+    def predict(self, arg):
+        raise ValueError(
+            "%s only embeds prompts. Use `create_twelve_labs_embeddings` to "
+            "compute video embeddings" % self.__class__.__name__
+        )
+
+    def embed_prompt(self, prompt):
+        def _fetch():
+            if self._client is None:
+                self._client = get_client(self.config.api_key, metrics=self.metrics)
+
+            res = self._client.embed.create(
+                model_name=self.config.model_name, text=prompt
+            )
+            return res.text_embedding.segments[0].embeddings_float
+
+        if self.query_cache is None:
+            embedding = _fetch()
+        else:
+            embedding = self.query_cache.get(self.config.model_name, prompt, _fetch)
+
+        return np.asarray(embedding, dtype=np.float32)
+
+
+def is_twelve_labs_index(dataset, brain_key, model_name):
+    """Returns whether the given brain run is a similarity index built by
+    :func:`update_similarity_index` from embeddings of the given model.
+    """
+    model_kwargs = dataset.get_brain_info(brain_key).config.model_kwargs
+    return (model_kwargs or {}).get("model_name", None) == model_name
+
+
+def load_similarity_index(samples, brain_key, field, options=None):
+    """Loads a similarity index built by :func:`update_similarity_index`,
+    restricted to the clips of ``field`` in the given collection.
+
+    Custom models cannot be stored on brain runs, so the index cannot embed
+    prompts itself. Query it with vectors from
+    :meth:`TwelveLabsModel.embed_prompt` instead.
+
+    Args:
+        samples: a :class:`fiftyone.core.collections.SampleCollection`
+        brain_key: the brain key of the index
+        field: the temporal detections field that holds the segments
+        options (None): an optional list of modalities to restrict the clips
+            to. Segments of unknown modality are always included
+    """
+    if options is not None:
+        samples = samples.filter_labels(
+            field,
+            F("embedding_option").is_in(options) | ~F("embedding_option").exists(),
+            only_matches=False,
+        )
+
+    results = samples._dataset.load_brain_results(brain_key)
+    results.use_view(samples.to_clips(field))
+    return results
+
+
+def update_similarity_index(
+    dataset, field, brain_key, model_name, store=None, backend=None
+):
+    """Creates or incrementally updates a similarity index over the clips of
+    the given temporal detections field.
+
+    The index is keyed by clip ID, which is the ID of each temporal
+    detection. Only segments that are not yet in the index are loaded and
+    added, and clips that no longer exist, such as those of re-embedded
+    videos, are removed. Backends that cannot list their contents are given
+    every segment, overwriting existing ones.
+
+    Args:
+        dataset: a :class:`fiftyone.core.dataset.Dataset`
+        field: the temporal detections field that holds the segments
+        brain_key: the brain key of the index
+        model_name: the Twelve Labs model that generated the embeddings
+        store (None): the :class:`store.SegmentStore` of the segments, if any
+        backend (None): the similarity backend to use when creating the
+            index. By default, the brain's default backend is used
+
+    Returns:
+        a tuple of the number of segments added and removed
+    """
+    if brain_key in dataset.list_brain_runs():
+        results = dataset.load_brain_results(brain_key)
+    else:
+        results = fob.compute_similarity(
+            dataset.to_clips(field),
+            embeddings=False,
+            brain_key=brain_key,
+            model_kwargs={"model_name": model_name},
+            backend=backend,
+        )
+
+    sample_ids, label_ids = dataset.values(["id", field + ".detections.id"])
+    clips = {
+        label_id: sample_id
+        for sample_id, _label_ids in zip(sample_ids, label_ids)
+        for label_id in _label_ids or []
+    }
+
+    indexed_ids = results.sample_ids
+    num_removed = 0
+    if indexed_ids is None:
+        indexed_ids = set()
+    else:
+        indexed_ids = set(indexed_ids)
+        stale_ids = [_id for _id in indexed_ids if _id not in clips]
+        if stale_ids:
+            results.remove_from_index(sample_ids=stale_ids)
+            num_removed = len(stale_ids)
+
+    new_ids = [_id for _id in clips if _id not in indexed_ids]
+    new_samples = list({clips[_id] for _id in new_ids})
+    index = SegmentIndex.from_view(dataset.select(new_samples), field, store=store)
+    rows = np.nonzero(~np.isin(index.label_ids, list(indexed_ids)))[0]
+
+    for start in range(0, len(rows), _ADD_BATCH_SIZE):
+        _rows = rows[start : start + _ADD_BATCH_SIZE]
+        results.add_to_index(
+            index.get_embeddings(_rows), index.label_ids[_rows], reload=False
+        )
+
+    if len(rows) > 0 or num_removed > 0:
+        results.save()
+
+    return len(rows), num_removed
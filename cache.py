@@ -0,0 +1,328 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+CachedSegment = namedtuple(
+    "CachedSegment",
+    ["start_offset_sec", "end_offset_sec", "embeddings_float", "embedding_option"],
+    defaults=[None],
+)
+
+
+def hash_file(file_path, chunk_size=2**20):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class EmbeddingCache(object):
+    """Persistent cache of Twelve Labs video embeddings keyed by file content.
+
+    Entries are keyed on the SHA-256 of the video file, the model name and the
+    embedding options, and evicted least-recently-used first once the total
+    size of stored embeddings exceeds ``max_size_bytes``.
+    """
+
+    def __init__(self, cache_dir, max_size_bytes=10 * 2**30):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "embeddings.db"),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, starts BLOB, ends BLOB, embeddings BLOB, "
+            "dim INTEGER, size INTEGER, last_access REAL)"
+        )
+
+        # Caches created before segments recorded their modality lack the
+        # column, and :meth:`get` treats their entries as misses
+        columns = [r[1] for r in self._conn.execute("PRAGMA table_info(embeddings)")]
+        if "options" not in columns:
+            self._conn.execute("ALTER TABLE embeddings ADD COLUMN options TEXT")
+
+    def content_hash(self, file_path):
+        # Re-hashing large videos on every run is expensive, so hashes are
+        # memoized on (path, size, mtime)
+        st = os.stat(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash FROM file_hashes WHERE path=? AND size=? AND mtime=?",
+                (file_path, st.st_size, st.st_mtime),
+            ).fetchone()
+
+        if row is not None:
+            return row[0]
+
+        content_hash = hash_file(file_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                (file_path, st.st_size, st.st_mtime, content_hash),
+            )
+
+        return content_hash
+
+    def make_key(self, file_path, model_name, embedding_options):
+        options = json.dumps(sorted(embedding_options))
+        return "%s:%s:%s" % (self.content_hash(file_path), model_name, options)
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT starts, ends, embeddings, dim, options FROM embeddings "
+                "WHERE key=?",
+                (key,),
+            ).fetchone()
+
+            # Entries cached before segments recorded their modality are
+            # misses, so that their videos are embedded again and search can
+            # tell modalities apart
+            if row is None or row[4] is None or None in json.loads(row[4]):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE embeddings SET last_access=? WHERE key=?",
+                (time.time(), key),
+            )
+
+        starts, ends, embeddings, dim, options = row
+        starts = np.frombuffer(starts, dtype=np.float64)
+        ends = np.frombuffer(ends, dtype=np.float64)
+        embeddings = np.frombuffer(embeddings, dtype=np.float32).reshape(-1, dim)
+        options = json.loads(options)
+
+        return [
+            CachedSegment(float(s), float(e), emb.tolist(), o)
+            for s, e, emb, o in zip(starts, ends, embeddings, options)
+        ]
+
+    def put(self, key, segments):
+        starts = np.array([s.start_offset_sec for s in segments], dtype=np.float64)
+        ends = np.array([s.end_offset_sec for s in segments], dtype=np.float64)
+        embeddings = np.array([s.embeddings_float for s in segments], dtype=np.float32)
+        options = json.dumps([getattr(s, "embedding_option", None) for s in segments])
+        dim = embeddings.shape[1] if embeddings.ndim == 2 else 0
+        size = starts.nbytes + ends.nbytes + embeddings.nbytes
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings "
+                "(key, starts, ends, embeddings, dim, size, last_access, options) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    starts.tobytes(),
+                    ends.tobytes(),
+                    embeddings.tobytes(),
+                    dim,
+                    size,
+                    time.time(),
+                    options,
+                ),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+        ).fetchone()[0]
+        if total <= self.max_size_bytes:
+            return
+
+        rows = self._conn.execute(
+            "SELECT key, size FROM embeddings ORDER BY last_access ASC"
+        ).fetchall()
+        evict = []
+        for key, size in rows:
+            if total <= self.max_size_bytes:
+                break
+
+            evict.append((key,))
+            total -= size
+
+        self._conn.executemany("DELETE FROM embeddings WHERE key=?", evict)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TTLCache(object):
+    """Thread-safe in-memory cache whose entries expire after ``ttl`` seconds.
+
+    Example::
+
+        cache = TTLCache(ttl=60)
+        value = cache.get(key, lambda: expensive_call())
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key, fetch):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and now - entry[0] < self.ttl:
+                return entry[1]
+
+        value = fetch()
+
+        with self._lock:
+            now = time.monotonic()
+            expired = [k for k, e in self._entries.items() if now - e[0] >= self.ttl]
+            for k in expired:
+                del self._entries[k]
+
+            self._entries[key] = (now, value)
+
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class QueryEmbeddingCache(object):
+    """Two-tier LRU cache of text query embeddings.
+
+    A small in-memory tier holds the hottest entries, backed by an on-disk
+    SQLite tier that is shared by every process using the same
+    ``cache_dir``, e.g. App sessions and delegated workers. Entries are keyed
+    on the model name and the normalized prompt.
+
+    The API latency of every fetched embedding is stored with it, so the
+    latency saved by each hit can be reported.
+    """
+
+    def __init__(self, cache_dir, max_entries=100000, memory_entries=1024):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.saved_secs = 0.0
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "queries.db"),
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=30,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS queries ("
+            "key TEXT PRIMARY KEY, embedding BLOB, fetch_secs REAL, "
+            "last_access REAL)"
+        )
+
+    @staticmethod
+    def make_key(model_name, prompt):
+        return "%s:%s" % (model_name, " ".join(prompt.lower().split()))
+
+    def get(self, model_name, prompt, fetch):
+        """Returns the embedding of ``prompt``, calling ``fetch()`` to compute
+        it on a miss.
+        """
+        key = self.make_key(model_name, prompt)
+
+        with self._lock:
+            entry = self._memory.get(key, None)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.saved_secs += entry[1]
+                return entry[0]
+
+            row = self._conn.execute(
+                "SELECT embedding, fetch_secs FROM queries WHERE key=?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE queries SET last_access=? WHERE key=?",
+                    (time.time(), key),
+                )
+                embedding = np.frombuffer(row[0], dtype=np.float32)
+                self._remember(key, embedding, row[1])
+                self.disk_hits += 1
+                self.saved_secs += row[1]
+                return embedding
+
+        start = time.perf_counter()
+        embedding = np.asarray(fetch(), dtype=np.float32)
+        fetch_secs = time.perf_counter() - start
+
+        with self._lock:
+            self.misses += 1
+            self._remember(key, embedding, fetch_secs)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?)",
+                (key, embedding.tobytes(), fetch_secs, time.time()),
+            )
+            self._evict()
+
+        return embedding
+
+    def _remember(self, key, embedding, fetch_secs):
+        self._memory[key] = (embedding, fetch_secs)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+        if count <= self.max_entries:
+            return
+
+        self._conn.execute(
+            "DELETE FROM queries WHERE key IN ("
+            "SELECT key FROM queries ORDER BY last_access ASC LIMIT ?)",
+            (count - self.max_entries,),
+        )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "latency_saved_secs": self.saved_secs,
+            }
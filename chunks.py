@@ -0,0 +1,100 @@
+import math
+import os
+from collections import namedtuple
+
+import fiftyone.utils.video as fouv
+
+from .cache import CachedSegment
+
+# Twelve Labs accepts videos of up to 2 hours. Only longer videos are split,
+# and their chunks stay a little shorter so that re-encoding never pushes
+# them over the limit
+MAX_VIDEO_DURATION = 7200
+MAX_CHUNK_DURATION = 7000
+CHUNK_OVERLAP = 30
+
+Chunk = namedtuple("Chunk", ["index", "start", "end"])
+
+
+def plan_chunks(duration, max_duration=MAX_CHUNK_DURATION, overlap=CHUNK_OVERLAP):
+    """Splits ``[0, duration]`` into the fewest equal-length chunks of at most
+    ``max_duration`` seconds, each overlapping the next by ``overlap`` seconds.
+
+    Returns:
+        a list of :class:`Chunk` instances
+    """
+    if duration <= max_duration:
+        return [Chunk(0, 0.0, float(duration))]
+
+    num_chunks = math.ceil((duration - overlap) / (max_duration - overlap))
+    length = (duration + (num_chunks - 1) * overlap) / num_chunks
+    step = length - overlap
+
+    chunks = []
+    for i in range(num_chunks):
+        start = i * step
+        end = duration if i == num_chunks - 1 else start + length
+        chunks.append(Chunk(i, start, end))
+
+    return chunks
+
+
+def extract_chunk(video_path, chunk, output_dir, sample_id):
+    """Writes the given chunk of a video to ``output_dir`` and returns its
+    path.
+
+    Chunk files are named by ``sample_id`` rather than the video's filename,
+    so videos with the same name in different directories do not collide.
+
+    Args:
+        video_path: the path to the video
+        chunk: a :class:`Chunk`
+        output_dir: the directory in which to write the chunk
+        sample_id: the ID of the video's sample
+    """
+    ext = os.path.splitext(video_path)[1]
+    output_path = os.path.join(output_dir, "%s-%05d%s" % (sample_id, chunk.index, ext))
+    fouv.extract_clip(video_path, output_path, timestamps=[chunk.start, chunk.end])
+    return output_path
+
+
+def stitch_segments(chunks, chunk_segments):
+    """Stitches the segments of each chunk back onto the source video's
+    timeline.
+
+    Segment offsets are shifted by their chunk's start. Each overlap between
+    neighboring chunks is split at its midpoint, and only segments starting
+    on a chunk's side of the split are kept, so boundary segments are not
+    duplicated.
+
+    Args:
+        chunks: a list of :class:`Chunk` instances
+        chunk_segments: a list with the segments of each chunk
+
+    Returns:
+        a list of :class:`CachedSegment` instances
+    """
+    segments = []
+    for i, (chunk, chunk_segs) in enumerate(zip(chunks, chunk_segments)):
+        lower = -math.inf
+        if i > 0:
+            lower = 0.5 * (chunk.start + chunks[i - 1].end)
+
+        upper = math.inf
+        if i < len(chunks) - 1:
+            upper = 0.5 * (chunks[i + 1].start + chunk.end)
+
+        for segment in chunk_segs:
+            start = segment.start_offset_sec + chunk.start
+            if lower <= start < upper:
+                segments.append(
+                    CachedSegment(
+                        start,
+                        segment.end_offset_sec + chunk.start,
+                        segment.embeddings_float,
+                        segment.embedding_option,
+                    )
+                )
+
+    segments.sort(key=lambda s: s.start_offset_sec)
+    return segments
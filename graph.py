@@ -0,0 +1,143 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+class KNNGraph(object):
+    """k-nearest neighbor graph over the segments of a
+    :class:`search.SegmentIndex`.
+
+    Row ``i`` of ``neighbors`` holds the rows of the ``k`` segments most
+    similar to segment ``i``, sorted by descending cosine similarity, and
+    ``scores`` holds their similarities. A segment is never its own neighbor.
+    """
+
+    def __init__(self, neighbors, scores):
+        self.neighbors = np.asarray(neighbors, dtype=np.int64)
+        self.scores = np.asarray(scores, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.neighbors)
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    @classmethod
+    def build(
+        cls,
+        index,
+        k,
+        query_block_size=1024,
+        block_size=2**14,
+        on_progress=None,
+    ):
+        """Builds the exact kNN graph of the given index.
+
+        Segments are scored against each other with one matrix-matrix
+        product per ``query_block_size x block_size`` block, and only the
+        running top ``k`` of each segment is kept between blocks. Memory is
+        therefore bounded by the block sizes rather than by the number of
+        segments, while compute grows quadratically with it.
+
+        Args:
+            index: a :class:`search.SegmentIndex`
+            k: the number of neighbors per segment
+            query_block_size (1024): the number of segments whose neighbors
+                are found at a time
+            block_size (16384): the number of segments to score at a time
+            on_progress (None): an optional ``on_progress(done, total)``
+                callback
+
+        Returns:
+            a :class:`KNNGraph`
+        """
+        n = len(index)
+        k = min(k, max(n - 1, 0))
+        neighbors = np.empty((n, k), dtype=np.int64)
+        scores = np.empty((n, k), dtype=np.float32)
+
+        for start in range(0, n, query_block_size):
+            rows = np.arange(start, min(start + query_block_size, n))
+
+            # Each segment is its own best match, so one extra neighbor is
+            # fetched and the segment itself is dropped
+            inds, _scores = index.search_batch(
+                index.get_embeddings(rows), k + 1, block_size=block_size
+            )
+            keep = inds != rows[:, np.newaxis]
+            keep &= np.cumsum(keep, axis=1) <= k
+            neighbors[rows] = inds[keep].reshape(len(rows), k)
+            scores[rows] = _scores[keep].reshape(len(rows), k)
+
+            if on_progress is not None:
+                on_progress(rows[-1] + 1, n)
+
+        return cls(neighbors, scores)
+
+    def duplicates(self, threshold, sample_ids=None, supports=None):
+        """Returns the pairs of segments whose similarity is at least
+        ``threshold``.
+
+        If ``sample_ids`` and ``supports`` are provided, pairs of segments on
+        the same sample whose supports overlap are skipped, since they are
+        the same content rather than a repeat of it.
+
+        Returns:
+            a tuple of ``i``, ``j`` and ``scores`` arrays, with ``i < j`` and
+            each pair listed once
+        """
+        rows, cols = np.nonzero(self.scores >= threshold)
+        i = rows
+        j = self.neighbors[rows, cols]
+        scores = self.scores[rows, cols]
+
+        # Each pair may be found from both ends
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        _, unique = np.unique(np.stack([i, j], axis=1), axis=0, return_index=True)
+        i, j, scores = i[unique], j[unique], scores[unique]
+
+        if sample_ids is not None and supports is not None:
+            sample_ids = np.asarray(sample_ids)
+            supports = np.asarray(supports)
+            overlaps = np.minimum(supports[i, 1], supports[j, 1]) >= np.maximum(
+                supports[i, 0], supports[j, 0]
+            )
+            keep = (sample_ids[i] != sample_ids[j]) | ~overlaps
+            i, j, scores = i[keep], j[keep], scores[keep]
+
+        return i, j, scores
+
+    def clusters(self, threshold, sample_ids=None, supports=None):
+        """Clusters the segments into groups of near-duplicates.
+
+        Two segments are in the same cluster if they are connected by a
+        chain of pairs returned by :meth:`duplicates`.
+
+        Returns:
+            an array of cluster labels per segment, as returned by
+            :func:`cluster_pairs`
+        """
+        i, j, _ = self.duplicates(threshold, sample_ids=sample_ids, supports=supports)
+        return cluster_pairs(len(self), i, j)
+
+
+def cluster_pairs(n, i, j):
+    """Labels the connected components of the graph with ``n`` nodes and
+    edges ``(i, j)``.
+
+    Returns:
+        an array of cluster labels per node, numbered from 0 in order of
+        decreasing cluster size. Nodes without edges are labeled -1
+    """
+    adjacency = coo_matrix((np.ones(len(i)), (i, j)), shape=(n, n))
+    _, components = connected_components(adjacency, directed=False)
+
+    sizes = np.bincount(components)
+    order = np.argsort(-sizes, kind="stable")
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+
+    labels = ranks[components]
+    labels[sizes[components] < 2] = -1
+    return labels
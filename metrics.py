@@ -0,0 +1,126 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics(object):
+    """Thread-safe per-stage timers and counters for one operator run.
+
+    Example::
+
+        metrics = Metrics("create_twelve_labs_embeddings")
+        with metrics.timer("upload"):
+            ...
+
+        metrics.incr("bytes_uploaded", num_bytes)
+        output["metrics"] = metrics.finish()
+
+    Stages that run concurrently each accumulate their own time, so stage
+    totals can add up to more than the run's wall time.
+    """
+
+    def __init__(self, operator):
+        self.operator = operator
+        self.start = time.perf_counter()
+
+        self._lock = threading.Lock()
+        self._timings = defaultdict(lambda: [0, 0.0, 0.0])
+        self._counters = defaultdict(int)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, secs):
+        with self._lock:
+            timing = self._timings[stage]
+            timing[0] += 1
+            timing[1] += secs
+            timing[2] = max(timing[2], secs)
+
+    def incr(self, counter, value=1):
+        with self._lock:
+            self._counters[counter] += value
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "operator": self.operator,
+                "wall_secs": time.perf_counter() - self.start,
+                "timings": {
+                    stage: {"count": t[0], "total_secs": t[1], "max_secs": t[2]}
+                    for stage, t in self._timings.items()
+                },
+                "counters": dict(self._counters),
+            }
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        d = self.to_dict()
+        op = 'operator="%s"' % self.operator
+        lines = [
+            "# HELP twelve_labs_run_seconds Wall time of the last operator run.",
+            "# TYPE twelve_labs_run_seconds gauge",
+            "twelve_labs_run_seconds{%s} %r" % (op, d["wall_secs"]),
+            "# HELP twelve_labs_stage_seconds Time spent in each stage of the last run.",
+            "# TYPE twelve_labs_stage_seconds gauge",
+        ]
+        for stage, t in sorted(d["timings"].items()):
+            lines.append(
+                'twelve_labs_stage_seconds{%s,stage="%s"} %r'
+                % (op, stage, t["total_secs"])
+            )
+
+        lines += [
+            "# HELP twelve_labs_stage_calls Number of times each stage ran in the last run.",
+            "# TYPE twelve_labs_stage_calls gauge",
+        ]
+        for stage, t in sorted(d["timings"].items()):
+            lines.append(
+                'twelve_labs_stage_calls{%s,stage="%s"} %d' % (op, stage, t["count"])
+            )
+
+        lines += [
+            "# HELP twelve_labs_count Counters of the last run.",
+            "# TYPE twelve_labs_count gauge",
+        ]
+        for counter, value in sorted(d["counters"].items()):
+            lines.append('twelve_labs_count{%s,counter="%s"} %r' % (op, counter, value))
+
+        return "\n".join(lines) + "\n"
+
+    def finish(self):
+        """Logs the metrics, exports them if ``TL_METRICS_DIR`` is set, and
+        returns them as a dict.
+        """
+        d = self.to_dict()
+        logger.info(json.dumps({"event": "twelve_labs_metrics", **d}))
+
+        metrics_dir = os.environ.get("TL_METRICS_DIR", None)
+        if metrics_dir:
+            self.export(metrics_dir)
+
+        return d
+
+    def export(self, metrics_dir):
+        """Writes the metrics to ``<operator>.prom`` in ``metrics_dir``, e.g.
+        for the node_exporter textfile collector.
+        """
+        os.makedirs(metrics_dir, exist_ok=True)
+        path = os.path.join(metrics_dir, self.operator + ".prom")
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus())
+
+        # Scrapers must never see a partially written file
+        os.replace(tmp_path, path)
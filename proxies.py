@@ -0,0 +1,225 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import hash_file
+
+PROXY_MAX_SIZE = 720
+PROXY_MAX_BITRATE = "2M"
+
+
+class UploadProxies(object):
+    """Transcodes videos to smaller proxies before they are uploaded to
+    Twelve Labs.
+
+    Proxies cap the shorter side of the video at ``max_size`` pixels and its
+    bitrate at ``max_bitrate``, and drop the audio track unless
+    ``keep_audio`` is True. Each transcode runs in its own ffmpeg process, at
+    most ``max_workers`` at a time.
+
+    Proxies are stored in ``cache_dir`` keyed on the SHA-256 of the source
+    video and the proxy settings, so re-ingesting a video reuses its proxy.
+    Pass a ``content_hash`` function that memoizes hashes, such as
+    :meth:`EmbeddingCache.content_hash`, to avoid re-reading large sources
+    on every run.
+    The least recently used proxies are evicted once the cache exceeds
+    ``max_size_bytes``, except those used since this instance was created,
+    which may still be uploading. If a proxy is not smaller than its source, the source
+    is uploaded instead.
+
+    Example::
+
+        with UploadProxies(cache_dir, keep_audio=False) as proxies:
+            upload(proxies.get(sample.filepath))
+
+        print(proxies.stats())
+
+    Args:
+        cache_dir: the directory in which to store proxies
+        max_size (720): the maximum length of the shorter side, in pixels
+        max_bitrate ("2M"): the maximum video bitrate
+        keep_audio (True): whether to keep the audio track
+        max_workers (None): the maximum number of concurrent transcodes. By
+            default, this is half the number of CPUs
+        max_size_bytes (50 GB): the maximum total size of the cache
+        content_hash (None): a function that returns the SHA-256 of a file.
+            By default, files are hashed in full on every call
+        metrics (None): an optional :class:`Metrics` that records transcode
+            time and bytes saved
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        max_size=PROXY_MAX_SIZE,
+        max_bitrate=PROXY_MAX_BITRATE,
+        keep_audio=True,
+        max_workers=None,
+        max_size_bytes=50 * 2**30,
+        content_hash=None,
+        metrics=None,
+    ):
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 2) // 2)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_bitrate = max_bitrate
+        self.keep_audio = keep_audio
+        self.max_size_bytes = max_size_bytes
+        self.content_hash = content_hash or hash_file
+        self.metrics = metrics
+
+        self.num_transcoded = 0
+        self.num_reused = 0
+        self.source_bytes = 0
+        self.proxy_bytes = 0
+
+        # Whole seconds, so that coarse filesystem timestamps still compare
+        self._created_at = int(time.time())
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, video_path):
+        """Returns the path to upload for the given video, transcoding it if
+        necessary. Blocks until the proxy is ready.
+
+        Concurrent requests for the same video share one transcode.
+        """
+        with self._lock:
+            future = self._futures.get(video_path, None)
+            if future is None:
+                future = self._executor.submit(self._make_proxy, video_path)
+                self._futures[video_path] = future
+
+        return future.result()
+
+    def stats(self):
+        return {
+            "num_transcoded": self.num_transcoded,
+            "num_reused": self.num_reused,
+            "source_bytes": self.source_bytes,
+            "proxy_bytes": self.proxy_bytes,
+            "bytes_saved": self.source_bytes - self.proxy_bytes,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _proxy_path(self, video_path):
+        name = "%s-%d-%s-%s.mp4" % (
+            self.content_hash(video_path),
+            self.max_size,
+            self.max_bitrate,
+            "a" if self.keep_audio else "na",
+        )
+        return os.path.join(self.cache_dir, name)
+
+    def _make_proxy(self, video_path):
+        proxy_path = self._proxy_path(video_path)
+        if os.path.isfile(proxy_path):
+            # Refresh the modification time, which orders eviction
+            os.utime(proxy_path)
+            with self._lock:
+                self.num_reused += 1
+        else:
+            start = time.perf_counter()
+            transcode_proxy(
+                video_path,
+                proxy_path,
+                max_size=self.max_size,
+                max_bitrate=self.max_bitrate,
+                keep_audio=self.keep_audio,
+            )
+            if self.metrics is not None:
+                self.metrics.add_time("proxy_transcode", time.perf_counter() - start)
+
+            with self._lock:
+                self.num_transcoded += 1
+                self._evict()
+
+        source_size = os.path.getsize(video_path)
+        proxy_size = os.path.getsize(proxy_path)
+        if proxy_size >= source_size:
+            proxy_path = video_path
+            proxy_size = source_size
+
+        with self._lock:
+            self.source_bytes += source_size
+            self.proxy_bytes += proxy_size
+
+        if self.metrics is not None:
+            self.metrics.incr("proxy_bytes_saved", source_size - proxy_size)
+
+        return proxy_path
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".mp4") and entry.is_file():
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+
+        # Proxies used by this or a concurrent run since it started have been
+        # touched since, and may still be uploading
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size_bytes or mtime >= self._created_at:
+                break
+
+            os.remove(path)
+            total -= size
+
+
+def transcode_proxy(
+    video_path,
+    output_path,
+    max_size=PROXY_MAX_SIZE,
+    max_bitrate=PROXY_MAX_BITRATE,
+    keep_audio=True,
+):
+    """Transcodes a video to an H.264 proxy with ffmpeg.
+
+    The shorter side of the video is capped at ``max_size`` pixels, and the
+    aspect ratio is preserved. Videos that are already smaller are not
+    upscaled.
+    """
+    scale = (
+        "scale='if(gte(iw,ih),-2,trunc(min(iw,{0})/2)*2)'"
+        ":'if(gte(iw,ih),trunc(min(ih,{0})/2)*2,-2)'".format(max_size)
+    )
+    args = ["ffmpeg", "-nostdin", "-y", "-loglevel", "error", "-i", video_path]
+    args += ["-map", "0:v:0", "-vf", scale, "-pix_fmt", "yuv420p"]
+    args += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "26"]
+    args += ["-maxrate", max_bitrate, "-bufsize", max_bitrate]
+    if keep_audio:
+        args += ["-map", "0:a:0?", "-c:a", "aac", "-b:a", "96k"]
+    else:
+        args += ["-an"]
+
+    # Write to a temporary file so that a killed run never leaves a
+    # truncated proxy in the cache
+    tmp_path = "%s.%d.tmp" % (output_path, threading.get_ident())
+    args += ["-movflags", "+faststart", "-f", "mp4", tmp_path]
+
+    try:
+        subprocess.run(args, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        raise RuntimeError(
+            "Failed to transcode %s: %s" % (video_path, e.stderr.decode().strip())
+        )
+
+    os.replace(tmp_path, output_path)
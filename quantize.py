@@ -0,0 +1,33 @@
+import numpy as np
+
+# Storage precisions of segment embeddings and their dtypes
+PRECISIONS = {
+    "FLOAT32": np.float32,
+    "FLOAT16": np.float16,
+    "INT8": np.int8,
+}
+
+
+def quantize(embeddings, precision):
+    """Quantizes the given embeddings to the given precision.
+
+    ``INT8`` embeddings are scaled per vector, so that each vector's largest
+    magnitude maps to 127. Multiplying the codes by their scale recovers the
+    original vector to within half a quantization step.
+
+    Args:
+        embeddings: an array of embeddings, one per row
+        precision: one of :data:`PRECISIONS`
+
+    Returns:
+        a tuple of the quantized embeddings and their per-vector scales, or
+        None if the precision needs no scales
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if precision != "INT8":
+        return embeddings.astype(PRECISIONS[precision]), None
+
+    scales = np.abs(embeddings).max(axis=-1, keepdims=True) / 127
+    scales[scales == 0] = 1
+    codes = np.clip(np.rint(embeddings / scales), -127, 127).astype(np.int8)
+    return codes, scales[..., 0]
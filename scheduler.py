@@ -0,0 +1,275 @@
+import email.utils
+import os
+import random
+import threading
+import time
+
+import httpx
+from twelvelabs import TwelveLabs
+
+# Requests that may have created a task are only retried when the server
+# says it did not process them, or when they never left this machine. A
+# gateway error may arrive after the upstream accepted the request
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+_RETRY_STATUSES = {429, 503}
+_RETRY_IDEMPOTENT_STATUSES = {500, 502, 504}
+_UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket that refills at ``rate`` tokens per second,
+    up to ``burst`` tokens.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available.
+
+        Returns:
+            the number of seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    elapsed = now - self._last
+                    self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+                    self._last = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+
+                    wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, secs):
+        """Hands out no tokens for the next ``secs`` seconds, after which the
+        bucket refills from empty.
+        """
+        with self._lock:
+            until = time.monotonic() + secs
+            if until > self._paused_until:
+                self._paused_until = until
+                self._last = until
+                self._tokens = 0
+
+
+class RequestScheduler(object):
+    """Schedules the HTTP requests of every Twelve Labs client that shares an
+    API key.
+
+    All clients share one connection pool, one token bucket and one cap on
+    concurrent requests. Requests that fail with a rate limit or an
+    unavailable server, and requests that could not connect, are retried
+    with exponential backoff and full jitter. Idempotent requests are also
+    retried on gateway errors, server errors and any connection error. A ``Retry-After`` header takes precedence over the backoff, and a
+    429 pauses the token bucket so that every client backs off together.
+
+    Args:
+        rate (10): the maximum number of requests per second, or None for no
+            limit
+        burst (None): the number of requests that may be sent at once after
+            an idle period. By default, this is ``rate``
+        max_concurrent (16): the maximum number of requests in flight
+        max_retries (5): the maximum number of retries per request
+        backoff (0.5): the base backoff, in seconds. The n-th retry waits a
+            random time of up to ``backoff * 2 ** n`` seconds
+        max_backoff (60.0): the maximum backoff, in seconds. Responses whose
+            ``Retry-After`` asks for a longer wait are not retried
+    """
+
+    def __init__(
+        self,
+        rate=10,
+        burst=None,
+        max_concurrent=16,
+        max_retries=5,
+        backoff=0.5,
+        max_backoff=60.0,
+    ):
+        self.bucket = TokenBucket(rate, burst=burst) if rate else None
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._transport = httpx.HTTPTransport(
+            limits=httpx.Limits(
+                max_connections=max_concurrent,
+                max_keepalive_connections=max_concurrent,
+            )
+        )
+
+    def client(self, api_key, metrics=None):
+        """Returns a ``TwelveLabs`` client whose requests go through this
+        scheduler.
+
+        Args:
+            api_key: the API key
+            metrics (None): an optional :class:`Metrics` that records API
+                calls, retries and the time spent waiting on the rate limit
+        """
+        client = TwelveLabs(api_key=api_key)
+
+        # The SDK does not expose its HTTP client, so this relies on the
+        # private attribute of the versions pinned in requirements.txt
+        http_client = getattr(client, "_client", None)
+        if not isinstance(http_client, httpx.Client):
+            raise TypeError(
+                "Unsupported twelvelabs SDK version: expected the client to "
+                "wrap an httpx.Client, but found %s" % type(http_client)
+            )
+
+        client._client = httpx.Client(
+            base_url=http_client.base_url,
+            headers=http_client.headers,
+            timeout=http_client.timeout,
+            transport=_ScheduledTransport(self, metrics),
+        )
+        http_client.close()
+        return client
+
+    def send(self, request, metrics=None):
+        """Sends the given ``httpx.Request``, retrying it as necessary.
+
+        Returns:
+            an ``httpx.Response``
+        """
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                waited = self.bucket.acquire()
+                if waited and metrics is not None:
+                    metrics.add_time("rate_limit_wait", waited)
+
+            if metrics is not None:
+                metrics.incr("api_calls")
+
+            try:
+                with self._semaphore:
+                    response = self._transport.handle_request(request)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries or not _can_retry_error(request, e):
+                    raise
+
+                delay = self._backoff(attempt)
+            else:
+                status = response.status_code
+                if attempt >= self.max_retries or not _can_retry_status(
+                    request, status
+                ):
+                    return response
+
+                delay = _parse_retry_after(response.headers.get("Retry-After"))
+                if delay is None:
+                    delay = self._backoff(attempt)
+                elif delay > self.max_backoff:
+                    return response
+                else:
+                    # Clients told to wait the same time should not all
+                    # come back at once
+                    delay += random.uniform(0, self.backoff)
+
+                response.close()
+
+                if status == 429 and self.bucket is not None:
+                    self.bucket.pause(delay)
+
+            if metrics is not None:
+                metrics.incr("api_retries")
+
+            time.sleep(delay)
+            attempt += 1
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+
+class _ScheduledTransport(httpx.BaseTransport):
+    def __init__(self, scheduler, metrics):
+        self.scheduler = scheduler
+        self.metrics = metrics
+
+    def handle_request(self, request):
+        return self.scheduler.send(request, metrics=self.metrics)
+
+    def close(self):
+        # The connection pool is shared by every client of the scheduler
+        pass
+
+
+def get_scheduler(api_key):
+    """Returns the process-wide :class:`RequestScheduler` for the given API
+    key, configured by the ``TL_MAX_REQUESTS_PER_SEC``,
+    ``TL_MAX_CONCURRENT_REQUESTS`` and ``TL_MAX_RETRIES`` environment
+    variables.
+    """
+    # Connection pools must not be shared with forked workers
+    key = (api_key, os.getpid())
+    with _SCHEDULERS_LOCK:
+        if key not in _SCHEDULERS:
+            rate = float(os.environ.get("TL_MAX_REQUESTS_PER_SEC", 10))
+            _SCHEDULERS[key] = RequestScheduler(
+                rate=rate if rate > 0 else None,
+                max_concurrent=int(os.environ.get("TL_MAX_CONCURRENT_REQUESTS", 16)),
+                max_retries=int(os.environ.get("TL_MAX_RETRIES", 5)),
+            )
+
+        return _SCHEDULERS[key]
+
+
+def get_client(api_key, metrics=None):
+    """Returns a ``TwelveLabs`` client whose requests go through the shared
+    :class:`RequestScheduler` of its API key.
+    """
+    return get_scheduler(api_key).client(api_key, metrics=metrics)
+
+
+def _can_retry_status(request, status):
+    if status in _RETRY_STATUSES:
+        return True
+
+    return request.method in _IDEMPOTENT_METHODS and (
+        status in _RETRY_IDEMPOTENT_STATUSES
+    )
+
+
+def _can_retry_error(request, error):
+    if isinstance(error, _UNSENT_ERRORS):
+        return True
+
+    return request.method in _IDEMPOTENT_METHODS
+
+
+def _parse_retry_after(value):
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(date.timestamp() - time.time(), 0.0)
@@ -0,0 +1,1190 @@
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict, defaultdict
+
+import fiftyone.core.utils as fou
+from fiftyone.operators.store import ExecutionStore
+import numpy as np
+
+# Quantized rows are expanded to float32 this many at a time while scoring
+_QUANTIZED_BLOCK_SIZE = 2**13
+
+# Multimodal batch searches hold at most this many clip scores at a time
+_MULTIMODAL_BUFFER_SIZE = 2**24
+
+
+class SegmentIndex(object):
+    """Matrix of segment embeddings that can be scored against queries.
+
+    Row ``i`` of the index corresponds to the temporal detection with support
+    ``supports[i]`` on the sample with ID ``sample_ids[i]``. The first
+    ``len(embeddings)`` rows are held in memory, and any remaining rows are
+    read from ``store`` at ``store_rows``.
+
+    In-memory float32 rows are L2-normalized up front. Quantized float16 and
+    int8 rows are kept at their precision and expanded to float32 a block at
+    a time while scoring. ``refs`` optionally holds the store row of each
+    in-memory row, or -1, so that the best candidates can be re-scored at
+    full precision.
+
+    ``label_ids`` optionally holds the ID of each row's temporal detection,
+    which is also the ID of its clip in a clips view, and
+    ``embedding_options`` optionally holds the modality of each row, such as
+    ``"visual-text"`` or ``"audio"``, or None if it is unknown.
+    """
+
+    def __init__(
+        self,
+        sample_ids,
+        supports,
+        embeddings,
+        store=None,
+        store_rows=None,
+        refs=None,
+        label_ids=None,
+        embedding_options=None,
+    ):
+        self.sample_ids = np.asarray(sample_ids, dtype=object)
+        self.label_ids = (
+            None if label_ids is None else np.asarray(label_ids, dtype=object)
+        )
+        self.embedding_options = (
+            None
+            if embedding_options is None
+            else np.asarray(embedding_options, dtype=object)
+        )
+        self.supports = np.asarray(supports, dtype=np.int64).reshape(-1, 2)
+
+        embeddings = np.asarray(embeddings)
+        if embeddings.dtype in (np.float16, np.int8):
+            self.embeddings = embeddings
+            self._inv_norms = 1 / _quantized_norms(embeddings)
+        else:
+            self.embeddings = _normalize(embeddings.astype(np.float32))
+            self._inv_norms = None
+
+        self.refs = None if refs is None else np.asarray(refs, dtype=np.int64)
+
+        if store_rows is None:
+            store_rows = []
+
+        self.store = store
+        self.store_rows = np.asarray(store_rows, dtype=np.int64)
+        if store is not None and len(self.store_rows) > 0:
+            norms = store.norms()[self.store_rows]
+            norms[norms == 0] = 1
+            self._store_norms = norms
+        else:
+            self._store_norms = np.empty(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    @classmethod
+    def from_view(cls, view, field, store=None):
+        ids, label_ids, supports, embeddings, refs, options = view.values(
+            [
+                "id",
+                field + ".detections.id",
+                field + ".detections.support",
+                field + ".detections.embedding",
+                field + ".detections.embedding_ref",
+                field + ".detections.embedding_option",
+            ]
+        )
+
+        sample_ids = []
+        all_label_ids = []
+        all_supports = []
+        all_options = []
+        rows = []
+        row_refs = []
+        store_sample_ids = []
+        store_label_ids = []
+        store_supports = []
+        store_options = []
+        store_rows = []
+        for _id, _label_ids, _supports, _embeddings, _refs, _options in zip(
+            ids, label_ids, supports, embeddings, refs, options
+        ):
+            if not _supports:
+                continue
+
+            for label_id, support, embedding, ref, option in zip(
+                _label_ids, _supports, _embeddings, _refs, _options
+            ):
+                if isinstance(embedding, bytes):
+                    # Quantized embeddings are stored as serialized arrays,
+                    # and take precedence over the store for scoring
+                    sample_ids.append(_id)
+                    all_label_ids.append(label_id)
+                    all_supports.append(support)
+                    all_options.append(option)
+                    rows.append(fou.deserialize_numpy_array(embedding))
+                    row_refs.append(
+                        ref if ref is not None and store is not None else -1
+                    )
+                elif ref is not None and store is not None:
+                    store_sample_ids.append(_id)
+                    store_label_ids.append(label_id)
+                    store_supports.append(support)
+                    store_options.append(option)
+                    store_rows.append(ref)
+                elif embedding is not None:
+                    sample_ids.append(_id)
+                    all_label_ids.append(label_id)
+                    all_supports.append(support)
+                    all_options.append(option)
+                    rows.append(embedding)
+                    row_refs.append(-1)
+
+        if rows:
+            rows = np.array(rows, dtype=_common_dtype(rows))
+        else:
+            rows = np.empty((0, 0), dtype=np.float32)
+
+        return cls(
+            sample_ids + store_sample_ids,
+            all_supports + store_supports,
+            rows,
+            store=store,
+            store_rows=store_rows,
+            refs=row_refs if any(ref >= 0 for ref in row_refs) else None,
+            label_ids=all_label_ids + store_label_ids,
+            embedding_options=all_options + store_options,
+        )
+
+    def select(self, inds):
+        """Returns a :class:`SegmentIndex` with only the given rows, which
+        must be sorted.
+        """
+        inds = np.asarray(inds, dtype=np.int64)
+        num_memory = len(self.embeddings)
+        memory_inds = inds[inds < num_memory]
+        store_inds = inds[inds >= num_memory] - num_memory
+
+        return SegmentIndex(
+            self.sample_ids[inds],
+            self.supports[inds],
+            self.embeddings[memory_inds],
+            store=self.store,
+            store_rows=self.store_rows[store_inds],
+            refs=None if self.refs is None else self.refs[memory_inds],
+            label_ids=None if self.label_ids is None else self.label_ids[inds],
+            embedding_options=(
+                None if self.embedding_options is None else self.embedding_options[inds]
+            ),
+        )
+
+    def get_embeddings(self, inds):
+        """Returns the float32 embeddings of the given rows of the index.
+
+        In-memory rows are returned normalized, and rows backed by the store
+        are returned as stored.
+        """
+        inds = np.asarray(inds, dtype=np.int64)
+        num_memory = len(self.embeddings)
+        in_memory = inds < num_memory
+
+        if self.store is None or not np.any(~in_memory):
+            return self._get_memory_embeddings(inds)
+
+        out = np.empty((len(inds), self.store.dim), dtype=np.float32)
+        if np.any(in_memory):
+            out[in_memory] = self._get_memory_embeddings(inds[in_memory])
+
+        out[~in_memory] = self.store.get(self.store_rows[inds[~in_memory] - num_memory])
+        return out
+
+    def score_rows(self, inds, queries, full_precision=False):
+        """Returns the ``len(inds) x num_queries`` cosine similarities of the
+        given rows of the index to the given queries.
+
+        If ``full_precision`` is True, quantized rows with a full precision
+        copy in the store are scored from the store.
+        """
+        inds = np.asarray(inds, dtype=np.int64)
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = _normalize(queries.reshape(len(queries), -1))
+        if len(inds) == 0:
+            return np.empty((0, len(queries)), dtype=np.float32)
+
+        embeddings = self.get_embeddings(inds)
+        if full_precision and self.refs is not None:
+            in_memory = inds < len(self.embeddings)
+            refs = np.full(len(inds), -1, dtype=np.int64)
+            refs[in_memory] = self.refs[inds[in_memory]]
+            exact = refs >= 0
+            if np.any(exact):
+                embeddings[exact] = self.store.get(refs[exact])
+
+        return _normalize(embeddings) @ queries.T
+
+    def find(self, clips, min_overlap=0.5):
+        """Returns the rows of the segments that match the given clips.
+
+        Each clip is a ``(sample_id, support)`` tuple. A clip matches the
+        segments on its sample with the same support if there are any, and
+        otherwise those that overlap it by at least ``min_overlap`` of the
+        shorter support. A support of None matches every segment of the
+        sample.
+        """
+        sample_clips = defaultdict(list)
+        for sample_id, support in clips:
+            sample_clips[sample_id].append(support)
+
+        candidates = np.nonzero(np.isin(self.sample_ids, list(sample_clips)))[0]
+        sample_rows = defaultdict(list)
+        for i in candidates:
+            sample_rows[self.sample_ids[i]].append(i)
+
+        rows = set()
+        for sample_id, supports in sample_clips.items():
+            _rows = sample_rows.get(sample_id, [])
+            for support in supports:
+                if support is None:
+                    rows.update(_rows)
+                    continue
+
+                support = (int(support[0]), int(support[1]))
+                matches = [i for i in _rows if tuple(self.supports[i]) == support]
+                if not matches:
+                    matches = [
+                        i
+                        for i in _rows
+                        if _overlap(self.supports[i], support) >= min_overlap
+                    ]
+
+                rows.update(matches)
+
+        return np.array(sorted(rows), dtype=np.int64)
+
+    def score(self, query, block_size=2**16):
+        query = _normalize(np.asarray(query, dtype=np.float32).ravel())
+
+        # Only the rows of the index are read from the store, which may also
+        # hold rows of other views and superseded rows
+        scores = np.empty(len(self), dtype=np.float32)
+        blocks = self._iter_score_blocks(query[:, np.newaxis], block_size)
+        for offset, block_scores in blocks:
+            scores[offset : offset + len(block_scores)] = block_scores[:, 0]
+
+        return scores
+
+    def search(self, query, k, rerank=0):
+        """Returns the indices and scores of the ``k`` best matching segments,
+        sorted by descending score.
+
+        If ``rerank`` is greater than ``k``, the best ``rerank`` candidates
+        are re-scored at full precision from the store where possible, and
+        the best ``k`` of them are returned.
+        """
+        query = _normalize(np.asarray(query, dtype=np.float32).ravel())
+        inds, scores = top_k(self.score(query), max(k, rerank))
+        if rerank > k:
+            inds, scores = self._rerank(inds[np.newaxis], scores[np.newaxis], query)
+            inds, scores = inds[0, :k], scores[0, :k]
+
+        return inds, scores
+
+    def search_batch(self, queries, k, block_size=2**16, rerank=0):
+        """Returns the indices and scores of the ``k`` best matching segments
+        for each of the given queries.
+
+        All queries are scored together, one matrix-matrix product per block
+        of ``block_size`` segments, and only the running top ``k`` of each
+        query is kept between blocks.
+
+        Args:
+            queries: a ``num_queries x dim`` array of query embeddings
+            k: the number of segments to return per query
+            block_size (65536): the number of segments to score at a time
+            rerank (0): the number of candidates per query to re-score at
+                full precision, if greater than ``k``
+
+        Returns:
+            a tuple of ``num_queries x k`` arrays of indices and scores, each
+            row sorted by descending score
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = _normalize(queries.reshape(len(queries), -1))
+
+        num_queries = len(queries)
+        inds = np.empty((num_queries, 0), dtype=np.int64)
+        scores = np.empty((num_queries, 0), dtype=np.float32)
+        if k <= 0:
+            return inds, scores
+
+        num_candidates = max(k, rerank)
+        for offset, block_scores in self._iter_score_blocks(queries.T, block_size):
+            # Each block is cut down to its own best candidates before they
+            # are merged with the running ones
+            block_scores = np.ascontiguousarray(block_scores.T)
+            if block_scores.shape[1] > num_candidates:
+                block_inds = np.argpartition(-block_scores, num_candidates - 1, axis=1)[
+                    :, :num_candidates
+                ]
+                block_scores = np.take_along_axis(block_scores, block_inds, axis=1)
+            else:
+                block_inds = np.broadcast_to(
+                    np.arange(block_scores.shape[1]), block_scores.shape
+                )
+
+            inds = np.concatenate([inds, block_inds + offset], axis=1)
+            scores = np.concatenate([scores, block_scores], axis=1)
+            if scores.shape[1] > num_candidates:
+                keep = np.argpartition(-scores, num_candidates - 1, axis=1)
+                keep = keep[:, :num_candidates]
+                inds = np.take_along_axis(inds, keep, axis=1)
+                scores = np.take_along_axis(scores, keep, axis=1)
+
+        if rerank > k:
+            inds, scores = self._rerank(inds, scores, queries)
+        else:
+            order = np.argsort(-scores, axis=1, kind="stable")
+            inds = np.take_along_axis(inds, order, axis=1)
+            scores = np.take_along_axis(scores, order, axis=1)
+
+        return inds[:, :k], scores[:, :k]
+
+    def _rerank(self, inds, scores, queries):
+        # Only quantized in-memory rows with a full precision copy in the
+        # store need re-scoring, since all other rows are already exact
+        queries = queries.reshape(-1, queries.shape[-1])
+        scores = scores.copy()
+        if self._inv_norms is not None and self.refs is not None:
+            in_memory = inds < len(self.embeddings)
+            refs = np.full(inds.shape, -1, dtype=np.int64)
+            refs[in_memory] = self.refs[inds[in_memory]]
+
+            query_inds, cols = np.nonzero(refs >= 0)
+            if len(query_inds) > 0:
+                rows, inverse = np.unique(refs[query_inds, cols], return_inverse=True)
+                exact = _normalize(self.store.get(rows)) @ queries.T
+                scores[query_inds, cols] = exact[inverse, query_inds]
+
+        order = np.argsort(-scores, axis=1, kind="stable")
+        return (
+            np.take_along_axis(inds, order, axis=1),
+            np.take_along_axis(scores, order, axis=1),
+        )
+
+    def _get_memory_embeddings(self, inds):
+        if self._inv_norms is None:
+            return self.embeddings[inds]
+
+        embeddings = self.embeddings[inds].astype(np.float32)
+        return embeddings * self._inv_norms[inds, np.newaxis]
+
+    def _memory_dot(self, start, stop, queries):
+        if self._inv_norms is None:
+            return self.embeddings[start:stop] @ queries
+
+        out = np.empty((stop - start,) + queries.shape[1:], dtype=np.float32)
+        for i in range(start, stop, _QUANTIZED_BLOCK_SIZE):
+            j = min(i + _QUANTIZED_BLOCK_SIZE, stop)
+            inv_norms = self._inv_norms[i:j]
+            if queries.ndim == 2:
+                inv_norms = inv_norms[:, np.newaxis]
+
+            block = self.embeddings[i:j].astype(np.float32)
+            out[i - start : j - start] = (block @ queries) * inv_norms
+
+        return out
+
+    def _iter_score_blocks(self, queries, block_size):
+        num_memory = len(self.embeddings)
+        for start in range(0, num_memory, block_size):
+            stop = min(start + block_size, num_memory)
+            yield start, self._memory_dot(start, stop, queries)
+
+        for start in range(0, len(self.store_rows), block_size):
+            rows = self.store_rows[start : start + block_size]
+            norms = self._store_norms[start : start + block_size]
+            block_scores = self.store.get(rows) @ queries
+            yield num_memory + start, block_scores / norms[:, np.newaxis]
+
+
+class MultimodalIndex(object):
+    """Segment embeddings of several modalities, each held in its own
+    :class:`SegmentIndex`, that are scored separately and combined per clip.
+
+    Twelve Labs embeds each clip of a video once per modality, so clip ``i``
+    is the support ``supports[i]`` on the sample with ID ``sample_ids[i]``,
+    and ``rows[i, j]`` is the row of its segment in the index of modality
+    ``options[j]``, or -1 if it has none.
+
+    The scores of a clip's modalities are combined with one of the following
+    operators:
+
+    -   ``"or"``: the best score of any modality
+    -   ``"and"``: the worst score of all modalities, so clips that lack a
+        modality never match
+    -   ``"weighted"``: the weighted mean of the scores of the modalities
+        that the clip has
+    """
+
+    def __init__(self, indexes):
+        self.options = list(indexes.keys())
+        self.indexes = [indexes[option] for option in self.options]
+
+        clips = {}
+        self._row_clips = []
+        for index in self.indexes:
+            row_clips = np.empty(len(index), dtype=np.int64)
+            keys = zip(
+                index.sample_ids,
+                index.supports[:, 0].tolist(),
+                index.supports[:, 1].tolist(),
+            )
+            for i, key in enumerate(keys):
+                row_clips[i] = clips.setdefault(key, len(clips))
+
+            self._row_clips.append(row_clips)
+
+        self.rows = np.full((len(clips), len(self.indexes)), -1, dtype=np.int64)
+        for j, row_clips in enumerate(self._row_clips):
+            self.rows[row_clips, j] = np.arange(len(row_clips))
+
+        if clips:
+            sample_ids, starts, ends = zip(*clips.keys())
+        else:
+            sample_ids, starts, ends = [], [], []
+
+        self.sample_ids = np.asarray(sample_ids, dtype=object)
+        self.supports = np.stack(
+            [np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)],
+            axis=1,
+        )
+
+    def __len__(self):
+        return len(self.sample_ids)
+
+    @property
+    def num_segments(self):
+        return sum(len(index) for index in self.indexes)
+
+    @classmethod
+    def from_index(cls, index):
+        """Splits the given :class:`SegmentIndex` into one index per modality.
+
+        Segments whose modality is unknown are skipped.
+        """
+        options = index.embedding_options
+        if options is None:
+            options = np.full(len(index), None, dtype=object)
+
+        known = sorted({option for option in options if option is not None})
+        return cls(
+            {option: index.select(np.nonzero(options == option)[0]) for option in known}
+        )
+
+    def find(self, clips, min_overlap=0.5):
+        """Returns the indices of the clips that match the given clips in any
+        modality.
+
+        See :meth:`SegmentIndex.find` for how clips are matched.
+        """
+        inds = [
+            row_clips[index.find(clips, min_overlap=min_overlap)]
+            for index, row_clips in zip(self.indexes, self._row_clips)
+        ]
+        return np.unique(np.concatenate(inds)) if inds else np.empty(0, np.int64)
+
+    def pool(self, clip_inds):
+        """Returns a dict mapping each modality to the mean of the normalized
+        segment embeddings of the given clips in that modality.
+
+        Modalities in which none of the clips have a segment are omitted.
+        """
+        pooled = {}
+        for option, index, rows in zip(self.options, self.indexes, self.rows.T):
+            rows = rows[clip_inds]
+            rows = rows[rows >= 0]
+            if len(rows) > 0:
+                pooled[option] = pool_embeddings(index.get_embeddings(rows))
+
+        return pooled
+
+    def search(self, query, k, options=None, operator="or", weights=None, rerank=0):
+        """Returns the indices and combined scores of the ``k`` best matching
+        clips, sorted by descending score.
+
+        Every segment of the requested modalities is scored. If ``rerank`` is
+        greater than ``k``, the best ``rerank`` clips are re-scored at full
+        precision from the store where possible.
+
+        Args:
+            query: the query embedding, or a dict mapping modalities to the
+                query embedding of each
+            k: the number of clips to return
+            options (None): the modalities to score. By default, all are
+                scored, or all that have a query
+            operator ("or"): how to combine the scores of a clip's modalities,
+                ``"or"``, ``"and"`` or ``"weighted"``
+            weights (None): a dict of weights per modality for the
+                ``"weighted"`` operator. By default, modalities are weighted
+                equally
+            rerank (0): the number of candidates to re-score at full
+                precision, if greater than ``k``
+
+        Returns:
+            a tuple of arrays of clip indices and scores
+        """
+        if isinstance(query, dict):
+            queries = {
+                option: np.asarray(q, dtype=np.float32).reshape(1, -1)
+                for option, q in query.items()
+            }
+        else:
+            queries = np.asarray(query, dtype=np.float32).reshape(1, -1)
+
+        inds, scores = self.search_batch(
+            queries,
+            k,
+            options=options,
+            operator=operator,
+            weights=weights,
+            rerank=rerank,
+        )
+        return inds[0], scores[0]
+
+    def search_batch(
+        self,
+        queries,
+        k,
+        options=None,
+        operator="or",
+        weights=None,
+        block_size=2**16,
+        rerank=0,
+    ):
+        """Returns the indices and combined scores of the ``k`` best matching
+        clips for each of the given queries.
+
+        Queries are scored a group at a time, one matrix-matrix product per
+        block of ``block_size`` segments of each modality. The scores of a
+        group are held for every clip, so groups are sized to keep that
+        buffer bounded.
+
+        Args:
+            queries: a ``num_queries x dim`` array of query embeddings, or a
+                dict mapping modalities to such arrays, in which case each
+                modality is scored against its own queries
+            k: the number of clips to return per query
+            options (None): the modalities to score. By default, all are
+                scored, or all that have queries
+            operator ("or"): how to combine the scores of a clip's modalities,
+                ``"or"``, ``"and"`` or ``"weighted"``
+            weights (None): a dict of weights per modality for the
+                ``"weighted"`` operator. By default, modalities are weighted
+                equally
+            block_size (65536): the number of segments to score at a time
+            rerank (0): the number of candidates per query to re-score at
+                full precision, if greater than ``k``
+
+        Returns:
+            a tuple of lists with the arrays of clip indices and scores of
+            each query, sorted by descending score
+        """
+        if isinstance(queries, dict):
+            if options is None:
+                options = self.options
+
+            options = [option for option in options if option in queries]
+
+        cols, weights = self._parse_options(options, weights)
+        queries, num_queries = self._get_queries(queries, cols)
+
+        num_clips = max(len(self) * len(cols), 1)
+        group_size = max(_MULTIMODAL_BUFFER_SIZE // num_clips, 1)
+
+        all_inds = []
+        all_scores = []
+        for start in range(0, num_queries, group_size):
+            stop = min(start + group_size, num_queries)
+            groups = [q[start:stop] for q in queries]
+            scores = np.full((len(self), stop - start, len(cols)), np.nan, np.float32)
+            for c, j in enumerate(cols):
+                row_clips = self._row_clips[j]
+                blocks = self.indexes[j]._iter_score_blocks(groups[c].T, block_size)
+                for offset, block_scores in blocks:
+                    clips = row_clips[offset : offset + len(block_scores)]
+                    scores[clips, :, c] = block_scores
+
+            combined = _combine_modalities(scores, operator, weights)
+            for i, query_scores in enumerate(combined.T):
+                inds, _scores = top_k(query_scores, max(k, rerank))
+                if rerank > k:
+                    _queries = [group[i : i + 1] for group in groups]
+                    _scores = self._score_clips(inds, _queries, cols, True)
+                    _scores = _combine_modalities(_scores[:, 0], operator, weights)
+                    order = np.argsort(-_scores, kind="stable")[:k]
+                    inds, _scores = inds[order], _scores[order]
+
+                keep = np.isfinite(_scores)
+                all_inds.append(inds[keep])
+                all_scores.append(_scores[keep])
+
+        return all_inds, all_scores
+
+    def _parse_options(self, options, weights):
+        if options is None:
+            options = self.options
+
+        cols = [
+            self.options.index(option) for option in options if option in self.options
+        ]
+
+        if weights is None:
+            weights = {}
+
+        weights = np.array(
+            [weights.get(self.options[j], 1.0) for j in cols], dtype=np.float32
+        )
+        return cols, weights
+
+    def _get_queries(self, queries, cols):
+        # Queries are either shared by every modality or given per modality
+        if isinstance(queries, dict):
+            queries = [queries[self.options[j]] for j in cols]
+            num_queries = len(queries[0]) if queries else 0
+        else:
+            num_queries = len(queries)
+            queries = [queries] * len(cols)
+
+        queries = [
+            _normalize(np.asarray(q, dtype=np.float32).reshape(num_queries, -1))
+            for q in queries
+        ]
+        return queries, num_queries
+
+    def _score_clips(self, clip_inds, queries, cols, full_precision):
+        # ``queries`` holds the queries of each column in ``cols``
+        num_queries = len(queries[0]) if queries else 1
+        scores = np.full(
+            (len(clip_inds), num_queries, len(cols)), np.nan, dtype=np.float32
+        )
+        for c, j in enumerate(cols):
+            rows = self.rows[clip_inds, j]
+            valid = rows >= 0
+            scores[valid, :, c] = self.indexes[j].score_rows(
+                rows[valid], queries[c], full_precision=full_precision
+            )
+
+        return scores
+
+
+class HierarchicalIndex(object):
+    """Two-level index that ranks videos by their video-level embeddings, and
+    then scores the segments of only the best matching videos.
+
+    ``index`` is the :class:`SegmentIndex` or :class:`MultimodalIndex` of the
+    segments, and video ``i`` is the sample with ID ``video_ids[i]``. Videos
+    have one video-level embedding per modality of the index, and
+    ``video_embeddings[i, j]`` is the embedding of video ``i`` for modality
+    ``j``, or NaN if the video has no segments of that modality. A
+    :class:`SegmentIndex` has a single modality.
+
+    The scores of a video's modalities are combined in the same way as those
+    of its clips, so a query scores every video but only the segments of the
+    videos it keeps, and its cost grows with the number of videos rather than
+    the number of segments.
+
+    Args:
+        index: a :class:`SegmentIndex` or :class:`MultimodalIndex`
+        video_ids: the sample IDs of the videos
+        video_embeddings: a ``num_videos x num_modalities x dim`` array of
+            video-level embeddings
+    """
+
+    def __init__(self, index, video_ids, video_embeddings):
+        self.index = index
+        self.video_ids = np.asarray(video_ids, dtype=object)
+
+        num_modalities = _num_modalities(index)
+        video_embeddings = np.asarray(video_embeddings, dtype=np.float32)
+        if video_embeddings.size > 0:
+            video_embeddings = video_embeddings.reshape(
+                len(self.video_ids), num_modalities, -1
+            )
+        else:
+            video_embeddings = np.empty(
+                (len(self.video_ids), num_modalities, 0), dtype=np.float32
+            )
+
+        self.video_embeddings = _normalize(video_embeddings)
+
+        # Rows are grouped by video, and rows of videos without a video-level
+        # embedding sort first and are never searched
+        videos = {video_id: i for i, video_id in enumerate(self.video_ids)}
+        row_videos = np.array(
+            [videos.get(_id, -1) for _id in index.sample_ids], dtype=np.int64
+        )
+        self._rows = np.argsort(row_videos, kind="stable")
+        self._offsets = np.searchsorted(
+            row_videos[self._rows], np.arange(len(self.video_ids) + 1)
+        )
+
+    def __len__(self):
+        return len(self.video_ids)
+
+    @classmethod
+    def from_view(cls, view, field, index):
+        """Loads the video-level embeddings of the given view for the given
+        index of its segments.
+
+        Videos whose ``video_embeddings`` were not recorded, such as those
+        embedded before they were, are pooled from their segments in the
+        index.
+        """
+        ids, embeddings, options = view.values(
+            ["id", field + ".video_embeddings", field + ".video_embedding_options"]
+        )
+
+        if isinstance(index, MultimodalIndex):
+            cols = {option: j for j, option in enumerate(index.options)}
+        else:
+            cols = {None: 0}
+
+        indexed = set(index.sample_ids)
+        video_ids = []
+        video_embeddings = []
+        missing = []
+        for _id, _embeddings, _options in zip(ids, embeddings, options):
+            if _id not in indexed:
+                continue
+
+            if isinstance(_embeddings, bytes):
+                _embeddings = fou.deserialize_numpy_array(_embeddings)
+
+            if _embeddings is None or _options is None:
+                missing.append(_id)
+                continue
+
+            _embeddings = np.asarray(_embeddings, dtype=np.float32)
+            keep = [i for i, option in enumerate(_options) if option in cols]
+            if not keep:
+                missing.append(_id)
+                continue
+
+            embedding = np.full(
+                (len(cols), _embeddings.shape[1]), np.nan, dtype=np.float32
+            )
+            embedding[[cols[_options[i]] for i in keep]] = _embeddings[keep]
+            video_ids.append(_id)
+            video_embeddings.append(embedding)
+
+        if missing:
+            video_ids.extend(missing)
+            video_embeddings.extend(_pool_index(index, missing))
+
+        return cls(index, video_ids, video_embeddings)
+
+    def rank_videos(self, query, num_videos, options=None, operator="or", weights=None):
+        """Returns the indices and scores of the ``num_videos`` best matching
+        videos, sorted by descending score.
+
+        Args:
+            query: the query embedding
+            num_videos: the number of videos to return
+            options (None): the modalities to score, for a
+                :class:`MultimodalIndex`
+            operator ("or"): how to combine the scores of a video's
+                modalities, for a :class:`MultimodalIndex`
+            weights (None): a dict of weights per modality for the
+                ``"weighted"`` operator
+
+        Returns:
+            a tuple of arrays of video indices and scores
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = _normalize(np.asarray(query, dtype=np.float32).ravel())
+        if isinstance(self.index, MultimodalIndex):
+            cols, weights = self.index._parse_options(options, weights)
+        else:
+            cols, weights = [0], np.ones(1, dtype=np.float32)
+
+        scores = self.video_embeddings[:, cols] @ query
+        scores = _combine_modalities(scores, operator, weights)
+
+        inds, scores = top_k(scores, num_videos)
+        keep = np.isfinite(scores)
+        return inds[keep], scores[keep]
+
+    def num_segments(self, videos):
+        """Returns the number of segments of the given videos."""
+        rows = self._get_rows(videos)
+        if isinstance(self.index, MultimodalIndex):
+            return int(np.count_nonzero(self.index.rows[rows] >= 0))
+
+        return len(rows)
+
+    def search(
+        self,
+        query,
+        k,
+        num_videos=100,
+        videos=None,
+        rerank=0,
+        options=None,
+        operator="or",
+        weights=None,
+    ):
+        """Returns the indices in :attr:`index` and scores of the ``k`` best
+        matching segments of the best matching videos, sorted by descending
+        score.
+
+        Videos are ranked with the same modalities, operator and weights as
+        their segments.
+
+        Args:
+            query: the query embedding
+            k: the number of segments to return
+            num_videos (100): the number of best matching videos whose
+                segments are scored
+            videos (None): the indices of the videos to score, which take
+                precedence over ``num_videos``
+            rerank (0): the number of candidates to re-score at full
+                precision, if greater than ``k``
+            options (None): the modalities to score, for a
+                :class:`MultimodalIndex`
+            operator ("or"): how to combine the scores of a clip's
+                modalities, for a :class:`MultimodalIndex`
+            weights (None): a dict of weights per modality for the
+                ``"weighted"`` operator
+
+        Returns:
+            a tuple of arrays of indices and scores
+        """
+        query = _normalize(np.asarray(query, dtype=np.float32).ravel())
+        kwargs = dict(options=options, operator=operator, weights=weights)
+
+        if videos is None:
+            videos, _ = self.rank_videos(query, num_videos, **kwargs)
+
+        rows = self._get_rows(videos)
+        inds, scores = top_k(self._score(rows, query, False, **kwargs), max(k, rerank))
+        inds = rows[inds]
+        if rerank > k:
+            scores = self._score(inds, query, True, **kwargs)
+            order = np.argsort(-scores, kind="stable")[:k]
+            inds, scores = inds[order], scores[order]
+
+        keep = np.isfinite(scores)
+        return inds[keep], scores[keep]
+
+    def _get_rows(self, videos):
+        if len(videos) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        rows = [self._rows[self._offsets[i] : self._offsets[i + 1]] for i in videos]
+        return np.sort(np.concatenate(rows))
+
+    def _score(self, rows, query, full_precision, options, operator, weights):
+        queries = query[np.newaxis]
+        if isinstance(self.index, MultimodalIndex):
+            cols, weights = self.index._parse_options(options, weights)
+            queries = [queries] * len(cols)
+            scores = self.index._score_clips(rows, queries, cols, full_precision)
+            return _combine_modalities(scores[:, 0], operator, weights)
+
+        scores = self.index.score_rows(rows, queries, full_precision=full_precision)
+        return scores[:, 0]
+
+
+def pool_embeddings(embeddings):
+    """Returns the video-level embedding pooled from the given segment
+    embeddings of a video, which is the mean of the normalized segment
+    embeddings.
+    """
+    embeddings = _normalize(np.asarray(embeddings, dtype=np.float32))
+    return embeddings.mean(axis=0)
+
+
+def pool_modalities(embeddings, options):
+    """Pools the given segment embeddings of a video separately for each
+    modality, so that modalities are never averaged together.
+
+    Args:
+        embeddings: the segment embeddings
+        options: the modality of each segment, which may be None
+
+    Returns:
+        a tuple of the list of modalities, in order of appearance, and a
+        ``num_modalities x dim`` array of their video-level embeddings
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    options = np.asarray(options, dtype=object)
+    modalities = list(dict.fromkeys(options.tolist()))
+    pooled = [pool_embeddings(embeddings[options == m]) for m in modalities]
+    return modalities, np.stack(pooled)
+
+
+def _num_modalities(index):
+    if isinstance(index, MultimodalIndex):
+        return len(index.indexes)
+
+    return 1
+
+
+def _pool_index(index, sample_ids):
+    # Pools the segments of each modality of the given samples, a block of
+    # rows at a time. Modalities that a sample has no segments of are NaN
+    if isinstance(index, MultimodalIndex):
+        indexes = index.indexes
+    else:
+        indexes = [index]
+
+    videos = {_id: i for i, _id in enumerate(sample_ids)}
+    pooled = None
+    for j, _index in enumerate(indexes):
+        row_videos = np.array(
+            [videos.get(_id, -1) for _id in _index.sample_ids], dtype=np.int64
+        )
+        rows = np.nonzero(row_videos >= 0)[0]
+        sums = None
+        counts = np.zeros(len(sample_ids), dtype=np.float32)
+        for start in range(0, len(rows), _QUANTIZED_BLOCK_SIZE):
+            _rows = rows[start : start + _QUANTIZED_BLOCK_SIZE]
+            embeddings = _normalize(_index.get_embeddings(_rows))
+            if sums is None:
+                sums = np.zeros((len(sample_ids), embeddings.shape[1]), np.float32)
+
+            np.add.at(sums, row_videos[_rows], embeddings)
+            counts += np.bincount(row_videos[_rows], minlength=len(sample_ids))
+
+        if sums is None:
+            continue
+
+        if pooled is None:
+            shape = (len(sample_ids), len(indexes), sums.shape[1])
+            pooled = np.full(shape, np.nan, dtype=np.float32)
+
+        present = counts > 0
+        pooled[present, j] = sums[present] / counts[present, np.newaxis]
+
+    if pooled is None:
+        return np.empty((len(sample_ids), len(indexes), 0), dtype=np.float32)
+
+    return pooled
+
+
+def _combine_modalities(scores, operator, weights):
+    # Scores are ``... x num_modalities`` with NaN for missing modalities, and
+    # clips that do not match are given a score of -inf
+    present = ~np.isnan(scores)
+    if scores.shape[-1] == 0:
+        combined = np.full(scores.shape[:-1], -np.inf)
+    elif operator == "or":
+        combined = np.max(np.where(present, scores, -np.inf), axis=-1)
+    elif operator == "and":
+        combined = np.min(np.where(present, scores, np.inf), axis=-1)
+        combined[~np.all(present, axis=-1)] = -np.inf
+    elif operator == "weighted":
+        weights = np.where(present, weights, 0)
+        total = np.sum(weights, axis=-1)
+        combined = np.sum(np.where(present, scores, 0) * weights, axis=-1)
+        combined = np.where(
+            total > 0, combined / np.where(total > 0, total, 1), -np.inf
+        )
+    else:
+        raise ValueError("Unsupported operator '%s'" % operator)
+
+    return combined.astype(np.float32)
+
+
+def top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+
+    if k < len(scores):
+        inds = np.argpartition(-scores, k - 1)[:k]
+    else:
+        inds = np.arange(len(scores))
+
+    inds = inds[np.argsort(-scores[inds], kind="stable")]
+    return inds, scores[inds]
+
+
+def _common_dtype(rows):
+    # int8 codes are exact in float16, and every row is normalized separately,
+    # so quantized rows of either precision can share a float16 matrix
+    dtypes = {getattr(row, "dtype", np.dtype(np.float32)) for row in rows}
+    if dtypes <= {np.dtype(np.int8)}:
+        return np.int8
+
+    if dtypes <= {np.dtype(np.int8), np.dtype(np.float16)}:
+        return np.float16
+
+    return np.float32
+
+
+def _quantized_norms(embeddings):
+    norms = np.empty(len(embeddings), dtype=np.float32)
+    for i in range(0, len(embeddings), _QUANTIZED_BLOCK_SIZE):
+        block = embeddings[i : i + _QUANTIZED_BLOCK_SIZE].astype(np.float32)
+        norms[i : i + _QUANTIZED_BLOCK_SIZE] = np.linalg.norm(block, axis=1)
+
+    norms[norms == 0] = 1
+    return norms
+
+
+def _normalize(embeddings):
+    if embeddings.size == 0:
+        return embeddings
+
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return embeddings / norms
+
+
+# Loaded indexes are kept least-recently-used first, up to a total size of
+# ``TL_INDEX_CACHE_MAX_GB`` gigabytes
+_INDEX_CACHE = OrderedDict()
+_INDEX_CACHE_LOCK = threading.Lock()
+_INDEX_CACHE_MAX_BYTES = int(float(os.environ.get("TL_INDEX_CACHE_MAX_GB", 8)) * 2**30)
+
+# Loaded indexes are versioned on a token per embeddings field that is
+# changed whenever the field is written, so that writes to other fields of
+# the samples, such as search results, keep them cached
+_INDEX_VERSIONS_STORE = "twelve_labs_segment_indexes"
+
+
+def bump_index_version(dataset, field):
+    """Marks the indexes loaded from the given embeddings field of the
+    dataset as stale, in every process.
+
+    Call this after writing the field.
+    """
+    store = ExecutionStore.create(_INDEX_VERSIONS_STORE, dataset._doc.id)
+    store.set(field, uuid.uuid4().hex)
+
+
+def _get_index_version(dataset, field):
+    store = ExecutionStore.create(_INDEX_VERSIONS_STORE, dataset._doc.id)
+    return store.get(field)
+
+
+def load_segment_index(
+    view, field, store=None, split_modalities=False, hierarchical=False
+):
+    """Loads a :class:`SegmentIndex` for the given view, reusing a previously
+    loaded index if the view has the same samples and the field has not been
+    written since, as recorded by :func:`bump_index_version`.
+
+    If ``split_modalities`` is True and the segments record their modality,
+    a :class:`MultimodalIndex` is loaded instead. If ``hierarchical`` is
+    True, the index is wrapped in a :class:`HierarchicalIndex`.
+    """
+    view = view.view()
+    stages = json.dumps(view._serialize(include_uuids=False), default=str)
+    key = (view._dataset._doc.id, field, stages, split_modalities, hierarchical)
+    version = (len(view), _get_index_version(view._dataset, field))
+
+    with _INDEX_CACHE_LOCK:
+        entry = _INDEX_CACHE.get(key, None)
+        if entry is not None and entry[0] == version:
+            _INDEX_CACHE.move_to_end(key)
+            return entry[1]
+
+    if hierarchical:
+        # The segments are shared with the cached flat index of the view
+        index = load_segment_index(
+            view, field, store=store, split_modalities=split_modalities
+        )
+        index = HierarchicalIndex.from_view(view, field, index)
+    else:
+        index = SegmentIndex.from_view(view, field, store=store)
+        if split_modalities and any(o is not None for o in index.embedding_options):
+            index = MultimodalIndex.from_index(index)
+
+    nbytes = _index_nbytes(index)
+    with _INDEX_CACHE_LOCK:
+        _INDEX_CACHE.pop(key, None)
+        if nbytes <= _INDEX_CACHE_MAX_BYTES:
+            total = sum(e[2] for e in _INDEX_CACHE.values())
+            while _INDEX_CACHE and total + nbytes > _INDEX_CACHE_MAX_BYTES:
+                total -= _INDEX_CACHE.popitem(last=False)[1][2]
+
+            _INDEX_CACHE[key] = (version, index, nbytes)
+
+    return index
+
+
+def _index_nbytes(index):
+    # Approximates the memory held by an index, counting the segments that a
+    # hierarchical index shares with its flat index, which may be evicted first
+    if isinstance(index, HierarchicalIndex):
+        return index.video_embeddings.nbytes + _index_nbytes(index.index)
+
+    if isinstance(index, MultimodalIndex):
+        return index.rows.nbytes + sum(_index_nbytes(i) for i in index.indexes)
+
+    nbytes = 0
+    for value in vars(index).values():
+        if isinstance(value, np.ndarray):
+            nbytes += value.nbytes
+            if value.dtype == object:
+                # The ID strings themselves
+                nbytes += 80 * len(value)
+
+    return nbytes
+
+
+def reciprocal_rank_fusion(rankings, k=60, min_overlap=0.5):
+    """Merges ranked lists of clips with reciprocal rank fusion.
+
+    Each clip scores ``1 / (k + rank)`` in every ranking it appears in. Clips
+    on the same sample whose supports overlap by at least ``min_overlap`` of
+    the shorter support are treated as the same clip, and take the shorter
+    support.
+
+    Args:
+        rankings: a list of rankings, each a list of ``(sample_id, support)``
+            tuples sorted by descending relevance
+        k (60): the rank offset
+        min_overlap (0.5): the minimum overlap for two clips to match
+
+    Returns:
+        a list of ``(sample_id, support, score)`` tuples sorted by descending
+        fused score
+    """
+    clips = []
+    sample_clips = {}
+    for i, ranking in enumerate(rankings):
+        for rank, (sample_id, support) in enumerate(ranking, 1):
+            support = (int(support[0]), int(support[1]))
+            score = 1.0 / (k + rank)
+
+            candidates = sample_clips.setdefault(sample_id, [])
+            for clip in candidates:
+                # A clip takes at most one hit, its best, from each ranking
+                if i not in clip[3] and _overlap(clip[1], support) >= min_overlap:
+                    if _length(support) < _length(clip[1]):
+                        clip[1] = support
+
+                    clip[2] += score
+                    clip[3].add(i)
+                    break
+            else:
+                clip = [sample_id, support, score, {i}]
+                candidates.append(clip)
+                clips.append(clip)
+
+    clips.sort(key=lambda c: c[2], reverse=True)
+    return [(c[0], c[1], c[2]) for c in clips]
+
+
+def _length(support):
+    return support[1] - support[0] + 1
+
+
+def _overlap(a, b):
+    inter = min(a[1], b[1]) - max(a[0], b[0]) + 1
+    return max(inter, 0) / min(_length(a), _length(b))
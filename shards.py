@@ -0,0 +1,346 @@
+import copy
+import hashlib
+import json
+import time
+
+from bson import ObjectId
+from fiftyone.operators.delegated import DelegatedOperationService
+from fiftyone.operators.executor import ExecutionRunState
+
+# Execution store in which the state of sharded runs is kept
+_STORE_NAME = "twelve_labs_shards"
+
+# Parameters that are set per shard or only tune execution, and so do not
+# change which run an operation belongs to
+_RUN_EXCLUDED_PARAMS = {
+    "delegate",
+    "shard_index",
+    "shard_run",
+    "max_concurrent_tasks",
+    "num_workers",
+    "batch_size",
+    "proxy_workers",
+}
+
+
+def get_shard(sample_id, num_shards):
+    """Returns the shard of the sample with the given ID.
+
+    Shards are assigned by hashing sample IDs, so a sample stays in the same
+    shard as other samples are added to or removed from the view.
+    """
+    digest = hashlib.md5(str(sample_id).encode()).hexdigest()
+    return int(digest[:8], 16) % num_shards
+
+
+def select_shard(view, shard_index, num_shards):
+    """Returns the samples of the given view that are in the given shard."""
+    ids = [
+        _id for _id in view.values("id") if get_shard(_id, num_shards) == shard_index
+    ]
+    return view.select(ids, ordered=True)
+
+
+class ShardedRun(object):
+    """A run of an operator whose target view is split into shards that are
+    executed as separate delegated operations.
+
+    The state of the run is kept in an execution store of the dataset, which
+    every delegated worker can reach. The run key is derived from the
+    operator, its target view and its parameters, so running the same
+    operation again resumes the run. Shards that completed on the same
+    samples are skipped, shards that are still queued or running are left
+    alone, and all others, including failed ones, are queued again.
+
+    Each shard records its status, progress and results as it runs. The last
+    shard to finish finalizes the run, exactly once per attempt, by merging
+    the results of every shard into the run's own record.
+    :meth:`schedule` reports when no shard needs to run, so that the caller
+    can finalize the run again.
+
+    Args:
+        store: a :class:`fiftyone.operators.store.ExecutionStore`
+        run_key: the key of the run
+    """
+
+    def __init__(self, store, run_key):
+        self.store = store
+        self.run_key = run_key
+        self._last_progress = {}
+
+    @classmethod
+    def from_context(cls, ctx):
+        """Returns the run of the given operator execution context."""
+        run_key = ctx.params.get("shard_run", None)
+        if run_key is None:
+            params = {
+                k: v for k, v in ctx.params.items() if k not in _RUN_EXCLUDED_PARAMS
+            }
+            view = ctx.view._serialize(include_uuids=False)
+            spec = json.dumps(
+                [ctx.operator_uri, view, ctx.selected, params],
+                sort_keys=True,
+                default=str,
+            )
+            run_key = hashlib.sha1(spec.encode()).hexdigest()[:16]
+
+        return cls(ctx.store(_STORE_NAME), run_key)
+
+    def _shard_key(self, shard_index):
+        return "%s:shard:%d" % (self.run_key, shard_index)
+
+    def _operation_key(self, shard_index):
+        return "%s:operation:%d" % (self.run_key, shard_index)
+
+    def get_info(self):
+        """Returns the record of the run, or None if it has never run."""
+        return self.store.get(self.run_key)
+
+    def get_shard_info(self, shard_index):
+        """Returns the record of the given shard, or None."""
+        return self.store.get(self._shard_key(shard_index))
+
+    def schedule(self, ctx, target_view, num_shards, params=None, label=None):
+        """Queues a delegated operation for every shard of the target view
+        that has not completed.
+
+        Args:
+            ctx: the :class:`fiftyone.operators.ExecutionContext` of the
+                parent operation
+            target_view: the view to split into shards
+            num_shards: the number of shards
+            params (None): extra parameters for every shard's operation
+            label (None): a label for the shard operations
+
+        Returns:
+            a dict describing the shards that were queued, skipped because
+            they completed, or left because they are in progress
+        """
+        info = self.get_info() or {}
+        attempt = info.get("attempt", 0) + 1
+
+        shard_ids = [[] for _ in range(num_shards)]
+        for _id in target_view.values("id"):
+            shard_ids[get_shard(_id, num_shards)].append(_id)
+
+        # The run is recorded before any shard is queued, so that shards that
+        # finish quickly see the attempt they belong to
+        self.store.set(
+            self.run_key,
+            {
+                "operator": ctx.operator_uri,
+                "num_shards": num_shards,
+                "num_samples": sum(len(ids) for ids in shard_ids),
+                "attempt": attempt,
+                "status": "running",
+                "result": None,
+                "updated_at": time.time(),
+            },
+        )
+
+        queued = []
+        completed = []
+        in_progress = []
+        service = DelegatedOperationService()
+        for shard_index, ids in enumerate(shard_ids):
+            digest = hashlib.sha1(",".join(sorted(ids)).encode()).hexdigest()
+            shard = self.get_shard_info(shard_index) or {}
+
+            if shard.get("digest", None) == digest:
+                if shard.get("status", None) == "completed":
+                    completed.append(shard_index)
+                    continue
+
+                operation_id = self.store.get(self._operation_key(shard_index))
+                if _is_active(service, operation_id):
+                    in_progress.append(shard_index)
+                    continue
+
+            self.store.set(
+                self._shard_key(shard_index),
+                {
+                    "status": "queued" if ids else "completed",
+                    "digest": digest,
+                    "num_samples": len(ids),
+                    "done": 0,
+                    "attempt": attempt,
+                    "result": None if ids else {},
+                    "error": None,
+                },
+            )
+
+            if not ids:
+                completed.append(shard_index)
+                continue
+
+            shard_params = dict(params or {})
+            shard_params.update(
+                shard_index=shard_index, num_shards=num_shards, shard_run=self.run_key
+            )
+            op = _queue_shard(
+                service,
+                ctx,
+                shard_params,
+                "%s (shard %d/%d)"
+                % (label or ctx.operator_uri, shard_index + 1, num_shards),
+            )
+            self.store.set(self._operation_key(shard_index), str(op.id))
+            queued.append(shard_index)
+
+        return {
+            "run_key": self.run_key,
+            "num_shards": num_shards,
+            "queued": queued,
+            "completed": completed,
+            "in_progress": in_progress,
+        }
+
+    def start(self, shard_index):
+        """Marks the given shard as running."""
+        self._update(shard_index, status="running", error=None)
+
+    def set_progress(self, shard_index, done, total, min_interval=5.0):
+        """Records the progress of the given shard at most once every
+        ``min_interval`` seconds.
+        """
+        now = time.monotonic()
+        last = self._last_progress.get(shard_index, 0.0)
+        if done < total and now - last < min_interval:
+            return
+
+        self._last_progress[shard_index] = now
+        self._update(shard_index, done=done)
+
+    def complete(self, shard_index, result=None, error=None):
+        """Records the outcome of the given shard.
+
+        A shard fails if ``error`` is provided or if any of its samples
+        failed, so that running the operation again retries it.
+
+        Returns:
+            True if every shard has now finished and the caller must finalize
+            the run, and False otherwise
+        """
+        failed = error is not None or bool((result or {}).get("failures", None))
+        self._update(
+            shard_index,
+            status="failed" if failed else "completed",
+            result=result,
+            error=error,
+        )
+
+        info = self.get_info()
+        if info is None:
+            return False
+
+        for i in range(info["num_shards"]):
+            shard = self.get_shard_info(i)
+            if shard is None or shard["status"] not in ("completed", "failed"):
+                return False
+
+        # Several shards may finish at once, so the run is claimed atomically
+        claim = "%s:finalized:%d" % (self.run_key, info["attempt"])
+        return self.store.set_if_absent(claim, True)
+
+    def finalize(self, extra=None):
+        """Merges the results of every shard into the run's record.
+
+        Numeric results are summed, dict results are merged recursively, and
+        other results are taken from the last shard that has them.
+
+        Args:
+            extra (None): an optional dict of results to add to the merged
+                results
+
+        Returns:
+            the merged results
+        """
+        info = self.get_info()
+        merged = {}
+        failed_shards = []
+        for i in range(info["num_shards"]):
+            shard = self.get_shard_info(i)
+            if shard["status"] == "failed":
+                failed_shards.append(i)
+
+            _merge_results(merged, shard.get("result", None) or {})
+
+        merged.update(extra or {})
+        merged["failed_shards"] = failed_shards
+
+        info.update(
+            status="failed" if failed_shards else "completed",
+            result=merged,
+            updated_at=time.time(),
+        )
+        self.store.set(self.run_key, info)
+        return merged
+
+    def summary(self):
+        """Returns a dict summarizing the progress of the run, or None if it
+        has never run.
+        """
+        info = self.get_info()
+        if info is None:
+            return None
+
+        counts = {}
+        done = 0
+        for i in range(info["num_shards"]):
+            shard = self.get_shard_info(i) or {"status": "queued", "done": 0}
+            counts[shard["status"]] = counts.get(shard["status"], 0) + 1
+            if shard["status"] in ("completed", "failed"):
+                done += shard.get("num_samples", 0)
+            else:
+                done += shard.get("done", 0)
+
+        return {
+            "status": info["status"],
+            "num_shards": info["num_shards"],
+            "shards": counts,
+            "done": done,
+            "total": info["num_samples"],
+        }
+
+    def _update(self, shard_index, **kwargs):
+        # Each shard's record is only written by its own operation, so a
+        # read-modify-write is safe
+        key = self._shard_key(shard_index)
+        shard = self.store.get(key) or {}
+        shard.update(kwargs)
+        self.store.set(key, shard)
+
+
+def _merge_results(merged, result):
+    for key, value in result.items():
+        if isinstance(value, dict):
+            _merge_results(merged.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            merged[key] = merged.get(key, 0) + value
+        else:
+            merged[key] = value
+
+
+def _is_active(service, operation_id):
+    if operation_id is None:
+        return False
+
+    try:
+        op = service.get(ObjectId(operation_id))
+    except Exception:
+        return False
+
+    return op is not None and op.run_state not in ExecutionRunState.TERMINAL_STATES
+
+
+def _queue_shard(service, ctx, params, label):
+    request_params = copy.deepcopy(ctx.request_params)
+    request_params["params"] = dict(ctx.params, **params)
+    request_params["delegated"] = True
+
+    return service.queue_operation(
+        operator=ctx.operator_uri,
+        label=label,
+        delegation_target=ctx.delegation_target,
+        context={"request_params": request_params},
+    )
@@ -0,0 +1,226 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("sample_id", "S24"),
+        ("segment", "<i4"),
+        ("start", "<f8"),
+        ("end", "<f8"),
+        ("norm", "<f4"),
+    ]
+)
+
+
+class SegmentStore(object):
+    """Append-only on-disk store of segment embeddings.
+
+    Embeddings are written as raw float32 rows into fixed-size shard files,
+    and every row has a record in ``index.bin`` describing the sample and
+    segment it belongs to. Rows are addressed by their global row number,
+    which is what temporal detections store in their ``embedding_ref``
+    attribute.
+
+    Shards are read through ``np.memmap``, so opening a store is instant and
+    the pages are shared by all processes reading the same store.
+    """
+
+    def __init__(self, store_dir, dim=None, rows_per_shard=2**18):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+
+        meta_path = os.path.join(store_dir, "meta.json")
+        if os.path.isfile(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        else:
+            meta = {"dim": dim, "rows_per_shard": rows_per_shard}
+            if dim is not None:
+                self._write_meta(meta)
+
+        self.dim = meta["dim"]
+        self.rows_per_shard = meta["rows_per_shard"]
+
+        self._lock = threading.Lock()
+        self._shards = {}
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.store_dir, "index.bin")
+
+    def _shard_path(self, shard):
+        return os.path.join(self.store_dir, "shard_%05d.f32" % shard)
+
+    def _write_meta(self, meta):
+        with open(os.path.join(self.store_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+    def __len__(self):
+        if not os.path.isfile(self._index_path):
+            return 0
+
+        return os.path.getsize(self._index_path) // INDEX_DTYPE.itemsize
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock:
+            with open(os.path.join(self.store_dir, ".lock"), "w") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+    def append(self, sample_id, segments):
+        """Appends the given segments of a sample to the store.
+
+        Args:
+            sample_id: the ID of the sample
+            segments: a list of objects with ``start_offset_sec``,
+                ``end_offset_sec`` and ``embeddings_float`` attributes
+
+        Returns:
+            the list of global row numbers of the appended segments
+        """
+        if not segments:
+            return []
+
+        embeddings = np.array([s.embeddings_float for s in segments], dtype=np.float32)
+
+        records = np.zeros(len(segments), dtype=INDEX_DTYPE)
+        records["sample_id"] = str(sample_id)
+        records["segment"] = np.arange(len(segments))
+        records["start"] = [s.start_offset_sec for s in segments]
+        records["end"] = [s.end_offset_sec for s in segments]
+        records["norm"] = np.linalg.norm(embeddings, axis=1)
+
+        with self._write_lock():
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+                self._write_meta(
+                    {"dim": self.dim, "rows_per_shard": self.rows_per_shard}
+                )
+
+            # The index is the commit log: rows are only visible once their
+            # records are appended, so a partially written shard is simply
+            # overwritten by the next append
+            start = len(self)
+            row = start
+            while row < start + len(segments):
+                shard, offset = divmod(row, self.rows_per_shard)
+                count = min(self.rows_per_shard - offset, start + len(segments) - row)
+                path = self._shard_path(shard)
+                with open(path, "r+b" if os.path.isfile(path) else "wb") as f:
+                    f.seek(offset * self.dim * 4)
+                    chunk = embeddings[row - start : row - start + count]
+                    f.write(chunk.tobytes())
+
+                row += count
+
+            with open(self._index_path, "ab") as f:
+                f.write(records.tobytes())
+
+        return list(range(start, start + len(segments)))
+
+    def compact(self, rows):
+        """Rewrites the store with only the given rows, dropping all others,
+        such as those of re-embedded videos that nothing references anymore.
+
+        The rows keep their relative order. New shard and index files are
+        written aside and then moved into place, so readers should not use
+        the store until the callers' references have been remapped.
+
+        Args:
+            rows: the global row numbers to keep
+
+        Returns:
+            an array mapping every old row number to its new row number, or
+            -1 if the row was dropped
+        """
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+
+        with self._write_lock():
+            total = len(self)
+            rows = rows[(rows >= 0) & (rows < total)]
+            remap = np.full(total, -1, dtype=np.int64)
+            remap[rows] = np.arange(len(rows))
+
+            records = np.array(self.records()[rows])
+            paths = []
+            for start in range(0, len(rows), self.rows_per_shard):
+                path = self._shard_path(start // self.rows_per_shard)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(
+                        self.get(rows[start : start + self.rows_per_shard]).tobytes()
+                    )
+
+                paths.append(path)
+
+            with open(self._index_path + ".tmp", "wb") as f:
+                f.write(records.tobytes())
+
+            self._shards.clear()
+            for path in paths:
+                os.replace(path + ".tmp", path)
+
+            num_shards = -(-total // self.rows_per_shard)
+            for shard in range(len(paths), num_shards):
+                path = self._shard_path(shard)
+                if os.path.isfile(path):
+                    os.remove(path)
+
+            os.replace(self._index_path + ".tmp", self._index_path)
+
+        return remap
+
+    def records(self):
+        """Returns a read-only memory map of the index records."""
+        n = len(self)
+        if n == 0:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+
+        return np.memmap(self._index_path, dtype=INDEX_DTYPE, mode="r", shape=(n,))
+
+    def _get_shard(self, shard, num_rows):
+        mm = self._shards.get(shard, None)
+        if mm is None or len(mm) < num_rows:
+            mm = np.memmap(
+                self._shard_path(shard),
+                dtype=np.float32,
+                mode="r",
+                shape=(num_rows, self.dim),
+            )
+            self._shards[shard] = mm
+
+        return mm[:num_rows]
+
+    def get(self, rows):
+        """Returns the float32 embeddings of the given global rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows), self.dim or 0), dtype=np.float32)
+        if len(rows) == 0:
+            return out
+
+        total = len(self)
+        shards, offsets = np.divmod(rows, self.rows_per_shard)
+        for shard in np.unique(shards):
+            mask = shards == shard
+            num_rows = min(self.rows_per_shard, total - shard * self.rows_per_shard)
+            out[mask] = self._get_shard(shard, num_rows)[offsets[mask]]
+
+        return out
+
+    def norms(self):
+        return np.asarray(self.records()["norm"])
@@ -0,0 +1,185 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskFailedError(RuntimeError):
+    pass
+
+
+class TaskTracker(object):
+    """Runs Twelve Labs tasks through submit, poll and complete stages.
+
+    Up to ``max_in_flight`` items are submitted at once. The status of every
+    outstanding task is polled from a single asyncio loop, with a per-task
+    interval that starts at ``min_interval`` and grows by ``backoff`` after
+    every poll up to ``max_interval``, so short videos are picked up quickly
+    while long ones are polled rarely. Blocking API calls run on a shared
+    thread pool.
+
+    Args:
+        submit: a function ``submit(item)`` that starts the task for an item
+            and returns its task ID, or None if the item needs no remote task
+        status: a function ``status(task_id)`` that returns the task's status
+            string
+        complete: a function ``complete(item, task_id)`` that returns the
+            result of a finished item. It is also called with
+            ``task_id=None`` for items that needed no remote task
+        on_result: a function ``on_result(item, result, error)`` called on the
+            loop's thread as each item finishes. Exactly one of ``result`` and
+            ``error`` is not None. If it raises while handling a result, it is
+            called again with the exception as the item's error
+        on_submit (None): an optional function ``on_submit(item, task_id)``
+            called on the loop's thread after each task is created
+        on_progress (None): an optional function ``on_progress(done, total)``
+        max_in_flight (4): the maximum number of outstanding items
+        min_interval (2): the initial polling interval, in seconds
+        max_interval (30): the maximum polling interval, in seconds
+        backoff (1.5): the factor by which the interval grows after each poll
+        max_poll_errors (5): the number of consecutive failed status requests
+            after which a task is considered failed
+        metrics (None): an optional :class:`Metrics` that records the time
+            tasks spend processing on the server and the number of polls
+    """
+
+    def __init__(
+        self,
+        submit,
+        status,
+        complete,
+        on_result,
+        on_submit=None,
+        on_progress=None,
+        max_in_flight=4,
+        min_interval=2.0,
+        max_interval=30.0,
+        backoff=1.5,
+        max_poll_errors=5,
+        metrics=None,
+    ):
+        self.submit = submit
+        self.status = status
+        self.complete = complete
+        self.on_result = on_result
+        self.on_submit = on_submit
+        self.on_progress = on_progress
+        self.max_in_flight = max_in_flight
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_poll_errors = max_poll_errors
+        self.metrics = metrics
+
+    def run(self, items):
+        """Processes the given items and blocks until all are finished.
+
+        Returns:
+            a tuple of ``(num_succeeded, num_failed)``
+        """
+        items = list(items)
+        with ThreadPoolExecutor(max_workers=2 * self.max_in_flight) as executor:
+            return asyncio.run(self._run(items, executor))
+
+    async def _run(self, items, executor):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        counts = {"done": 0, "failed": 0}
+        total = len(items)
+
+        def _call(fn, *args):
+            return loop.run_in_executor(executor, fn, *args)
+
+        async def _process(item):
+            async with semaphore:
+                try:
+                    task_id = await _call(self.submit, item)
+                    if task_id is not None:
+                        if self.on_submit is not None:
+                            self.on_submit(item, task_id)
+
+                        await self._wait(task_id, _call)
+
+                    result = await _call(self.complete, item, task_id)
+                    error = None
+                except Exception as e:
+                    result = None
+                    error = e
+
+            try:
+                self.on_result(item, result, error)
+            except Exception as e:
+                if error is not None:
+                    raise
+
+                # Only this item fails, rather than the whole run
+                error = e
+                self.on_result(item, None, error)
+
+            if error is None:
+                counts["done"] += 1
+            else:
+                counts["failed"] += 1
+
+            if self.on_progress is not None:
+                self.on_progress(counts["done"] + counts["failed"], total)
+
+        await asyncio.gather(*[_process(item) for item in items])
+
+        return counts["done"], counts["failed"]
+
+    async def _wait(self, task_id, _call):
+        start = time.perf_counter()
+        try:
+            await self._poll(task_id, _call)
+        finally:
+            if self.metrics is not None:
+                self.metrics.add_time("server_wait", time.perf_counter() - start)
+
+    async def _poll(self, task_id, _call):
+        interval = self.min_interval
+        errors = 0
+        while True:
+            await asyncio.sleep(interval)
+            interval = min(interval * self.backoff, self.max_interval)
+
+            if self.metrics is not None:
+                self.metrics.incr("status_polls")
+
+            try:
+                status = await _call(self.status, task_id)
+                errors = 0
+            except Exception:
+                errors += 1
+                if self.metrics is not None:
+                    self.metrics.incr("poll_errors")
+
+                if errors >= self.max_poll_errors:
+                    raise
+
+                continue
+
+            if status == "ready":
+                return
+
+            if status == "failed":
+                raise TaskFailedError(f"Task {task_id} failed")
+
+
+def make_progress_callback(ctx, label, min_interval=1.0):
+    """Returns an ``on_progress`` callback that reports progress via
+    ``ctx.set_progress()`` at most once every ``min_interval`` seconds.
+    """
+    last = [0.0]
+
+    def on_progress(done, total):
+        now = time.monotonic()
+        if done < total and now - last[0] < min_interval:
+            return
+
+        last[0] = now
+        ctx.set_progress(
+            progress=done / total if total else 1.0,
+            label=f"{label} {done}/{total}",
+        )
+
+    return on_progress
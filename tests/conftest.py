@@ -0,0 +1,43 @@
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+# The plugin is loaded by FiftyOne as a package, so mirror that here
+_PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "semantic_video_search" not in sys.modules:
+    _package = types.ModuleType("semantic_video_search")
+    _package.__path__ = [_PLUGIN_DIR]
+    sys.modules["semantic_video_search"] = _package
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(51)
+
+
+def make_segments(rng, num_videos, segments_per_video, dim=64):
+    """Returns the sample IDs, supports and embeddings of random segments,
+    ``segments_per_video`` consecutive ones per video.
+    """
+    n = num_videos * segments_per_video
+    sample_ids = np.array(
+        ["%024x" % (i // segments_per_video) for i in range(n)], dtype=object
+    )
+    starts = 10 * (np.arange(n) % segments_per_video) + 1
+    supports = np.stack([starts, starts + 9], axis=1)
+    embeddings = rng.normal(size=(n, dim)).astype(np.float32)
+    return sample_ids, supports, embeddings
+
+
+def brute_force(embeddings, query, k):
+    """Returns the indices and cosine similarities of the ``k`` best matching
+    embeddings, sorted by descending score.
+    """
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = embeddings @ (query / np.linalg.norm(query))
+    inds = np.argsort(-scores, kind="stable")[:k]
+    return inds, scores[inds]
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from conftest import brute_force, make_segments
+from semantic_video_search.ann import IVFPQIndex, load_index
+from semantic_video_search.cache import CachedSegment
+from semantic_video_search.store import SegmentStore
+
+
+def _build(rng, num_videos=60, segments_per_video=10):
+    sample_ids, supports, embeddings = make_segments(
+        rng, num_videos, segments_per_video
+    )
+
+    # Clustered vectors, like real embeddings, rather than uniform noise
+    centers = rng.normal(size=(16, embeddings.shape[1]))
+    embeddings = centers[rng.integers(0, 16, len(embeddings))] + 0.3 * embeddings
+    index = IVFPQIndex.build(embeddings, sample_ids, supports, nlist=16, m=16)
+    return index, sample_ids, embeddings
+
+
+def _recall(rng, index, embeddings, **kwargs):
+    recalls = []
+    for query in embeddings[rng.choice(len(embeddings), 20, replace=False)]:
+        ids, _ = index.search(query, 10, **kwargs)
+        expected, _ = brute_force(embeddings, query, 10)
+        recalls.append(len(set(ids) & set(expected)) / 10)
+
+    return np.mean(recalls)
+
+
+def test_refined_search_recall_against_brute_force(rng, tmp_path):
+    index, sample_ids, embeddings = _build(rng)
+    store = SegmentStore(str(tmp_path))
+    segments = [CachedSegment(0, 6, e) for e in embeddings]
+    index.refs = np.asarray(store.append(sample_ids[0], segments))
+
+    approximate = _recall(rng, index, embeddings, nprobe=16)
+    refined = _recall(rng, index, embeddings, nprobe=16, store=store)
+
+    # Re-scoring the candidates exactly recovers what quantization loses
+    assert approximate >= 0.5
+    assert refined >= 0.95
+    assert refined >= approximate
+
+
+def test_removed_samples_are_never_returned(rng):
+    index, sample_ids, embeddings = _build(rng)
+    removed = sample_ids[0]
+
+    index.remove_samples([removed])
+    ids, _ = index.search(embeddings[0], 20, nprobe=16)
+
+    assert index.num_deleted == 10
+    assert removed.encode() not in set(index.sample_ids[ids])
+
+
+def test_compact_keeps_results(rng):
+    index, sample_ids, embeddings = _build(rng)
+    index.remove_samples(sample_ids[:50])
+    query = embeddings[100]
+
+    ids, scores = index.search(query, 10, nprobe=16)
+    before = index.sample_ids[ids], index.supports[ids]
+
+    index.compact()
+    ids, compacted_scores = index.search(query, 10, nprobe=16)
+
+    assert index.num_deleted == 0
+    assert len(index) == len(embeddings) - 50
+    np.testing.assert_array_equal(index.sample_ids[ids], before[0])
+    np.testing.assert_array_equal(index.supports[ids], before[1])
+    np.testing.assert_allclose(compacted_scores, scores)
+
+
+def test_load_index_is_cached_until_the_file_changes(rng, tmp_path):
+    index, sample_ids, _ = _build(rng)
+    path = str(tmp_path / "ann.npz")
+    index.save(path)
+
+    loaded = load_index(path)
+    assert load_index(path) is loaded
+    assert len(loaded) == len(index)
+
+    index.remove_samples(sample_ids[:1])
+    index.compact()
+    index.save(path)
+
+    reloaded = load_index(path)
+    assert reloaded is not loaded
+    assert len(reloaded) == len(index)
+
+
+def test_search_is_restricted_to_options(rng, tmp_path):
+    sample_ids, supports, embeddings = make_segments(rng, 20, 10)
+    options = ["visual-text", "audio"] * (len(embeddings) // 2)
+    options[0] = None
+    index = IVFPQIndex.build(
+        embeddings, sample_ids, supports, options=options, nlist=8, m=16
+    )
+    path = str(tmp_path / "ann.npz")
+    index.save(path)
+    index = IVFPQIndex.load(path)
+
+    ids, _ = index.search(embeddings[0], 50, nprobe=8, options=["audio"])
+
+    # Vectors of unknown modality match every option
+    assert len(ids) == 50
+    assert set(index.options[ids]) <= {"audio", ""}
+
+
+def test_build_rejects_zero_embeddings():
+    with pytest.raises(ValueError):
+        IVFPQIndex.build(np.empty((0, 64)), [], np.empty((0, 2)))
@@ -0,0 +1,16 @@
+from semantic_video_search.cache import CachedSegment, EmbeddingCache
+
+
+def test_entries_without_modalities_are_misses(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    segments = [CachedSegment(0.0, 6.0, [1.0, 2.0], "audio")]
+    cache.put("new", segments)
+    cache.put("legacy", segments)
+
+    # Entries cached before segments recorded their modality
+    cache._conn.execute("UPDATE embeddings SET options=NULL WHERE key='legacy'")
+
+    assert cache.get("new") == segments
+    assert cache.get("legacy") is None
+    assert cache.stats() == {"hits": 1, "misses": 1}
+    cache.close()
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import semantic_video_search.chunks as chunks
+from semantic_video_search.cache import CachedSegment
+from semantic_video_search.chunks import (
+    CHUNK_OVERLAP,
+    MAX_CHUNK_DURATION,
+    MAX_VIDEO_DURATION,
+    extract_chunk,
+    plan_chunks,
+    stitch_segments,
+)
+
+
+def test_videos_within_the_limit_are_not_split():
+    assert len(plan_chunks(MAX_VIDEO_DURATION, max_duration=MAX_VIDEO_DURATION)) == 1
+    assert len(plan_chunks(120.0)) == 1
+
+
+@pytest.mark.parametrize("duration", [7001.0, 14000.0, 30000.5])
+def test_chunks_cover_the_video_with_overlaps(duration):
+    chunks = plan_chunks(duration)
+
+    assert chunks[0].start == 0
+    assert chunks[-1].end == duration
+    for chunk in chunks:
+        assert chunk.end - chunk.start <= MAX_CHUNK_DURATION + 1e-6
+
+    for prev, chunk in zip(chunks, chunks[1:]):
+        assert prev.end - chunk.start == pytest.approx(CHUNK_OVERLAP)
+
+
+def _chunk_segments(chunk, length=6.0):
+    # Segments on the chunk's own timeline, as Twelve Labs returns them
+    starts = np.arange(0, chunk.end - chunk.start, length)
+    return [
+        CachedSegment(s, min(s + length, chunk.end - chunk.start), [s], "visual-text")
+        for s in starts
+    ]
+
+
+def test_stitching_drops_duplicates_from_overlaps():
+    chunks = plan_chunks(200.0, max_duration=110.0, overlap=20.0)
+    assert len(chunks) == 2
+
+    segments = stitch_segments(chunks, [_chunk_segments(c) for c in chunks])
+    starts = [s.start_offset_sec for s in segments]
+
+    # Segments are on the source timeline, sorted, and each overlap is split
+    # at its midpoint, so no two segments start within the same window
+    assert starts == sorted(starts)
+    assert segments[-1].end_offset_sec == pytest.approx(200.0)
+    midpoint = 0.5 * (chunks[1].start + chunks[0].end)
+    assert all(s < midpoint for s in starts if s < chunks[1].start)
+    assert all(b - a >= 1.0 for a, b in zip(starts, starts[1:]))
+    assert all(s.embedding_option == "visual-text" for s in segments)
+
+
+def test_stitching_shifts_offsets_by_chunk_start():
+    chunks = plan_chunks(200.0, max_duration=110.0, overlap=20.0)
+    segments = stitch_segments(chunks, [_chunk_segments(c) for c in chunks])
+
+    second = [s for s in segments if s.start_offset_sec >= chunks[1].start + 10]
+    for segment in second:
+        local_start = segment.embeddings_float[0]
+        assert segment.start_offset_sec == pytest.approx(local_start + chunks[1].start)
+
+
+def test_chunks_of_videos_with_the_same_name_do_not_collide(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunks.fouv, "extract_clip", lambda *args, **kwargs: None)
+    chunk = plan_chunks(20000.0)[1]
+
+    path1 = extract_chunk("/a/video.mp4", chunk, str(tmp_path), "a" * 24)
+    path2 = extract_chunk("/b/video.mp4", chunk, str(tmp_path), "b" * 24)
+
+    assert path1 != path2
+    assert path1.endswith(".mp4")
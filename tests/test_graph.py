@@ -0,0 +1,41 @@
+import numpy as np
+
+from conftest import make_segments
+from semantic_video_search.graph import KNNGraph, cluster_pairs
+from semantic_video_search.search import SegmentIndex
+
+
+def test_graph_matches_brute_force(rng):
+    sample_ids, supports, embeddings = make_segments(rng, 10, 10)
+    index = SegmentIndex(sample_ids, supports, embeddings)
+
+    graph = KNNGraph.build(index, 5, query_block_size=16, block_size=32)
+
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = normalized @ normalized.T
+    np.fill_diagonal(scores, -np.inf)
+    expected = np.argsort(-scores, axis=1, kind="stable")[:, :5]
+
+    np.testing.assert_array_equal(graph.neighbors, expected)
+    assert not np.any(graph.neighbors == np.arange(len(index))[:, np.newaxis])
+
+
+def test_duplicates_skip_overlapping_segments_of_a_video(rng):
+    embeddings = rng.normal(size=(4, 16)).astype(np.float32)
+    embeddings[1] = embeddings[0]
+    embeddings[3] = embeddings[2]
+    sample_ids = ["a", "a", "a", "b"]
+    supports = [(1, 10), (5, 15), (20, 30), (1, 10)]
+    index = SegmentIndex(sample_ids, supports, embeddings)
+    graph = KNNGraph.build(index, 2)
+
+    i, j, _ = graph.duplicates(0.99, sample_ids=sample_ids, supports=supports)
+
+    assert list(zip(i, j)) == [(2, 3)]
+
+
+def test_cluster_pairs_links_chains():
+    labels = cluster_pairs(6, np.array([0, 1, 4]), np.array([1, 2, 5]))
+
+    # Clusters are numbered by decreasing size, and singletons are -1
+    np.testing.assert_array_equal(labels, [0, 0, 0, -1, 1, 1])
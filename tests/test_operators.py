@@ -0,0 +1,181 @@
+import functools
+import hashlib
+import importlib.util
+import os
+import sys
+from types import SimpleNamespace
+
+import fiftyone as fo
+from fiftyone.operators.executor import ExecutionContext, Executor
+import numpy as np
+import pytest
+
+from semantic_video_search.tasks import TaskTracker
+
+_NUM_VIDEOS = 4
+_CLIP_LENGTH = 6
+
+
+class _FakeClient(object):
+    """Stands in for the Twelve Labs client, embedding every video as
+    consecutive clips with one random embedding per modality.
+    """
+
+    def __init__(self, dim=64):
+        self.dim = dim
+        self.num_tasks = 0
+        self.text_embedding = None
+        self.embed = SimpleNamespace(
+            create=self._embed_text,
+            task=SimpleNamespace(
+                create=self._create_task,
+                status=lambda task_id: SimpleNamespace(status="ready"),
+                retrieve=self._retrieve,
+            ),
+        )
+        self._videos = {}
+
+    def embedding(self, video_path, index, option):
+        key = "%s:%d:%s" % (video_path, index, option)
+        seed = int(hashlib.sha1(key.encode()).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).normal(size=self.dim).tolist()
+
+    def _create_task(self, model_name, video_file):
+        task_id = "task-%d" % self.num_tasks
+        self.num_tasks += 1
+        self._videos[task_id] = video_file
+        return SimpleNamespace(id=task_id)
+
+    def _retrieve(self, task_id, embedding_option=None):
+        video_path = self._videos[task_id]
+        segments = [
+            SimpleNamespace(
+                start_offset_sec=float(_CLIP_LENGTH * i),
+                end_offset_sec=float(_CLIP_LENGTH * (i + 1)),
+                embeddings_float=self.embedding(video_path, i, option),
+                embedding_option=option,
+            )
+            for i in range(3)
+            for option in embedding_option
+        ]
+        return SimpleNamespace(video_embedding=SimpleNamespace(segments=segments))
+
+    def _embed_text(self, model_name, text):
+        segment = SimpleNamespace(embeddings_float=self.text_embedding)
+        return SimpleNamespace(text_embedding=SimpleNamespace(segments=[segment]))
+
+
+@pytest.fixture(scope="module")
+def plugin():
+    # conftest only registers the package, so its operators are loaded here
+    package = sys.modules["semantic_video_search"]
+    if not hasattr(package, "CreateTwelveLabsEmbeddings"):
+        package.__package__ = package.__name__
+        spec = importlib.util.spec_from_file_location(
+            package.__name__,
+            os.path.join(package.__path__[0], "__init__.py"),
+            submodule_search_locations=package.__path__,
+        )
+        spec.loader.exec_module(package)
+
+    return package
+
+
+@pytest.fixture
+def client(plugin, monkeypatch, tmp_path):
+    monkeypatch.setenv("TL_API_KEY", "fake")
+    monkeypatch.setenv("TL_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("TL_STORE_DIR", str(tmp_path / "store"))
+
+    client = _FakeClient()
+    monkeypatch.setattr(plugin, "get_client", lambda *args, **kwargs: client)
+    monkeypatch.setattr(
+        plugin, "TaskTracker", functools.partial(TaskTracker, min_interval=0.0)
+    )
+    return client
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    samples = []
+    for i in range(_NUM_VIDEOS):
+        filepath = str(tmp_path / ("video%d.mp4" % i))
+        with open(filepath, "wb") as f:
+            f.write(b"%d" % i)
+
+        samples.append(
+            fo.Sample(
+                filepath=filepath,
+                metadata=fo.VideoMetadata(
+                    frame_rate=30, total_frame_count=540, duration=18.0
+                ),
+            )
+        )
+
+    dataset = fo.Dataset()
+    dataset.add_samples(samples)
+    yield dataset
+    dataset.delete()
+
+
+def _execute(operator, dataset, params):
+    ctx = ExecutionContext(
+        request_params={"dataset_name": dataset.name, "params": params},
+        executor=Executor(),
+        operator_uri="@danielgural/semantic_video_search/" + operator.config.name,
+        required_secrets=["TL_API_KEY"],
+    )
+    return operator.execute(ctx)
+
+
+def test_embed_operator_stores_segments_of_each_modality(plugin, client, dataset):
+    results = _execute(plugin.CreateTwelveLabsEmbeddings(), dataset, {})
+
+    assert results["num_embedded"] == _NUM_VIDEOS
+    assert client.num_tasks == _NUM_VIDEOS
+
+    options = dataset.values(plugin._EMBEDDINGS_FIELD + ".detections.embedding_option")
+    for _options in options:
+        assert sorted(_options) == ["audio"] * 3 + ["visual-text"] * 3
+
+    # Unchanged videos are served from the embedding cache
+    results = _execute(plugin.CreateTwelveLabsEmbeddings(), dataset, {})
+
+    assert results["cache"]["hits"] == _NUM_VIDEOS
+    assert client.num_tasks == _NUM_VIDEOS
+
+
+@pytest.mark.parametrize("search_method", ["EXACT", "HIERARCHICAL", "APPROXIMATE"])
+@pytest.mark.parametrize("option", ["visual-text", "audio"])
+def test_search_operator_finds_the_matching_clip(
+    plugin, client, dataset, search_method, option
+):
+    _execute(plugin.CreateTwelveLabsEmbeddings(), dataset, {})
+
+    sample = dataset.skip(2).first()
+    client.text_embedding = client.embedding(sample.filepath, 1, option)
+
+    # Prompt embeddings are cached per process, so each test has its own
+    _execute(
+        plugin.TwelveLabsSemanticSearch(),
+        dataset,
+        {
+            "prompt": "%s %s" % (sample.filepath, option),
+            "top_k": 5,
+            "search_method": search_method,
+        },
+    )
+
+    matches = [
+        (det.confidence, sample_id, det.support)
+        for sample_id, dets in zip(*dataset.values(["id", "results.detections"]))
+        for det in dets or []
+    ]
+    _, sample_id, support = max(matches)
+
+    expected = fo.TemporalDetection.from_timestamps(
+        [_CLIP_LENGTH, 2 * _CLIP_LENGTH], sample=sample
+    )
+    assert sample_id == sample.id
+    assert support == expected.support
+    assert len(matches) == 5
@@ -0,0 +1,34 @@
+import os
+
+import semantic_video_search.proxies as proxies
+from semantic_video_search.proxies import UploadProxies
+
+
+def _fake_transcode(video_path, output_path, **kwargs):
+    with open(output_path, "wb") as f:
+        f.write(b"\0" * 100)
+
+
+def test_eviction_keeps_proxies_of_the_current_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxies, "transcode_proxy", _fake_transcode)
+
+    videos = []
+    for i in range(3):
+        path = str(tmp_path / ("video%d.mp4" % i))
+        with open(path, "wb") as f:
+            f.write(b"%d" % i * 1000)
+
+        videos.append(path)
+
+    cache_dir = str(tmp_path / "proxies")
+    with UploadProxies(cache_dir, max_size_bytes=150) as old:
+        stale = old.get(videos[0])
+
+    # Proxies from earlier runs are evicted first
+    os.utime(stale, (0, 0))
+
+    with UploadProxies(cache_dir, max_size_bytes=150) as current:
+        paths = [current.get(video) for video in videos[1:]]
+
+    assert not os.path.exists(stale)
+    assert all(os.path.exists(path) for path in paths)
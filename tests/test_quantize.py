@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from semantic_video_search.quantize import quantize
+
+
+def test_int8_reconstructs_within_half_a_step(rng):
+    embeddings = rng.normal(size=(100, 32)).astype(np.float32)
+
+    codes, scales = quantize(embeddings, "INT8")
+
+    assert codes.dtype == np.int8
+    assert np.abs(codes).max() == 127
+    error = np.abs(codes * scales[:, np.newaxis] - embeddings)
+    assert np.all(error <= 0.5 * scales[:, np.newaxis] + 1e-6)
+
+
+def test_int8_handles_zero_vectors():
+    codes, scales = quantize(np.zeros((2, 8)), "INT8")
+
+    assert not np.any(codes)
+    np.testing.assert_array_equal(scales, [1, 1])
+
+
+@pytest.mark.parametrize(
+    "precision,dtype", [("FLOAT32", np.float32), ("FLOAT16", np.float16)]
+)
+def test_float_precisions_need_no_scales(rng, precision, dtype):
+    codes, scales = quantize(rng.normal(size=(4, 8)), precision)
+
+    assert codes.dtype == dtype
+    assert scales is None
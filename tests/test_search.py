@@ -0,0 +1,204 @@
+import numpy as np
+import pytest
+
+from conftest import brute_force, make_segments
+from semantic_video_search.quantize import quantize
+from semantic_video_search.search import (
+    HierarchicalIndex,
+    MultimodalIndex,
+    SegmentIndex,
+    _combine_modalities,
+    _pool_index,
+    pool_modalities,
+    reciprocal_rank_fusion,
+    top_k,
+)
+
+
+def test_top_k_matches_full_sort(rng):
+    scores = rng.normal(size=1000).astype(np.float32)
+    inds, top_scores = top_k(scores, 10)
+
+    expected = np.argsort(-scores)[:10]
+    np.testing.assert_array_equal(inds, expected)
+    np.testing.assert_array_equal(top_scores, scores[expected])
+
+
+def test_top_k_handles_small_inputs():
+    scores = np.array([0.5, 0.9], dtype=np.float32)
+
+    inds, _ = top_k(scores, 5)
+    np.testing.assert_array_equal(inds, [1, 0])
+
+    inds, _ = top_k(scores, 0)
+    assert len(inds) == 0
+
+
+def test_search_matches_brute_force(rng):
+    sample_ids, supports, embeddings = make_segments(rng, 50, 20)
+    index = SegmentIndex(sample_ids, supports, embeddings)
+    query = rng.normal(size=embeddings.shape[1])
+
+    inds, scores = index.search(query, 25)
+    expected_inds, expected_scores = brute_force(embeddings, query, 25)
+
+    np.testing.assert_array_equal(inds, expected_inds)
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+
+
+def test_search_batch_matches_search(rng):
+    sample_ids, supports, embeddings = make_segments(rng, 20, 10)
+    index = SegmentIndex(sample_ids, supports, embeddings)
+    queries = rng.normal(size=(7, embeddings.shape[1]))
+
+    # Small blocks exercise merging the running top-k across blocks
+    all_inds, all_scores = index.search_batch(queries, 5, block_size=16)
+
+    for query, inds, scores in zip(queries, all_inds, all_scores):
+        expected_inds, expected_scores = index.search(query, 5)
+        np.testing.assert_array_equal(inds, expected_inds)
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+
+
+@pytest.mark.parametrize("precision,atol", [("FLOAT16", 1e-3), ("INT8", 2e-2)])
+def test_quantized_scores_within_tolerance(rng, precision, atol):
+    sample_ids, supports, embeddings = make_segments(rng, 20, 10, dim=256)
+    codes, _ = quantize(embeddings, precision)
+    index = SegmentIndex(sample_ids, supports, codes)
+    query = rng.normal(size=embeddings.shape[1])
+
+    scores = index.score(query)
+
+    expected = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    expected = expected @ (query / np.linalg.norm(query))
+    assert np.abs(scores - expected).max() < atol
+
+
+def test_find_matches_overlapping_supports(rng):
+    sample_ids, supports, embeddings = make_segments(rng, 3, 4)
+    index = SegmentIndex(sample_ids, supports, embeddings)
+
+    # Exact supports match only themselves, and others match by overlap
+    np.testing.assert_array_equal(index.find([(sample_ids[0], (11, 20))]), [1])
+    np.testing.assert_array_equal(index.find([(sample_ids[0], (13, 22))]), [1])
+    np.testing.assert_array_equal(index.find([(sample_ids[4], None)]), [4, 5, 6, 7])
+
+
+def _make_multimodal(rng):
+    sample_ids, supports, embeddings = make_segments(rng, 10, 5)
+    visual = SegmentIndex(sample_ids, supports, embeddings)
+
+    # Only the first 6 videos have audio
+    audio = SegmentIndex(
+        sample_ids[:30],
+        supports[:30],
+        rng.normal(size=(30, embeddings.shape[1])).astype(np.float32),
+    )
+    return MultimodalIndex({"visual-text": visual, "audio": audio})
+
+
+@pytest.mark.parametrize("operator", ["or", "and", "weighted"])
+def test_multimodal_combines_modality_scores(rng, operator):
+    index = _make_multimodal(rng)
+    query = rng.normal(size=64)
+    weights = {"visual-text": 2.0, "audio": 1.0}
+
+    inds, scores = index.search(query, len(index), operator=operator, weights=weights)
+
+    per_modality = np.full((len(index), 2), np.nan, dtype=np.float32)
+    for j, _index in enumerate(index.indexes):
+        rows = index.rows[:, j]
+        present = rows >= 0
+        per_modality[present, j] = _index.score(query)[rows[present]]
+
+    _weights = np.array([weights[o] for o in index.options], dtype=np.float32)
+    expected = _combine_modalities(per_modality, operator, _weights)
+    finite = np.isfinite(expected)
+
+    assert len(inds) == np.count_nonzero(finite)
+    np.testing.assert_allclose(scores, expected[inds], atol=1e-5)
+    if operator == "and":
+        # Clips without audio never match every modality
+        assert np.all(index.rows[inds] >= 0)
+
+
+def test_multimodal_accepts_per_modality_queries(rng):
+    index = _make_multimodal(rng)
+    visual_query, audio_query = rng.normal(size=(2, 64))
+
+    inds, scores = index.search({"audio": audio_query}, 5)
+    expected_inds, expected_scores = index.search(audio_query, 5, options=["audio"])
+    np.testing.assert_array_equal(inds, expected_inds)
+    np.testing.assert_allclose(scores, expected_scores)
+
+    query = {"visual-text": visual_query, "audio": audio_query}
+    inds, scores = index.search(query, 5, rerank=20)
+    expected_inds, _ = index.search(query, 5)
+    np.testing.assert_array_equal(inds, expected_inds)
+
+
+def test_hierarchical_search_of_every_video_matches_exact(rng):
+    index = _make_multimodal(rng)
+    video_ids = list(dict.fromkeys(index.sample_ids))
+    hierarchical = HierarchicalIndex(index, video_ids, _pool_index(index, video_ids))
+    query = rng.normal(size=64)
+
+    for operator in ("or", "and"):
+        inds, scores = hierarchical.search(
+            query, 10, num_videos=len(video_ids), operator=operator
+        )
+        expected_inds, expected_scores = index.search(query, 10, operator=operator)
+        np.testing.assert_array_equal(inds, expected_inds)
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+
+
+def test_hierarchical_pools_each_modality(rng):
+    index = _make_multimodal(rng)
+    video_ids = list(dict.fromkeys(index.sample_ids))
+    pooled = _pool_index(index, video_ids)
+
+    # Videos without audio have no audio embedding
+    audio = index.options.index("audio")
+    assert np.all(np.isnan(pooled[6:, audio]))
+    assert not np.any(np.isnan(pooled[:6]))
+
+    embeddings = index.indexes[audio].get_embeddings(np.arange(5))
+    options, expected = pool_modalities(embeddings, ["audio"] * 5)
+    assert options == ["audio"]
+    np.testing.assert_allclose(pooled[0, audio], expected[0], atol=1e-6)
+
+
+def test_rrf_sums_reciprocal_ranks():
+    a = ("a" * 24, (1, 10))
+    b = ("b" * 24, (1, 10))
+    c = ("c" * 24, (1, 10))
+
+    fused = reciprocal_rank_fusion([[a, b], [b, c]], k=60)
+
+    assert [clip[0] for clip in fused] == [b[0], a[0], c[0]]
+    assert fused[0][2] == pytest.approx(1 / 62 + 1 / 61)
+
+
+def test_rrf_ties_keep_first_seen_order():
+    a = ("a" * 24, (1, 10))
+    b = ("b" * 24, (1, 10))
+
+    # Both clips rank first once, so they tie and keep their order
+    fused = reciprocal_rank_fusion([[a], [b]])
+
+    assert [clip[0] for clip in fused] == [a[0], b[0]]
+    assert fused[0][2] == fused[1][2]
+
+
+def test_rrf_merges_overlapping_clips():
+    sample_id = "a" * 24
+
+    fused = reciprocal_rank_fusion(
+        [[(sample_id, (1, 20))], [(sample_id, (5, 15)), (sample_id, (1, 20))]]
+    )
+
+    # The overlapping clips merge into the shorter support, and a clip takes
+    # at most one hit from each ranking
+    assert len(fused) == 2
+    assert fused[0][1] == (5, 15)
+    assert fused[0][2] == pytest.approx(2 / 61)
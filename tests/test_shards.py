@@ -0,0 +1,96 @@
+from semantic_video_search.shards import ShardedRun, get_shard
+
+
+class _MemoryStore(object):
+    # Stands in for an execution store, which every worker shares
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key, None)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def set_if_absent(self, key, value):
+        if key in self.data:
+            return False
+
+        self.data[key] = value
+        return True
+
+
+def _make_run(num_shards, attempt=1):
+    run = ShardedRun(_MemoryStore(), "run")
+    run.store.set(
+        "run",
+        {
+            "num_shards": num_shards,
+            "num_samples": 10 * num_shards,
+            "attempt": attempt,
+            "status": "running",
+        },
+    )
+    for i in range(num_shards):
+        run.store.set(run._shard_key(i), {"status": "queued", "num_samples": 10})
+
+    return run
+
+
+def test_shards_are_stable_and_balanced():
+    ids = ["%024x" % i for i in range(4000)]
+    shards = [get_shard(_id, 4) for _id in ids]
+
+    assert shards == [get_shard(_id, 4) for _id in ids]
+    counts = [shards.count(i) for i in range(4)]
+    assert min(counts) > 800
+
+
+def test_only_the_last_shard_claims_the_run():
+    run = _make_run(3)
+
+    for i in range(3):
+        run.start(i)
+
+    assert run.complete(0, result={"num_embedded": 1}) is False
+    assert run.complete(2, result={"num_embedded": 2}) is False
+    assert run.complete(1, result={"num_embedded": 3}) is True
+
+    # A shard that reports again cannot finalize the same attempt twice
+    assert run.complete(1, result={"num_embedded": 3}) is False
+
+
+def test_each_attempt_is_claimed_once():
+    run = _make_run(1)
+    assert run.complete(0) is True
+
+    info = run.get_info()
+    info["attempt"] += 1
+    run.store.set("run", info)
+    assert run.complete(0) is True
+
+
+def test_finalize_merges_shard_results():
+    run = _make_run(2)
+    run.complete(0, result={"num_embedded": 4, "metrics": {"api_calls": 10}})
+    run.complete(
+        1,
+        result={
+            "num_embedded": 3,
+            "metrics": {"api_calls": 5},
+            "failures": {"abc": "timeout"},
+        },
+    )
+
+    merged = run.finalize(extra={"similarity_index": "key"})
+
+    assert merged["num_embedded"] == 7
+    assert merged["metrics"] == {"api_calls": 15}
+    assert merged["failures"] == {"abc": "timeout"}
+    assert merged["failed_shards"] == [1]
+    assert merged["similarity_index"] == "key"
+    assert run.get_info()["status"] == "failed"
+
+    summary = run.summary()
+    assert summary["shards"] == {"completed": 1, "failed": 1}
+    assert summary["done"] == summary["total"] == 20
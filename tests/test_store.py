@@ -0,0 +1,43 @@
+import numpy as np
+
+from semantic_video_search.cache import CachedSegment
+from semantic_video_search.store import SegmentStore
+
+
+def _segments(rng, n):
+    return [
+        CachedSegment(i, i + 6, rng.normal(size=8).astype(np.float32)) for i in range(n)
+    ]
+
+
+def test_rows_span_shards(rng, tmp_path):
+    store = SegmentStore(str(tmp_path), rows_per_shard=4)
+    segments = _segments(rng, 10)
+
+    rows = store.append("a" * 24, segments)
+
+    assert rows == list(range(10))
+    np.testing.assert_array_equal(
+        store.get([9, 0, 5]),
+        [segments[i].embeddings_float for i in (9, 0, 5)],
+    )
+
+
+def test_compact_keeps_referenced_rows(rng, tmp_path):
+    store = SegmentStore(str(tmp_path), rows_per_shard=4)
+    first = _segments(rng, 6)
+    second = _segments(rng, 6)
+    store.append("a" * 24, first)
+    rows = store.append("a" * 24, second)
+
+    remap = store.compact(rows)
+
+    assert len(store) == 6
+    np.testing.assert_array_equal(remap[:6], -1)
+    np.testing.assert_array_equal(remap[rows], np.arange(6))
+    np.testing.assert_array_equal(
+        store.get(np.arange(6)), [s.embeddings_float for s in second]
+    )
+    np.testing.assert_allclose(
+        store.norms(), np.linalg.norm([s.embeddings_float for s in second], axis=1)
+    )
@@ -0,0 +1,23 @@
+from semantic_video_search.tasks import TaskTracker
+
+
+def test_failure_to_handle_a_result_fails_only_its_item():
+    results = {}
+
+    def on_result(item, result, error):
+        if item == 1 and error is None:
+            raise RuntimeError("bad result")
+
+        results[item] = error
+
+    tracker = TaskTracker(
+        lambda item: "task-%d" % item,
+        lambda task_id: "ready",
+        lambda item, task_id: item,
+        on_result,
+        min_interval=0.0,
+    )
+
+    assert tracker.run(range(4)) == (3, 1)
+    assert isinstance(results.pop(1), RuntimeError)
+    assert results == {0: None, 2: None, 3: None}
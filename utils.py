@@ -0,0 +1,85 @@
+import signal
+import threading
+import time
+from collections import defaultdict
+
+
+class BatchedWriter(object):
+    """Buffers sample field values and writes them in bulk.
+
+    Values are keyed by sample ID and flushed via
+    :meth:`fiftyone.core.collections.SampleCollection.set_values` whenever
+    ``batch_size`` samples are buffered, and when the context exits. Exiting
+    the context always flushes, including when the run is interrupted by an
+    exception, ``KeyboardInterrupt`` or ``SIGTERM``, so completed work is not
+    lost. ``SIGTERM`` is only handled in processes that leave it at its
+    default action, such as delegated operation workers, so handlers that
+    servers install are never replaced.
+
+    If ``metrics`` is provided, the time spent writing is recorded in its
+    ``db_write`` stage.
+
+    Example::
+
+        with BatchedWriter(dataset, batch_size=100) as writer:
+            for sample_id, value in results:
+                writer.set(sample_id, "field", value)
+    """
+
+    def __init__(self, sample_collection, batch_size=100, metrics=None):
+        self.sample_collection = sample_collection
+        self.batch_size = batch_size
+        self.metrics = metrics
+
+        self._buffer = defaultdict(dict)
+        self._sample_ids = set()
+        self._lock = threading.Lock()
+        self._prev_sigterm = None
+
+    def __enter__(self):
+        if (
+            threading.current_thread() is threading.main_thread()
+            and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+        ):
+            self._prev_sigterm = signal.signal(signal.SIGTERM, _raise_exit)
+
+        return self
+
+    def __exit__(self, *args):
+        try:
+            self.flush()
+        finally:
+            if self._prev_sigterm is not None:
+                signal.signal(signal.SIGTERM, self._prev_sigterm)
+                self._prev_sigterm = None
+
+    def set(self, sample_id, field, value):
+        with self._lock:
+            self._buffer[field][sample_id] = value
+            self._sample_ids.add(sample_id)
+            full = len(self._sample_ids) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            buffer = self._buffer
+            sample_ids = self._sample_ids
+            self._buffer = defaultdict(dict)
+            self._sample_ids = set()
+
+            if not buffer:
+                return
+
+            start = time.perf_counter()
+            for field, values in buffer.items():
+                self.sample_collection.set_values(field, values, key_field="id")
+
+            if self.metrics is not None:
+                self.metrics.add_time("db_write", time.perf_counter() - start)
+                self.metrics.incr("samples_written", len(sample_ids))
+
+
+def _raise_exit(signum, frame):
+    raise SystemExit(128 + signum)